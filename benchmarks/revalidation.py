@@ -0,0 +1,79 @@
+"""
+Replays the frontend's repeated calls against a running API and compares what goes over the wire:
+    - identity: no compression, every call downloads the full response.
+    - compressed: Accept-Encoding: br, gzip.
+    - compressed+etag: like a browser cache, the ETag of every URL is sent back as If-None-Match and
+      unchanged responses come back as an empty 304.
+Reports the bytes downloaded and the p50/p95 latency of each mode. Start the API first (with its dataset
+generation listener connected, ETags are only given while the generation is known).
+
+Usage (from the repo root): python benchmarks/revalidation.py [--url http://localhost:8001] [--rounds 20] [--concurrency 8]
+"""
+import time
+import asyncio
+import argparse
+import statistics
+
+from typing import Dict, List
+
+import httpx
+
+# the fields frontend/script.js shows on its cards
+CARD_FIELDS = "BorrowerName,BorrowerAddress,BorrowerCity,BorrowerState,InitialApprovalAmount,ForgivenessAmount"
+
+PATHS = [
+    f"/loans/top-borrowers?fields={CARD_FIELDS}",
+    f"/loans/search/by-borrower?borrower_name=delta%20leasing&fields={CARD_FIELDS}",
+    "/loans/search/by-loan-number?loan_number=9547507704",
+    "/loans?limit=500",
+    "/loans/search/by-date-range?start_date=2020-05-01&end_date=2020-05-31&limit=500",
+]
+
+MODES = {
+    "identity": {"Accept-Encoding": "identity"},
+    "compressed": {"Accept-Encoding": "br, gzip"},
+    "compressed+etag": {"Accept-Encoding": "br, gzip"},
+}
+
+async def client_loop(client: httpx.AsyncClient, mode: str, rounds: int, latencies: List[float], downloaded: List[int]) -> None:
+    etags: Dict[str, str] = {}
+    for _ in range(rounds):
+        for path in PATHS:
+            headers = dict(MODES[mode])
+            if mode == "compressed+etag" and path in etags:
+                headers["If-None-Match"] = etags[path]
+            start = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in (200, 304):
+                raise RuntimeError(f"{path}: HTTP {response.status_code}")
+            downloaded.append(response.num_bytes_downloaded)
+            if "etag" in response.headers:
+                etags[path] = response.headers["etag"]
+
+def percentile(values: List[float], pct: int) -> float:
+    return statistics.quantiles(values, n=100)[pct - 1]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'mode':>16} {'requests':>9} {'MB down':>9} {'KB/request':>11} {'p50 ms':>8} {'p95 ms':>8}")
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        (await client.get("/ready")).raise_for_status()
+        for mode in MODES:
+            latencies, downloaded = [], []
+            await asyncio.gather(*(
+                client_loop(client, mode, args.rounds, latencies, downloaded) for _ in range(args.concurrency)
+            ))
+            total = sum(downloaded)
+            print(
+                f"{mode:>16} {len(latencies):>9} {total / 1e6:>9.2f} {total / len(latencies) / 1e3:>11.1f}"
+                f" {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f}"
+            )
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+Measures what pruning the schema in generate_query's prompt saves, and checks it doesn't cost accuracy:
+    - tokens: the prompt tokens of every question of a fixed set, with the full SCHEMA and with prune_schema.
+    - accuracy: every question comes with the columns a correct query needs, a question whose pruned schema misses
+      one of them is reported (and makes the script exit with 1).
+Counts tokens with tiktoken's gpt-3.5-turbo encoding when it is installed, otherwise estimates 4 characters per token.
+No database or OpenAI calls needed.
+
+Usage (from the repo root): python benchmarks/schema_pruning.py [--verbose]
+"""
+import sys
+import argparse
+import statistics
+
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from machine_learning_application.query_generator import SCHEMA, SCHEMA_COLUMNS, query_messages, relevant_columns
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# question -> the columns a correct query needs (besides the key columns, which are always sent)
+QUESTIONS: List[Tuple[str, List[str]]] = [
+    ("Show me the top 5 states by total forgiveness", ["borrower_state", "forgiveness_amount"]),
+    ("Which lender served Sumter Coatings?", ["servicing_lender_name"]),
+    ("Who originated the most loans?", ["originating_lender"]),
+    ("How many loans were approved in Texas?", ["borrower_state"]),
+    ("What is the average loan amount in Miami, Florida?", ["current_approval_amount", "borrower_city", "borrower_state"]),
+    ("How many loans were approved in May 2020?", ["date_approved"]),
+    ("Which month had the most approvals?", ["date_approved"]),
+    ("What percentage of loans were fully forgiven?", ["forgiveness_amount", "current_approval_amount"]),
+    ("How many loans have not been forgiven yet?", ["forgiveness_amount"]),
+    ("Which industries received the most money?", ["naics_code", "current_approval_amount"]),
+    ("How many jobs were reported by veterans?", ["jobs_reported", "veteran"]),
+    ("How many women owned businesses got loans?", ["gender"]),
+    ("What is the total amount given to nonprofits?", ["non_profit", "current_approval_amount"]),
+    ("How many loans went to rural businesses?", ["rural_urban_indicator"]),
+    ("Which county in Ohio got the most loans?", ["project_county_name", "borrower_state"]),
+    ("What are the loans for Delta Leasing?", []),
+    ("How much was spent on payroll in total?", ["payroll_proceed"]),
+    ("How much of the money went to rent and utilities?", ["rent_proceed", "utilities_proceed"]),
+    ("How many loans were paid in full?", ["loan_status"]),
+    ("What is the most common loan term?", ["term"]),
+    ("Which franchises received loans?", ["franchise_name"]),
+    ("How many loans went to sole proprietorships?", ["business_type"]),
+    ("How many loans went to startups?", ["business_age_description"]),
+    ("What is the average number of employees per loan in California?", ["jobs_reported", "borrower_state"]),
+    ("How many Hispanic owned businesses received loans?", ["ethnicity"]),
+    ("How many loans went to businesses in zip code 29150?", ["borrower_zip"]),
+    ("Which banks serviced the most loans in New York?", ["servicing_lender_name", "borrower_state"]),
+    ("How many loans are in HUBZones?", ["hubzone_indicator"]),
+    ("What is the largest undisbursed amount?", ["undisbursed_amount"]),
+    ("Which congressional district got the most money?", ["cd", "current_approval_amount"]),
+    ("Who is the business with the longest who had their loan status approval take the longest time?", ["loan_status_date", "date_approved"]),
+    ("When was the loan of Sumter Coatings forgiven?", ["forgiveness_date"]),
+    ("Which city has the highest average loan amount?", ["borrower_city", "current_approval_amount"]),
+    ("How many loans were approved per week in April 2020?", ["date_approved"]),
+    ("What is the SBA guaranty percentage of most loans?", ["sba_guaranty_percentage"]),
+]
+
+def token_counter() -> Tuple[str, Callable[[str], int]]:
+    if tiktoken is not None:
+        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        return "tiktoken", lambda text: len(encoding.encode(text))
+    return "estimated, 4 characters per token", lambda text: (len(text) + 3) // 4
+
+def prompt_tokens(count: Callable[[str], int], question: str, table_schema=None) -> int:
+    return sum(count(message["content"]) for message in query_messages(question, table_schema))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verbose", action="store_true", help="print every question")
+    args = parser.parse_args()
+
+    method, count = token_counter()
+    full, pruned, columns, misses = [], [], [], []
+    for question, needed in QUESTIONS:
+        selected = relevant_columns(question)
+        full.append(prompt_tokens(count, question, SCHEMA))
+        pruned.append(prompt_tokens(count, question))
+        columns.append(len(selected if selected is not None else SCHEMA_COLUMNS))
+        missing = [column for column in needed if selected is not None and column not in selected]
+        if missing:
+            misses.append((question, missing))
+        if args.verbose:
+            print(f"{full[-1]:>6} -> {pruned[-1]:>5} tokens, {columns[-1]:>2} columns  {question}{'  MISSING ' + ', '.join(missing) if missing else ''}")
+
+    print(f"prompt tokens ({method}) over {len(QUESTIONS)} questions:")
+    print(f"{'':>8} {'mean':>8} {'median':>8} {'max':>8}")
+    for name, tokens in [("full", full), ("pruned", pruned)]:
+        print(f"{name:>8} {statistics.mean(tokens):>8.0f} {statistics.median(tokens):>8.0f} {max(tokens):>8}")
+    print(f"saved {1 - sum(pruned) / sum(full):.0%} of the prompt tokens, {statistics.mean(columns):.1f} columns sent on average")
+    print(f"accuracy: {len(QUESTIONS) - len(misses)}/{len(QUESTIONS)} questions got every column they need")
+    for question, missing in misses:
+        print(f"  missing {', '.join(missing)}: {question}")
+    sys.exit(1 if misses else 0)
+
+if __name__ == "__main__":
+    main()
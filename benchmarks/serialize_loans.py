@@ -0,0 +1,108 @@
+"""
+Compares the two ways the API can turn loans read from the database into a JSON response:
+    - response_model: what FastAPI does with response_model=List[PPPLoanDataSchema], validate every ORM row
+      (from_attributes) and serialize the models by alias.
+    - orjson: encoding.dumps_loans, build the same objects straight from the rows and encode them with orjson.
+Runs on in-memory PPPLoanData rows, no database needed.
+
+Usage (from the repo root): python benchmarks/serialize_loans.py [--rows 1000 100000] [--repeat 3]
+"""
+import sys
+import time
+import argparse
+import datetime
+
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pydantic import TypeAdapter
+from encoding import dumps_loans
+from models import PPPLoanDataSchema
+from server import PPPLoanData
+from utils import normalize
+
+def make_loans(count: int) -> List[PPPLoanData]:
+    loans = []
+    for i in range(count):
+        borrower_name = f"COMPANY {i} LLC"
+        loans.append(PPPLoanData(
+            loan_number=f"{9500000000 + i}",
+            date_approved=datetime.date(2020, 5, 1) + datetime.timedelta(days=i % 60),
+            borrower_name=borrower_name,
+            borrower_name_normalized=normalize(borrower_name),
+            sba_office_code="0464",
+            processing_method="PPP",
+            borrower_address=f"{i} Main Street",
+            borrower_city="Sumter",
+            borrower_state="SC",
+            borrower_zip="29150",
+            loan_status_date=datetime.date(2020, 12, 18),
+            loan_status="Paid in Full",
+            term=24,
+            sba_guaranty_percentage=100.0,
+            initial_approval_amount=1000.0 + i,
+            current_approval_amount=1000.0 + i,
+            undisbursed_amount=0.0,
+            servicing_lender_location_id="19248",
+            servicing_lender_name="Synovus Bank",
+            servicing_lender_address="1148 Broadway",
+            servicing_lender_city="COLUMBUS",
+            servicing_lender_state="GA",
+            servicing_lender_zip="31901-2429",
+            rural_urban_indicator="U",
+            hubzone_indicator="N",
+            lmi_indicator="N",
+            business_age_description="Existing or more than 2 years old",
+            project_city="Sumter",
+            project_county_name="SUMTER",
+            project_state="SC",
+            project_zip="29150-9662",
+            cd="SC-05",
+            jobs_reported=10 + i % 50,
+            naics_code="325510",
+            race="Unanswered",
+            ethnicity="Unknown/NotStated",
+            gender="Unanswered",
+            veteran="Unanswered",
+            non_profit="",
+            payroll_proceed=1000.0 + i,
+            business_type="Corporation",
+            originating_lender_location_id="19248",
+            originating_lender="Synovus Bank",
+            originating_lender_city="COLUMBUS",
+            originating_lender_state="GA",
+            forgiveness_amount=1000.0 + i,
+            forgiveness_date=datetime.date(2021, 3, 17),
+        ))
+    return loans
+
+response_model = TypeAdapter(List[PPPLoanDataSchema])
+
+def dumps_response_model(loans: List[PPPLoanData]) -> bytes:
+    return response_model.dump_json(response_model.validate_python(loans, from_attributes=True), by_alias=True)
+
+def best_time(serialize: Callable[[List[PPPLoanData]], bytes], loans: List[PPPLoanData], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serialize(loans)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'path':>15} {'seconds':>9} {'rows/sec':>11}")
+    for count in args.rows:
+        loans = make_loans(count)
+        for name, serialize in (("response_model", dumps_response_model), ("orjson", dumps_loans)):
+            seconds = best_time(serialize, loans, args.repeat)
+            print(f"{count:>8} {name:>15} {seconds:>9.3f} {count / seconds:>11,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Load tests a running API to compare serving profiles: requests/sec and latency percentiles under a fixed concurrency.
+Start the API in the profile to measure, then point this script at it, e.g.
+    dev:        python -m uvicorn server:app --port 8001 --reload
+    production: API_PROFILE=production python -m uvicorn server:app --port 8001 --workers 4 --no-access-log
+
+Usage (from the repo root): python benchmarks/serve_profiles.py [--url http://localhost:8001] [--concurrency 32] [--duration 20]
+"""
+import time
+import asyncio
+import argparse
+import statistics
+
+from typing import List
+
+import httpx
+
+PATHS = [
+    "/loans",
+    "/loans/top-borrowers",
+    "/loans/search/by-date-range?start_date=2020-05-01&end_date=2020-05-02",
+]
+
+async def worker(client: httpx.AsyncClient, deadline: float, latencies: List[float], errors: list) -> None:
+    i = 0
+    while time.perf_counter() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+        except httpx.TransportError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+def percentile(values: List[float], pct: float) -> float:
+    return statistics.quantiles(values, n=100)[int(pct) - 1]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        (await client.get("/ready")).raise_for_status()
+        latencies, errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            worker(client, start + args.duration, latencies, errors) for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    print(f"requests: {len(latencies)} in {elapsed:.1f}s, errors: {len(errors)} {sorted(set(map(str, errors)))}")
+    print(f"requests/sec: {len(latencies) / elapsed:,.0f}")
+    print(f"latency ms: p50 {percentile(latencies, 50) * 1000:.1f}, p99 {percentile(latencies, 99) * 1000:.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,188 @@
+import time
+import orjson
+import asyncio
+import logging
+import sqlite3
+import asyncpg
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from sql import DATASET_GENERATION_CHANNEL, DATASET_GENERATION_TABLE
+
+# set up logging
+logger = logging.getLogger(__name__)
+
+# returned by TTLCache.get on a miss, so None can be cached (e.g. a loan number that doesn't exist)
+MISSING = object()
+
+class TTLCache:
+    """Size bounded LRU cache whose entries also expire ttl seconds after they were set.
+
+    Not thread safe, it is meant to be used from a single event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value for key, or MISSING if it was never set, was evicted or has expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at <= self.timer():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Cache value under key for ttl seconds (the cache's TTL by default), evicting the least recently used
+        entries past maxsize."""
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+class PersistentCache:
+    """TTLCache whose entries are also kept in a SQLite table, so they survive restarts and are shared by workers.
+
+    A lookup that misses in memory falls back to the table and keeps what it finds in memory for the rest of its TTL.
+    Keys and values have to be JSON serializable (tuples come back as lists), keys are stored as their JSON.
+    Expiry uses the wall clock, so TTLs keep running while the process is down. The table holds at most maxsize
+    entries, the ones that expire first go. Without a path this is just the in-memory TTLCache.
+
+    SQLite calls block, in WAL mode on a local disk they take well under a millisecond.
+    """
+
+    def __init__(self, path: Optional[str], table: str, maxsize: int, ttl: float, timer: Callable[[], float] = time.time) -> None:
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.memory = TTLCache(maxsize, ttl, timer)
+        self._db: Optional[sqlite3.Connection] = None
+        if path and maxsize > 0:
+            # autocommit, every write is its own transaction
+            self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # WAL makes NORMAL crash safe, a power loss may only lose the latest entries
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value for key, or MISSING if it isn't cached (any more)."""
+        value = self.memory.get(key)
+        if value is not MISSING or self._db is None:
+            return value
+        row = self._db.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (orjson.dumps(key).decode(),)).fetchone()
+        if row is None or row[1] <= self.timer():
+            return MISSING
+        value = orjson.loads(row[0])
+        self.memory.set(key, value, ttl=row[1] - self.timer())
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache value under key, in memory and in the table."""
+        self.memory.set(key, value)
+        if self._db is None:
+            return
+        self._db.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (orjson.dumps(key).decode(), orjson.dumps(value).decode(), self.timer() + self.ttl),
+        )
+        # the expired entries, and whatever expires before the newest maxsize entries
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE expires_at <= max(?, coalesce("
+            f"(SELECT expires_at FROM {self.table} ORDER BY expires_at DESC LIMIT 1 OFFSET ?), 0))",
+            (self.timer(), self.maxsize),
+        )
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+class DatasetGeneration:
+    """Tracks the dataset generation the pipeline bumps (see sql.CreateTempTables.bump_dataset_generation).
+
+    `current` is None whenever it isn't known for sure, i.e. before listen() connected or while the listening
+    connection is down (a bump could be missed), callers must not use the cache then.
+    """
+
+    def __init__(self, dsn: str, retry_delay: float = 5.0) -> None:
+        self.dsn = dsn
+        self.retry_delay = retry_delay
+        self.current: Optional[int] = None
+        # set (and replaced) whenever a generation becomes known, wakes up changed()
+        self._known = asyncio.Event()
+
+    def key(self, *parts: Hashable) -> Optional[Tuple]:
+        """Return a cache key for parts under the current generation, or None when the cache must be bypassed."""
+        if self.current is None:
+            return None
+        return (self.current, *parts)
+
+    def _set_current(self, generation: int) -> None:
+        self.current = generation
+        self._known.set()
+        self._known = asyncio.Event()
+
+    def pin(self, generation: int) -> None:
+        """Fix the generation of a dataset that can't change while it is served (a snapshot), instead of listen()."""
+        self._set_current(generation)
+
+    async def changed(self, generation: Optional[int]) -> int:
+        """Wait until a generation other than `generation` is known and return it, for state rebuilt per generation."""
+        while self.current is None or self.current == generation:
+            await self._known.wait()
+        return self.current
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        self._set_current(int(payload))
+        logger.info(f"Dataset generation is now {self.current}")
+
+    async def listen(self) -> None:
+        """LISTEN for generation bumps until cancelled, reconnecting if the connection drops."""
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                # subscribe before reading so a bump in between isn't missed
+                await connection.add_listener(DATASET_GENERATION_CHANNEL, self._on_notify)
+                self._set_current(await self._fetch_generation(connection))
+                await closed.wait()
+                logger.warning("Lost the dataset generation listener connection, bypassing the cache")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Dataset generation listener unavailable, bypassing the cache: {e}")
+            finally:
+                self.current = None
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(self.retry_delay)
+
+    async def _fetch_generation(self, connection) -> int:
+        # no table yet means the pipeline never ran, anything cached now is bumped away by the first load
+        exists = await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", DATASET_GENERATION_TABLE)
+        if not exists:
+            return 0
+        return await connection.fetchval(f"SELECT coalesce(max(generation), 0) FROM {DATASET_GENERATION_TABLE}")
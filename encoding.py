@@ -0,0 +1,70 @@
+import typing
+import datetime
+import orjson
+
+from typing import Any, Callable, Iterable, List, Mapping, Tuple
+
+from models import PPPLoanDataSchema
+
+MIDNIGHT = datetime.time()
+
+# (attribute, response key) of every schema field, in the order model_dump(by_alias=True) writes them
+LOAN_FIELDS: List[Tuple[str, str]] = [
+    (name, field.alias or name) for name, field in PPPLoanDataSchema.model_fields.items()
+]
+
+# response keys of the datetime fields, the database hands some of them back as plain dates
+LOAN_DATETIME_KEYS: List[str] = [
+    field.alias or name
+    for name, field in PPPLoanDataSchema.model_fields.items()
+    if datetime.datetime in (field.annotation, *typing.get_args(field.annotation))
+]
+
+# the schema's own computed field functions, they only read attributes so they run on ORM rows as well
+LOAN_COMPUTED_FIELDS: List[Tuple[str, Callable[[Any], Any]]] = [
+    (field.alias or name, field.wrapped_property.fget)
+    for name, field in PPPLoanDataSchema.model_computed_fields.items()
+]
+
+def row_values(loan: Any) -> Mapping[str, Any]:
+    """Returns the column values of a loan row by attribute name.
+
+    ORM instances keep their loaded columns in __dict__, reading it directly skips the instrumented attribute
+    lookup per field, which costs more than building the response itself. Core rows expose theirs as _mapping.
+    """
+    mapping = getattr(loan, "_mapping", None)
+    return mapping if mapping is not None else vars(loan)
+
+def loan_to_dict(loan: Any) -> dict:
+    """Builds the response object of a loan read from the database, without validating it again.
+
+    Rows were validated at ingest, so this only reproduces what
+    PPPLoanDataSchema.model_validate(loan).model_dump(by_alias=True) returns, computed fields included.
+
+    Args:
+        loan (Any): A PPPLoanData instance, or any row with the same attributes.
+
+    Returns:
+        dict: The loan keyed by the schema's aliases.
+    """
+    values = row_values(loan)
+    data = {key: values.get(attribute) for attribute, key in LOAN_FIELDS}
+    for key in LOAN_DATETIME_KEYS:
+        value = data[key]
+        if value is not None and not isinstance(value, datetime.datetime):
+            data[key] = datetime.datetime.combine(value, MIDNIGHT)
+    for key, compute in LOAN_COMPUTED_FIELDS:
+        data[key] = compute(loan)
+    return data
+
+def dumps(content: Any) -> bytes:
+    """Encodes already built response content (dicts, lists, datetimes) to JSON bytes."""
+    return orjson.dumps(content)
+
+def dumps_loan(loan: Any) -> bytes:
+    """Encodes a single loan from the database to JSON bytes, see loan_to_dict."""
+    return orjson.dumps(loan_to_dict(loan))
+
+def dumps_loans(loans: Iterable[Any]) -> bytes:
+    """Encodes loans from the database to a JSON array, see loan_to_dict."""
+    return orjson.dumps([loan_to_dict(loan) for loan in loans])
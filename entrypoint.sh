@@ -56,8 +56,21 @@ done
 echo "Postgres is up - starting FastAPI server"
 
 # Launch the FastAPI server
-echo "Starting FastAPI server..."
-python -m uvicorn server:app --host 0.0.0.0 --port 8001 --reload
+# API_PROFILE=production runs API_WORKERS processes (one per CPU by default) without reload or access logs,
+# every worker has its own pool of DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+if [ "${API_PROFILE:-dev}" = "production" ]; then
+    API_WORKERS="${API_WORKERS:-$(nproc)}"
+    # the workers write their metrics to a shared directory so /metrics reports all of them, stale files from a
+    # previous run would be counted too
+    export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/ppp_api_metrics}"
+    rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+    mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+    echo "Starting FastAPI server (production, ${API_WORKERS} workers)..."
+    python -m uvicorn server:app --host 0.0.0.0 --port 8001 --workers "${API_WORKERS}" --no-access-log
+else
+    echo "Starting FastAPI server..."
+    python -m uvicorn server:app --host 0.0.0.0 --port 8001 --reload
+fi
 
 # Keep the container running for debugging or additional processing
 echo "Container is ready. You can now run additional commands or start your application."
@@ -1,5 +1,7 @@
 // API base URL
 const API_BASE_URL = 'http://localhost:8001';
+// the fields createBusinessCard shows, the API only selects and returns these
+const CARD_FIELDS = 'BorrowerName,BorrowerAddress,BorrowerCity,BorrowerState,InitialApprovalAmount,ForgivenessAmount';
 
 // Format currency
 function formatCurrency(amount) {
@@ -81,6 +83,45 @@ function removeLastMessage() {
     }
 }
 
+// Function to replace the text of the last message (the loading message while an answer streams in)
+function updateLastMessage(message) {
+    const chatBody = document.getElementById("chatbot-body");
+    const messages = chatBody.querySelectorAll(".chatbot-message");
+    if (messages.length > 0) {
+        messages[messages.length - 1].textContent = message;
+        chatBody.scrollTop = chatBody.scrollHeight;
+    }
+}
+
+// Function to read server-sent events from a fetch response, calling onEvent(event, data) for each one
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffered += decoder.decode(value, { stream: true });
+        // events are separated by a blank line, the last one may not have fully arrived yet
+        const events = buffered.split('\n\n');
+        buffered = events.pop();
+        for (const block of events) {
+            let event = 'message';
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) {
+                    event = line.slice('event: '.length);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice('data: '.length);
+                }
+            }
+            onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
 // Function to send a message
 async function sendMessage() {
     const input = document.getElementById('chatbot-input');
@@ -102,8 +143,8 @@ async function sendMessage() {
         addMessage("🤔 Thinking...", false);
         
         try {
-            // Make API call to ask-question endpoint
-            const response = await fetch(`${API_BASE_URL}/ask-question`, {
+            // Make API call to the streaming ask-question endpoint, every stage is shown as soon as it completes
+            const response = await fetch(`${API_BASE_URL}/ask-question/stream`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -117,11 +158,23 @@ async function sendMessage() {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
-            const data = await response.json();
-            
-            // Remove loading message and add bot response
-            removeLastMessage(); // Remove the "Thinking..." message
-            addMessage(data.response, false);
+            // the loading message turns into the answer as the summary streams in
+            let answer = '';
+            await readEvents(response, (event, data) => {
+                if (event === 'sql') {
+                    updateLastMessage("🔎 Running the query...");
+                } else if (event === 'rows') {
+                    const count = data.row_count ?? (data.truncated ? `more than ${data.result.length}` : data.result.length);
+                    updateLastMessage(`📊 Found ${count} rows, summarizing...`);
+                } else if (event === 'token') {
+                    answer += data;
+                    updateLastMessage(answer);
+                } else if (event === 'response') {
+                    updateLastMessage(data.response);
+                } else if (event === 'error') {
+                    throw new Error(data.detail);
+                }
+            });
             
         } catch (error) {
             console.error('Error calling API:', error);
@@ -175,7 +228,7 @@ async function searchBusinesses() {
     showLoading('searchResults', 'Searching businesses...');
 
     try {
-        let url = `${API_BASE_URL}/loans/search/by-borrower?borrower_name=${encodeURIComponent(name)}`;
+        let url = `${API_BASE_URL}/loans/search/by-borrower?borrower_name=${encodeURIComponent(name)}&fields=${CARD_FIELDS}`;
         if (state) url += `&borrower_state=${encodeURIComponent(state)}`;
         if (city) url += `&borrower_city=${encodeURIComponent(city)}`;
 
@@ -204,7 +257,7 @@ async function fetchTopBorrowers() {
     showLoading('topBorrowers', 'Loading top borrowers...');
 
     try {
-        const response = await fetch(`${API_BASE_URL}/loans/top-borrowers`);
+        const response = await fetch(`${API_BASE_URL}/loans/top-borrowers?fields=${CARD_FIELDS}`);
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
@@ -235,7 +288,7 @@ async function searchByLoanNumber() {
     showLoading('loanSearchResult', 'Searching loan...');
 
     try {
-        const response = await fetch(`${API_BASE_URL}/loans/search/by-loan-number?loan_number=${encodeURIComponent(loanNumber)}`);
+        const response = await fetch(`${API_BASE_URL}/loans/search/by-loan-number?loan_number=${encodeURIComponent(loanNumber)}&fields=${CARD_FIELDS}`);
         if (!response.ok) {
             if (response.status === 404) {
                 showError('loanSearchResult', 'Loan not found');
@@ -253,6 +306,48 @@ async function searchByLoanNumber() {
     }
 }
 
+// Suggest borrower names as the user types, debounced, a newer keystroke aborts the pending request
+const SUGGEST_DELAY_MS = 150;
+let suggestTimer = null;
+let suggestController = null;
+
+async function suggestBusinessNames(prefix) {
+    const list = document.getElementById('businessNameSuggestions');
+    if (suggestController) {
+        suggestController.abort();
+    }
+    if (prefix.length < 2) {
+        list.innerHTML = '';
+        return;
+    }
+    suggestController = new AbortController();
+    try {
+        const response = await fetch(
+            `${API_BASE_URL}/loans/suggest?q=${encodeURIComponent(prefix)}`,
+            { signal: suggestController.signal }
+        );
+        if (!response.ok) {
+            return;
+        }
+        const suggestions = await response.json();
+        list.innerHTML = '';
+        suggestions.forEach(suggestion => {
+            const option = document.createElement('option');
+            option.value = suggestion.borrower_name;
+            option.label = `${suggestion.loan_count} loan${suggestion.loan_count === 1 ? '' : 's'}`;
+            list.appendChild(option);
+        });
+    } catch (error) {
+        // aborted by a newer keystroke, or suggestions unavailable, the search itself still works
+    }
+}
+
+document.getElementById('businessName').addEventListener('input', function(e) {
+    clearTimeout(suggestTimer);
+    const prefix = this.value.trim();
+    suggestTimer = setTimeout(() => suggestBusinessNames(prefix), SUGGEST_DELAY_MS);
+});
+
 // Add input validation
 document.getElementById('state').addEventListener('input', function(e) {
     this.value = this.value.toUpperCase();
@@ -0,0 +1,242 @@
+import zlib
+import hashlib
+
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+import anyio
+import brotli
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Router
+
+# content encodings the API can compress with, preferred first when the client accepts several equally
+ENCODINGS = ("br", "gzip")
+
+def accepted_encodings(accept_encoding: Optional[str]) -> List[str]:
+    """Returns the encodings of ENCODINGS an Accept-Encoding header allows, most wanted first."""
+    if not accept_encoding:
+        return []
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        params = params.strip()
+        try:
+            weights[coding.strip().lower()] = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weights[coding.strip().lower()] = 0.0
+    default = weights.get("*", 0.0)
+    accepted = [coding for coding in ENCODINGS if weights.get(coding, default) > 0]
+    # stable, so equally wanted encodings keep the ENCODINGS preference
+    return sorted(accepted, key=lambda coding: -weights.get(coding, default))
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Picks the content encoding to compress a response with from an Accept-Encoding header, None for identity."""
+    accepted = accepted_encodings(accept_encoding)
+    return accepted[0] if accepted else None
+
+class ConditionalGetMiddleware:
+    """ASGI middleware that gives the data endpoints strong ETags and answers If-None-Match with 304.
+
+    The responses of the given paths only depend on the loaded dataset and the query, so their ETag is derived from
+    the dataset generation, the path and the sorted query parameters, and can be checked before the request is
+    routed: a matching If-None-Match is answered with 304 without running the endpoint or touching the database.
+    Responses get no ETag while the generation is unknown. The ETag of a compressed response carries its encoding
+    ("<tag>-br", "<tag>-gzip"), the bytes differ so a strong ETag has to as well.
+    """
+
+    def __init__(
+        self,
+        app,
+        router: Router,
+        paths: Collection[str],
+        generation: Callable[[], Optional[int]],
+        version: str,
+    ) -> None:
+        """
+        Args:
+            router (Router): The app's router, to label 304s with their route like routed requests.
+            paths (Collection[str]): The paths (without path parameters) whose responses get ETags.
+            generation (Callable[[], Optional[int]]): Returns the current dataset generation, None when unknown.
+            version (str): Changes the ETags of every path, bump it when response formats change.
+        """
+        self.app = app
+        self.router = router
+        self.paths = frozenset(paths)
+        self.generation = generation
+        self.version = version
+
+    def etag(self, generation: int, scope) -> str:
+        query = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+        # parameter order doesn't change the response, the order of a repeated parameter might
+        query = urlencode(sorted(query, key=lambda item: item[0]))
+        digest = hashlib.blake2b(f"{self.version}\0{scope['path']}\0{query}".encode(), digest_size=12).hexdigest()
+        return f"{generation}-{digest}"
+
+    @staticmethod
+    def matches(if_none_match: str, etag: str, accept_encoding: Optional[str]) -> Optional[str]:
+        """Returns the entity tag of If-None-Match that is still current, if any."""
+        accepted = accepted_encodings(accept_encoding)
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*":
+                return f'"{etag}"'
+            # If-None-Match compares weakly
+            tag = candidate.removeprefix("W/").strip('"')
+            if tag == etag:
+                return candidate
+            base, _, coding = tag.rpartition("-")
+            if base == etag and coding in accepted:
+                return candidate
+        return None
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD") or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        generation = self.generation()
+        if generation is None:
+            await self.app(scope, receive, send)
+            return
+
+        etag = self.etag(generation, scope)
+        headers = Headers(scope=scope)
+        if_none_match = headers.get("if-none-match")
+        matched = self.matches(if_none_match, etag, headers.get("accept-encoding")) if if_none_match else None
+        if matched is not None:
+            # label the response with its route for the metrics, as if it had been routed
+            scope["route"] = next((route for route in self.router.routes if getattr(route, "path", None) == scope["path"]), None)
+            await send({"type": "http.response.start", "status": 304, "headers": [
+                (b"etag", matched.encode("latin-1")),
+                (b"cache-control", b"no-cache"),
+                (b"vary", b"Accept-Encoding"),
+            ]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                response_headers = MutableHeaders(scope=message)
+                coding = response_headers.get("content-encoding")
+                response_headers["etag"] = f'"{etag}-{coding}"' if coding else f'"{etag}"'
+                # browsers keep the response but revalidate it on every use
+                response_headers["cache-control"] = "no-cache"
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+class Encoder:
+    """Incremental gzip or brotli compressor."""
+
+    def __init__(self, coding: str, gzip_level: int, brotli_quality: int) -> None:
+        self.coding = coding
+        if coding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """Compresses a chunk and flushes it, so a streamed response reaches the client chunk by chunk."""
+        if self.coding == "br":
+            return self._brotli.process(data) + (self._brotli.finish() if final else self._brotli.flush())
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class CompressionMiddleware:
+    """ASGI middleware that compresses responses of at least minimum_size bytes with brotli or gzip.
+
+    Bodies over thread_minimum_size are compressed in a worker thread instead of on the event loop.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        thread_minimum_size: int = 256 * 1024,
+        exclude_content_types: Tuple[str, ...] = ("text/event-stream",),
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.thread_minimum_size = thread_minimum_size
+        self.exclude_content_types = exclude_content_types
+
+    def add_vary_header(self, start: dict) -> None:
+        """Marks a response that is compressed for clients that accept it as varying on Accept-Encoding.
+
+        Uncompressed ones get it too (small bodies, clients without a supported coding), or a shared cache could
+        hand them to a client that expects the compressed representation, or the other way around.
+        """
+        headers = MutableHeaders(scope=start)
+        if "content-encoding" not in headers and not headers.get("content-type", "").startswith(self.exclude_content_types):
+            headers.add_vary_header("Accept-Encoding")
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if coding is None or scope["method"] == "HEAD":
+            async def send_identity(message) -> None:
+                if message["type"] == "http.response.start":
+                    self.add_vary_header(message)
+                await send(message)
+
+            await self.app(scope, receive, send_identity)
+            return
+
+        start: Optional[dict] = None
+        encoder: Optional[Encoder] = None
+        passthrough = False
+
+        async def compress(data: bytes, final: bool) -> bytes:
+            if len(data) >= self.thread_minimum_size:
+                return await anyio.to_thread.run_sync(encoder.compress, data, final)
+            return encoder.compress(data, final)
+
+        async def send_compressed(message) -> None:
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                headers = MutableHeaders(scope=start)
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or content_type.startswith(self.exclude_content_types)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    self.add_vary_header(start)
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = Encoder(coding, self.gzip_level, self.brotli_quality)
+                headers["content-encoding"] = coding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    # streamed, the compressed length isn't known up front
+                    del headers["content-length"]
+                    await send(start)
+                else:
+                    body = await compress(body, True)
+                    headers["content-length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+            elif not more_body:
+                await send({"type": "http.response.body", "body": await compress(body, True)})
+                return
+            await send({"type": "http.response.body", "body": await compress(body, False), "more_body": True})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,242 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from sql import LOAN_TABLE
+from utils import normalize
+from machine_learning_application.query_generator import STATE_CODES, normalize_question
+
+# Most questions asked of the chatbot are one of a few intents. Those are matched here with rules, no model and no
+# network, and answered by vetted SQL with bind parameters ($1, $2, ...) and a summary formatted locally, so they
+# need neither generate_query nor generate_response. Anything else returns None and goes to the LLM.
+
+# rows a template returns when the question doesn't say how many
+DEFAULT_TOP_N: int = 10
+MAX_TOP_N: int = 100
+# a shorter company name would match too many borrowers to be what was meant
+MIN_COMPANY_NAME_LENGTH: int = 3
+COMPANY_LOANS_LIMIT: int = 100
+
+# two letter codes are only taken for states where they can't be an ordinary word ("in", "me", "or", ...)
+STATE_CODE_WORDS: set[str] = set(STATE_CODES.values()) - {"IN", "ME", "OR", "OH", "HI", "OK", "LA", "AS", "DE", "PA", "MA", "CO", "AL", "GA", "ID", "MO", "WA"}
+
+# ppp_rollup_state column -> how the summary calls it, see sql.CreateTempTables.create_rollup_tables
+STATE_METRICS: dict[str, str] = {
+    "total_approval_amount": "total approved",
+    "total_forgiveness_amount": "total forgiven",
+    "loan_count": "loans",
+    "avg_approval_amount": "average loan",
+    "total_jobs_reported": "jobs reported",
+}
+MONEY_METRICS = {"total_approval_amount", "total_forgiveness_amount", "avg_approval_amount"}
+
+@dataclass
+class IntentMatch:
+    """A question matched to a vetted SQL template: the SQL, its bind parameters and how to summarize its rows."""
+    intent: str
+    sql: str
+    args: Tuple
+    # (rows, row_count) -> the answer shown to the user
+    summarize: Callable[[list, Optional[int]], str]
+
+def money(value: Optional[float]) -> str:
+    return "an unknown amount" if value is None else f"${value:,.2f}"
+
+def state_code(place: str) -> Optional[str]:
+    """Return the code of a state given by name or code, or None."""
+    place = place.strip()
+    if place in STATE_CODES:
+        return STATE_CODES[place]
+    return place.upper() if place.upper() in STATE_CODES.values() else None
+
+def metric_of(phrase: str) -> str:
+    """Pick the ppp_rollup_state column a question is about from its wording, the approved amount by default."""
+    if "forgiv" in phrase:
+        return "total_forgiveness_amount"
+    if "job" in phrase:
+        return "total_jobs_reported"
+    if re.search(r"\b(how many|number of|count)\b", phrase):
+        return "loan_count"
+    if re.search(r"\b(average|avg|mean)\b", phrase):
+        return "avg_approval_amount"
+    return "total_approval_amount"
+
+def format_metric(metric: str, value) -> str:
+    if metric in MONEY_METRICS:
+        return money(value)
+    return f"{value or 0:,} {STATE_METRICS[metric]}"
+
+def top_n(count: Optional[str]) -> int:
+    return min(int(count), MAX_TOP_N) if count else DEFAULT_TOP_N
+
+# "top 5 borrowers", "show me the 10 largest loans", "who are the biggest borrowers by forgiveness"
+TOP_BORROWERS = re.compile(
+    r"^(?:(?:show|list|give|get|find|what are|who are|who were)(?: me)? )?(?:the )?"
+    r"(?:(?:top|largest|biggest)(?: (\d+))?|(\d+) (?:largest|biggest)) (?:borrowers|loans|ppp loans|recipients)"
+    r"( by (?:forgiveness|forgiven amount|amount forgiven|forgiveness amount))?$"
+)
+
+def match_top_borrowers(question: str) -> Optional[IntentMatch]:
+    match = TOP_BORROWERS.match(question)
+    if not match:
+        return None
+    limit = top_n(match.group(1) or match.group(2))
+
+    if match.group(3):
+        def summarize_forgiven(rows: list, row_count: Optional[int]) -> str:
+            if not rows:
+                return "No forgiven loans were found."
+            loans = "; ".join(f"{name} in {city}, {state} ({money(amount)})" for name, city, state, amount in rows)
+            return f"The {len(rows)} largest loans by forgiveness amount went to: {loans}."
+
+        # the same order as /loans/top-borrowers, served by idx_forgiveness_amount_loan_number
+        return IntentMatch(
+            "top_borrowers",
+            f"SELECT borrower_name, borrower_city, borrower_state, forgiveness_amount FROM {LOAN_TABLE} "
+            f"WHERE forgiveness_amount IS NOT NULL ORDER BY forgiveness_amount DESC LIMIT $1",
+            (limit,),
+            summarize_forgiven,
+        )
+
+    def summarize(rows: list, row_count: Optional[int]) -> str:
+        if not rows:
+            return "No loans were found."
+        loans = "; ".join(f"{name} in {city}, {state} ({money(amount)})" for name, city, state, amount in rows)
+        return f"The {len(rows)} largest loans by approved amount went to: {loans}."
+
+    return IntentMatch(
+        "top_borrowers",
+        f"SELECT borrower_name, borrower_city, borrower_state, current_approval_amount FROM {LOAN_TABLE} "
+        f"ORDER BY current_approval_amount DESC NULLS LAST LIMIT $1",
+        (limit,),
+        summarize,
+    )
+
+# "top 5 states by total forgiveness", "total loans by state", "jobs reported per state"
+STATES_BY = re.compile(r"^(?:(?:show|list|give|get|what are|what were)(?: me)? )?(?:the )?(?:top (\d+) states by (.+)|(.+) (?:by|per|for each|in each) state)$")
+# "total forgiveness in texas", "how many loans were approved in ca", "how much was approved in new york"
+STATE_TOTAL = re.compile(r"^(?:what (?:is|was|are|were) )?(?:the )?(.*(?:total|how many|how much|number of|average|avg).*?) in (?:the state of )?([a-z ]+)$")
+
+def match_state_totals(question: str) -> Optional[IntentMatch]:
+    match = STATES_BY.match(question)
+    if match:
+        limit = top_n(match.group(1)) if match.group(1) else MAX_TOP_N
+        metric = metric_of(match.group(2) or match.group(3))
+
+        def summarize(rows: list, row_count: Optional[int]) -> str:
+            if not rows:
+                return "No state totals were found, the rollups may not have been built yet."
+            states = "; ".join(f"{state}: {format_metric(metric, value)}" for state, value in rows)
+            return f"States by {STATE_METRICS[metric]}: {states}."
+
+        # the rollups hold one row per state, built after every load
+        return IntentMatch(
+            "state_totals",
+            f"SELECT group_key AS borrower_state, {metric} FROM ppp_rollup_state ORDER BY {metric} DESC NULLS LAST LIMIT $1",
+            (limit,),
+            summarize,
+        )
+
+    match = STATE_TOTAL.match(question)
+    code = state_code(match.group(2)) if match else None
+    if code is None:
+        return None
+    metric = metric_of(match.group(1))
+
+    def summarize_state(rows: list, row_count: Optional[int]) -> str:
+        if not rows:
+            return f"No loans were found in {code}."
+        if metric == "loan_count":
+            return f"{code} had {rows[0][0]:,} loans."
+        return f"{code}: {format_metric(metric, rows[0][1])} across {rows[0][0]:,} loans."
+
+    return IntentMatch(
+        "state_total",
+        f"SELECT loan_count, {metric} FROM ppp_rollup_state WHERE group_key = $1",
+        (code,),
+        summarize_state,
+    )
+
+# "loans for sumter coatings", "which loans did acme inc get", "how much did acme inc receive"
+COMPANY_LOANS = [
+    re.compile(r"^(?:(?:show|list|find|get)(?: me)? )?(?:(?:all|the) )?(?:ppp )?loans? (?:for|of|to|taken by|received by|given to) (?:the company )?(.+)$"),
+    re.compile(r"^(?:which|what) (?:ppp )?loans? did (.+?) (?:get|receive|take|take out)$"),
+    re.compile(r"^how much (?:money )?did (.+?) (?:get|receive|borrow)$"),
+]
+
+def match_company_loans(question: str) -> Optional[IntentMatch]:
+    for pattern in COMPANY_LOANS:
+        match = pattern.match(question)
+        if match:
+            break
+    else:
+        return None
+    name = normalize(match.group(1))
+    if name is None or len(name) < MIN_COMPANY_NAME_LENGTH:
+        return None
+
+    def summarize(rows: list, row_count: Optional[int]) -> str:
+        if not rows:
+            return f"No loans were found for borrowers matching \"{name}\"."
+        # the count and total are over every match, not only the rows returned
+        largest, matched, total = rows[0], rows[0][5], rows[0][6]
+        listed = f" The {len(rows)} largest are listed." if matched > len(rows) else ""
+        return (
+            f"{matched:,} loan{'s' if matched != 1 else ''} matched \"{name}\", {money(total or 0)} approved in total. "
+            f"The largest went to {largest[0]} (loan {largest[1]}, approved {largest[2]:%Y-%m-%d}, {money(largest[3])}).{listed}"
+        )
+
+    # the same LIKE the generated SQL is asked to use, served by the trigram index, the window aggregates are taken
+    # before the LIMIT
+    return IntentMatch(
+        "company_loans",
+        f"SELECT borrower_name, loan_number, date_approved, current_approval_amount, forgiveness_amount, "
+        f"count(*) OVER () AS matched_loans, sum(current_approval_amount) OVER () AS matched_approval_amount FROM {LOAN_TABLE} "
+        f"WHERE borrower_name_normalized LIKE $1 ORDER BY current_approval_amount DESC NULLS LAST LIMIT $2",
+        (f"%{name}%", COMPANY_LOANS_LIMIT),
+        summarize,
+    )
+
+# "what is the average loan in austin, texas", "average loan amount in miami fl"
+CITY_AVERAGE = re.compile(r"^(?:what (?:is|was) )?(?:the )?(?:average|avg|mean) (?:ppp )?loan(?: amount| size)? (?:in|for) ([a-z .']+?)(?:, ?([a-z ]+))?$")
+
+def match_city_average(question: str) -> Optional[IntentMatch]:
+    match = CITY_AVERAGE.match(question)
+    if not match:
+        return None
+    city, state = match.group(1).strip(), match.group(2)
+    code = state_code(state) if state else None
+    if state and code is None:
+        return None
+    # "miami fl", a trailing code that can't be part of the city's name
+    words = city.rsplit(" ", 1)
+    if code is None and len(words) == 2 and words[1].upper() in STATE_CODE_WORDS:
+        city, code = words[0], words[1].upper()
+    place = f"{city.title()}, {code}" if code else city.title()
+
+    def summarize(rows: list, row_count: Optional[int]) -> str:
+        loan_count, average = rows[0]
+        if not loan_count:
+            return f"No loans were found in {place}."
+        return f"The average loan in {place} was {money(average)}, across {loan_count:,} loans."
+
+    # with the state, idx_borrower_state_city_date_approved narrows it down to the city
+    if code:
+        sql = (
+            f"SELECT count(*), avg(current_approval_amount) FROM {LOAN_TABLE} "
+            f"WHERE borrower_state = $1 AND upper(borrower_city) = $2"
+        )
+        return IntentMatch("city_average", sql, (code, city.upper()), summarize)
+    sql = f"SELECT count(*), avg(current_approval_amount) FROM {LOAN_TABLE} WHERE upper(borrower_city) = $1"
+    return IntentMatch("city_average", sql, (city.upper(),), summarize)
+
+MATCHERS = [match_top_borrowers, match_state_totals, match_company_loans, match_city_average]
+
+# function that maps a question to one of the common intents, None means it has to go to the LLM
+def match_intent(question: str) -> Optional[IntentMatch]:
+    question = normalize_question(question)
+    for matcher in MATCHERS:
+        intent = matcher(question)
+        if intent is not None:
+            return intent
+    return None
@@ -1,10 +1,12 @@
 import os
+import re
+import json
+import httpx
+import asyncio
 import psycopg2
 import logging
 from dotenv import load_dotenv
-import requests
-from typing import Any
-import time
+from typing import Any, AsyncIterator, Optional
 
 # set up the schema that will be passed into gpt
 SCHEMA: str = """
@@ -14,6 +16,7 @@ SCHEMA: str = """
                 loan_number TEXT NOT NULL, the loan number
                 date_approved TIMESTAMP NOT NULL, the date the loan was approved
                 borrower_name TEXT NOT NULL, the name of the borrower
+                borrower_name_normalized TEXT, the borrower name lowercased with punctuation removed (trigram indexed, use for name searches)
                 sba_office_code TEXT, the SBA office code
                 processing_method TEXT, the method of processing the loan
                 borrower_address TEXT, the address of the borrower
@@ -66,14 +69,206 @@ SCHEMA: str = """
                 forgiveness_date TIMESTAMP, the forgiveness date
                 shard_id BIGINT, the shard id
         """
+# the SCHEMA line of every column, in table order
+SCHEMA_HEADER, SCHEMA_COLUMNS_TEXT = SCHEMA.split("Columns:")
+SCHEMA_COLUMNS: dict[str, str] = {line.split()[0]: line.strip() for line in SCHEMA_COLUMNS_TEXT.strip().splitlines()}
+# always sent: the loan's key, and the names every name search needs
+KEY_COLUMNS: list[str] = ["loan_number", "borrower_name", "borrower_name_normalized"]
+
+# state name -> code, questions often name a state without saying "state"
+STATE_CODES: dict[str, str] = {
+    "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR", "california": "CA", "colorado": "CO",
+    "connecticut": "CT", "delaware": "DE", "district of columbia": "DC", "florida": "FL", "georgia": "GA",
+    "hawaii": "HI", "idaho": "ID", "illinois": "IL", "indiana": "IN", "iowa": "IA", "kansas": "KS",
+    "kentucky": "KY", "louisiana": "LA", "maine": "ME", "maryland": "MD", "massachusetts": "MA",
+    "michigan": "MI", "minnesota": "MN", "mississippi": "MS", "missouri": "MO", "montana": "MT",
+    "nebraska": "NE", "nevada": "NV", "new hampshire": "NH", "new jersey": "NJ", "new mexico": "NM",
+    "new york": "NY", "north carolina": "NC", "north dakota": "ND", "ohio": "OH", "oklahoma": "OK",
+    "oregon": "OR", "pennsylvania": "PA", "rhode island": "RI", "south carolina": "SC", "south dakota": "SD",
+    "tennessee": "TN", "texas": "TX", "utah": "UT", "vermont": "VT", "virginia": "VA", "washington": "WA",
+    "west virginia": "WV", "wisconsin": "WI", "wyoming": "WY", "puerto rico": "PR", "guam": "GU",
+    "virgin islands": "VI", "american samoa": "AS", "northern mariana islands": "MP",
+}
+
+# column -> the words (and phrases) a question asking about it is likely to use, besides the column's name.
+# Words are matched singular, "lenders" matches "lender". Columns not listed here are only matched by their name.
+COLUMN_KEYWORDS: dict[str, list[str]] = {
+    "date_approved": ["date", "when", "approved", "approval", "time", "longest", "month", "year", "day", "week", "2020", "2021", "january", "february",
+                      "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"],
+    "initial_approval_amount": ["approval", "approved amount", "initial", "original"],
+    "current_approval_amount": ["amount", "approval", "approved", "largest", "biggest", "smallest", "total", "sum",
+                                "average", "avg", "mean", "median", "money", "dollar", "size", "value", "much", "funding"],
+    "forgiveness_amount": ["forgiven", "forgive", "forgiveness", "unforgiven"],
+    "forgiveness_date": ["forgiven", "forgiveness", "when"],
+    "borrower_address": ["address", "street"],
+    "borrower_city": ["city", "town", "where"],
+    "borrower_state": ["state", "where", *STATE_CODES],
+    "borrower_zip": ["zip", "zipcode", "postal"],
+    "loan_status": ["status", "paid", "paid in full", "charged off", "exemption", "active", "outstanding"],
+    "loan_status_date": ["status"],
+    "term": ["term", "months", "duration"],
+    "sba_guaranty_percentage": ["guaranty", "guarantee", "guaranteed"],
+    "undisbursed_amount": ["undisbursed", "disbursed"],
+    "franchise_name": ["franchise", "franchisee"],
+    "servicing_lender_name": ["lender", "bank", "servicer", "serviced", "serviced by", "servicing"],
+    "originating_lender": ["lender", "bank", "originated", "originator", "originating"],
+    "rural_urban_indicator": ["rural", "urban"],
+    "hubzone_indicator": ["hubzone", "hub zone"],
+    "lmi_indicator": ["lmi", "low income", "moderate income"],
+    "business_age_description": ["age", "old", "new business", "startup", "existing", "established", "years old"],
+    "project_county_name": ["county"],
+    "project_state": ["project"],
+    "cd": ["congressional", "district"],
+    "jobs_reported": ["job", "employee", "worker", "employ", "employed", "headcount", "staff"],
+    "naics_code": ["naics", "industry", "sector"],
+    "race": ["race", "black", "white", "asian", "minority", "american indian"],
+    "ethnicity": ["ethnicity", "hispanic", "latino", "minority"],
+    "business_type": ["type", "corporation", "llc", "sole proprietor", "sole proprietorship", "partnership",
+                      "self employed", "independent contractor", "nonprofit", "cooperative"],
+    "gender": ["gender", "woman", "women", "female", "male", "men"],
+    "veteran": ["veteran"],
+    "non_profit": ["nonprofit", "non profit", "charity", "charities"],
+    "payroll_proceed": ["payroll", "proceed", "use of proceeds"],
+    "utilities_proceed": ["utility", "utilities", "proceed"],
+    "mortgage_interest_proceed": ["mortgage", "proceed"],
+    "rent_proceed": ["rent", "proceed"],
+    "refinance_eidl_proceed": ["refinance", "eidl", "proceed"],
+    "health_care_proceed": ["health", "healthcare", "proceed"],
+    "debt_interest_proceed": ["debt", "proceed"],
+}
+# column -> columns sent along with it: city names can't be recognized (and are ambiguous without the state),
+# and questions about forgiveness usually compare it to the approved amount
+COLUMN_COMPANIONS: dict[str, list[str]] = {
+    "borrower_state": ["borrower_city"],
+    "borrower_city": ["borrower_state"],
+    "forgiveness_amount": ["current_approval_amount"],
+}
+# parts of column names too generic to say which column a question is about
+GENERIC_NAME_WORDS: set[str] = {
+    "id", "loan", "name", "normalized", "date", "amount", "code", "indicator", "description", "proceed", "percentage",
+    "borrower", "business", "project", "location", "interest", "approved", "lender", "servicing", "originating", "shard", "method",
+}
+
+# function that reduces a word to the form matching uses, plural or singular
+def keyword_form(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+# column -> the phrases that select it, in keyword_form
+SCHEMA_KEYWORDS: dict[str, set[str]] = {
+    column: {
+        " ".join(keyword_form(word) for word in phrase.split())
+        for phrase in [*(part for part in column.split("_") if part not in GENERIC_NAME_WORDS), *COLUMN_KEYWORDS.get(column, [])]
+    }
+    for column in SCHEMA_COLUMNS
+}
+
+# function that picks the columns a question is about, None when it matches none (it then gets the whole schema)
+def relevant_columns(question: str) -> Optional[list[str]]:
+    words = [keyword_form(word) for word in re.findall(r"[a-z0-9]+", question.lower())]
+    text = f" {' '.join(words)} "
+    matched = {column for column, phrases in SCHEMA_KEYWORDS.items() if any(f" {phrase} " in text for phrase in phrases)}
+    if not matched - set(KEY_COLUMNS):
+        return None
+    matched.update(companion for column in list(matched) for companion in COLUMN_COMPANIONS.get(column, []))
+    # in table order, like the full schema
+    return [column for column in SCHEMA_COLUMNS if column in matched or column in KEY_COLUMNS]
+
+# function that returns SCHEMA with only the columns relevant to the question (and the keys)
+def prune_schema(question: str) -> str:
+    columns = relevant_columns(question)
+    if columns is None:
+        return SCHEMA
+    lines = "\n".join(f"            {SCHEMA_COLUMNS[column]}" for column in columns)
+    return f"{SCHEMA_HEADER}Columns:\n{lines}\n        "
+
 # set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# OpenAI API endpoint
+OPENAI_URL: str = "https://api.openai.com/v1/chat/completions"
+# seconds to wait for a completion, generating a long answer can take a while
+OPENAI_TIMEOUT: float = float(os.getenv("OPENAI_TIMEOUT", "60"))
+# part of the key SQL generated for a question is cached under, bump it when SCHEMA or the prompt change
+PROMPT_VERSION: int = 2
+# generate_response answers with this (and the error) when the summary couldn't be generated
+RESPONSE_ERROR_PREFIX: str = "Error formatting response"
+# query_database fetches at most this many rows, and gives the query this many seconds
+MAX_ROWS: int = int(os.getenv("CHAT_MAX_ROWS", "1000"))
+STATEMENT_TIMEOUT: float = float(os.getenv("CHAT_STATEMENT_TIMEOUT", "10"))
+
+# function that reduces a question to the form questions asking the same thing share (case, spacing, trailing punctuation)
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+# one client is meant to be shared by every question, so its connections (and TLS sessions) to the API are reused
+def new_openai_client(timeout: float = OPENAI_TIMEOUT) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=10.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+
+# function that builds the headers and payload of a request to the OpenAI API
+def completion_request(messages: list[dict[str, str]], temperature: float, stream: bool = False) -> tuple[dict[str, str], dict[str, Any]]:
+    # Get API key from the environment variables
+    api_key: Optional[str] = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+    # API Headers
+    headers: dict[str, str] = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    # prepare the request data payload
+    data: dict[str, Any] = {
+        "model": "gpt-3.5-turbo",
+        "messages": messages,
+        "temperature": temperature
+    }
+    if stream:
+        data["stream"] = True
+    return headers, data
+
+# function that sends the messages to the OpenAI API and returns the content of the reply
+async def chat_completion(client: httpx.AsyncClient, messages: list[dict[str, str]], temperature: float) -> str:
+    headers, data = completion_request(messages, temperature)
+
+    # make the POST request to the OpenAI API, the event loop keeps serving other requests while it is in flight
+    response: httpx.Response = await client.post(OPENAI_URL, headers=headers, json=data)
+
+    # if the request was not successful, raise an exception
+    if response.status_code != 200:
+        raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
+    result: dict[str, Any] = response.json()
+    return result['choices'][0]['message']['content']
+
+# function that sends the messages to the OpenAI API and yields the reply piece by piece as it is generated
+async def stream_chat_completion(client: httpx.AsyncClient, messages: list[dict[str, str]], temperature: float) -> AsyncIterator[str]:
+    headers, data = completion_request(messages, temperature, stream=True)
+
+    # the API answers with server-sent events, one "data: {json}" line per piece and "data: [DONE]" at the end
+    async with client.stream("POST", OPENAI_URL, headers=headers, json=data) as response:
+        if response.status_code != 200:
+            raise Exception(f"OpenAI API error: {response.status_code} - {(await response.aread()).decode()}")
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload: str = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            content: Optional[str] = json.loads(payload)['choices'][0]['delta'].get('content')
+            if content:
+                yield content
+
 # ensure that database is connected
-def connect_to_database() -> psycopg2.extensions.connection:
+# db_config defaults to the primary from the DB_* environment variables
+def connect_to_database(db_config: Optional[dict] = None) -> psycopg2.extensions.connection:
     try:
-        db_config = {
+        db_config = db_config or {
             "dbname":   os.getenv("DB_NAME"),
             "user":     os.getenv("DB_USER"),
             "password": os.getenv("DB_PASSWORD"),
@@ -88,12 +283,14 @@ def connect_to_database() -> psycopg2.extensions.connection:
         logger.error(f"Error connecting to database: {e}")
         return None
 
-# function that takes a natural language question and returns a sql query
-def generate_query(question: str) -> str:
+# function that builds the messages asking for the SQL answering the question, table_schema defaults to the columns of
+# SCHEMA relevant to the question (see prune_schema)
+def query_messages(question: str, table_schema: Optional[str] = None) -> list[dict[str, str]]:
     question: str = question.lower()
 
-    # schema of the table with information on each column to help ChatGPT understand the table
-    table_schema: str = SCHEMA
+    # schema of the table with information on the columns the question is about, to help ChatGPT understand the table
+    # without paying for (and waiting on) the prompt tokens of all 55 columns
+    table_schema: str = table_schema if table_schema is not None else prune_schema(question)
     
     # create the prompt for ChatGPT
     prompt = f"""
@@ -110,75 +307,54 @@ def generate_query(question: str) -> str:
     5. Handle NULL values appropriately
     6. Use PostgreSQL-specific functions and syntax
     7. For aggregations, cast to numeric before rounding: ROUND(AVG(column)::numeric, 2)
-    8. For business name searches, always use ILIKE with wildcards (%) for partial matching
-       Example: WHERE borrower_name ILIKE '%company name%'
+    8. For business name searches, always use borrower_name_normalized with LIKE and wildcards (%) for partial matching,
+       with the name lowercased and punctuation removed so the trigram index can be used
+       Example: WHERE borrower_name_normalized LIKE '%company name%'
 
     PostgreSQL Query:
     """
+    return [
+        {"role": "system", "content": "You are a PostgreSQL expert. Respond only with the PostgreSQL query using correct PostgreSQL syntax."},
+        {"role": "user", "content": prompt}
+    ]
 
+# function that takes a natural language question and returns a sql query
+async def generate_query(question: str, client: httpx.AsyncClient) -> str:
     try:
-        # Get API key from the environment variables
-        api_key: str = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-            
-        # OpenAI API endpoint
-        url: str = "https://api.openai.com/v1/chat/completions"
-        
-        # API Headers
-        headers: dict[str, str] = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # prepare the request data payload
-        data: dict[str, Any] = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "system", "content": "You are a PostgreSQL expert. Respond only with the PostgreSQL query using correct PostgreSQL syntax."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0
-        }
-        
-        # make the POST request to the OpenAI API
-        response: requests.Response = requests.post(url, headers=headers, json=data)
-        
-        # check if the request was successful, if it was, extract the SQL query from the response
-        if response.status_code == 200:
-            result: dict[str, Any] = response.json()
-            sql_query: str = result['choices'][0]['message']['content'].replace('```sql', '').replace('```', '').strip()
-
-            # remove any leading/trailing whitespace or newlines
-            sql_query = sql_query.strip()
-
-            # log the SQL query
-            logger.info(f"SQL Query: {sql_query} \n")
-
-            # return the SQL query
-            return sql_query
-        
-        # if the request was not successful, raise an exception
-        else:
-            raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
+        # ask for the query, temperature 0 so the same question gets the same SQL
+        content: str = await chat_completion(client, query_messages(question), temperature=0)
+
+        # extract the SQL query from the response, removing any leading/trailing whitespace or newlines
+        sql_query: str = content.replace('```sql', '').replace('```', '').strip()
+
+        # log the SQL query
+        logger.info(f"SQL Query: {sql_query} \n")
+
+        # return the SQL query
+        return sql_query
 
     except Exception as e:
         logging.error(f"Error generating query: {str(e)}")
         raise
 
-# function that queries the database with the sql query generated by LLM
-def query_database(sql_query: str) -> list[tuple]:
+# function that queries the database with the sql query generated by LLM, for running this module on its own
+# (the API runs the query on its read-only async connection pool instead, see server.query_chat_database).
+# Read only with a statement timeout, and a server side cursor fetches at most max_rows rows.
+def query_database(sql_query: str, db_config: Optional[dict] = None, max_rows: int = MAX_ROWS) -> list[tuple]:
     try:
         # connect to database
-        conn: psycopg2.extensions.connection = connect_to_database()
+        conn: psycopg2.extensions.connection = connect_to_database(db_config)
         if conn is None:
-            raise Exception("Failed to connect to database")
+            raise ConnectionError("Failed to connect to database")
         logger.info("✅ Connected to database successfully. Going to execute the query now.\n")
 
         # execute the query
-        cursor: psycopg2.extensions.cursor = conn.cursor()
-        cursor.execute(sql_query)
-        result: list[tuple] = cursor.fetchall()
+        conn.set_session(readonly=True)
+        with conn.cursor() as settings:
+            settings.execute("SET statement_timeout = %s", (round(STATEMENT_TIMEOUT * 1000),))
+        cursor: psycopg2.extensions.cursor = conn.cursor(name="chat_query")
+        cursor.execute(sql_query.strip().rstrip(";"))
+        result: list[tuple] = cursor.fetchmany(max_rows)
 
         # close the cursor and connection
         cursor.close()
@@ -190,94 +366,99 @@ def query_database(sql_query: str) -> list[tuple]:
         logger.error(f"Error querying database: {str(e)}")
         raise
 
+# function that builds the messages asking for a summary of the result, row_count is the number of rows the query
+# returned (None if unknown), truncated says result holds only the first ones
+def response_messages(result: list[tuple], question: str, row_count: Optional[int] = None, truncated: bool = False) -> list[dict[str, str]]:
+    if row_count is None:
+        row_count_line = f"more than {len(result)}" if truncated else str(len(result))
+    else:
+        row_count_line = str(row_count)
+
+    # Create the prompt for ChatGPT to format the response
+    prompt = f"""
+    Question: {question}
+
+    Total Rows: {row_count_line}
+
+    Raw Database Results:
+    {result[:10]}  # Show first 10 results for context
+
+    Requirements:
+    1. Provide a clear, natural language summary of the results
+    2. Format numbers with appropriate commas and decimal places
+    3. If relevant, mention the total count of results
+    4. If showing money values, use proper currency formatting ($)
+    5. Keep the response concise but informative
+    6. If no results, explain that no data was found
+
+    Please format a response that answers the original question using this data.
+    """
+    return [
+        {"role": "system", "content": "You are a helpful assistant that explains database results clearly and concisely."},
+        {"role": "user", "content": prompt}
+    ]
+
 # function that generates a response to the question
-def generate_response(result: list[tuple], question: str) -> str:
+async def generate_response(
+    result: list[tuple],
+    question: str,
+    client: httpx.AsyncClient,
+    row_count: Optional[int] = None,
+    truncated: bool = False,
+) -> str:
     try:
-        # Get API key from the environment variables
-        api_key: str = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-            
-        # Create the prompt for ChatGPT to format the response
-        prompt = f"""
-        Question: {question}
-
-        Raw Database Results:
-        {result[:10]}  # Show first 10 results for context
-
-        Requirements:
-        1. Provide a clear, natural language summary of the results
-        2. Format numbers with appropriate commas and decimal places
-        3. If relevant, mention the total count of results
-        4. If showing money values, use proper currency formatting ($)
-        5. Keep the response concise but informative
-        6. If no results, explain that no data was found
-
-        Please format a response that answers the original question using this data.
-        """
+        # Allow some creativity in response formatting
+        content: str = await chat_completion(client, response_messages(result, question, row_count, truncated), temperature=0.7)
+        return content.strip()
 
-        # OpenAI API endpoint
-        url: str = "https://api.openai.com/v1/chat/completions"
-        
-        # API Headers
-        headers: dict[str, str] = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # prepare the request data payload
-        data: dict[str, Any] = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "system", "content": "You are a helpful assistant that explains database results clearly and concisely."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7  # Allow some creativity in response formatting
-        }
-        
-        # make the POST request to the OpenAI API
-        response: requests.Response = requests.post(url, headers=headers, json=data)
-        
-        # check if the request was successful
-        if response.status_code == 200:
-            result_data: dict[str, Any] = response.json()
-            formatted_response: str = result_data['choices'][0]['message']['content'].strip()
-            
-            return formatted_response
-        else:
-            raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
+    except Exception as e:
+        logging.error(f"Error generating response: {str(e)}")
+        return f"{RESPONSE_ERROR_PREFIX}: {str(e)}"
+
+# function that streams the response to the question as it is generated, see generate_response.
+# If generating it fails the error is the last piece, after whatever was already generated.
+async def stream_response(
+    result: list[tuple],
+    question: str,
+    client: httpx.AsyncClient,
+    row_count: Optional[int] = None,
+    truncated: bool = False,
+) -> AsyncIterator[str]:
+    started: bool = False
+    try:
+        async for content in stream_chat_completion(client, response_messages(result, question, row_count, truncated), temperature=0.7):
+            # like generate_response, without the leading whitespace
+            if not started:
+                content = content.lstrip()
+                started = bool(content)
+            if content:
+                yield content
 
     except Exception as e:
         logging.error(f"Error generating response: {str(e)}")
-        return f"Error formatting response: {str(e)}"
+        yield f"{' ' if started else ''}{RESPONSE_ERROR_PREFIX}: {str(e)}"
 
 # main function
-if __name__ == "__main__":
+async def main() -> None:
     # load environment variables
     load_dotenv()
 
-    # connect to database
-    connection: psycopg2.extensions.connection = connect_to_database()
-    if connection is None:
-        raise Exception("Failed to connect to database")
-    logger.info("✅ Connected to database successfully \n")
-
-    # sleep for 3 seconds
-    logger.info(f"Going to sleep for 3 seconds now and then try querying the database with your question")
-    time.sleep(3)
-
     # get the question from the frontend
     question: str = "Who is the business with the longest who had their loan status approval take the longest time?"
     logger.info(f"Question: {question} \n")
 
-    # generate the query
-    postgres_sql_query: str = generate_query(question)
-    logger.info(f"PostgreSQL Query generated by the LLM: {postgres_sql_query} \n")
+    async with new_openai_client() as client:
+        # generate the query
+        postgres_sql_query: str = await generate_query(question, client)
+        logger.info(f"PostgreSQL Query generated by the LLM: {postgres_sql_query} \n")
 
-    # query the database
-    result: list[tuple] = query_database(postgres_sql_query)
-    logger.info(f"Result: {result} \n")
+        # query the database
+        result: list[tuple] = query_database(postgres_sql_query)
+        logger.info(f"Result: {result} \n")
 
-    # generate a nice response to send back to the user
-    response: str = generate_response(result, question)
-    logger.info(f"Response generated by the LLM: {response} \n")
\ No newline at end of file
+        # generate a nice response to send back to the user
+        response: str = await generate_response(result, question, client)
+        logger.info(f"Response generated by the LLM: {response} \n")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+import os
+import time
+import logging
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# set up logging
+logger = logging.getLogger(__name__)
+
+# label of requests that matched no route, so unknown paths can't blow up the label cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+# the stages /ask-question is broken down into
+ASK_QUESTION_STAGES = ("generate_query", "query_database", "generate_response")
+
+# buckets in seconds, from a cached lookup to a chatbot round trip
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROWS_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+
+REQUEST_DURATION = Histogram(
+    "ppp_api_request_duration_seconds", "Time to serve a request, by route and status code",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "ppp_api_requests_in_progress", "Requests currently being served", multiprocess_mode="livesum",
+)
+REQUEST_DB_DURATION = Histogram(
+    "ppp_api_request_db_duration_seconds", "Time a request spent executing SQL statements, by route",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_ROWS = Histogram(
+    "ppp_api_request_db_rows", "Rows the SQL statements of a request returned, by route",
+    ["method", "route"], buckets=ROWS_BUCKETS,
+)
+DB_STATEMENTS = Counter("ppp_api_db_statements", "SQL statements executed through the engine")
+POOL_CHECKOUT_WAIT = Histogram(
+    "ppp_api_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection",
+    buckets=LATENCY_BUCKETS,
+)
+POOL_CHECKOUTS_WAITING = Gauge(
+    "ppp_api_db_pool_checkouts_waiting", "Checkouts waiting for a pooled database connection", multiprocess_mode="livesum",
+)
+POOL_CONNECTIONS_CHECKED_OUT = Gauge(
+    "ppp_api_db_pool_connections_checked_out", "Pooled database connections in use", multiprocess_mode="livesum",
+)
+REPLICA_LAG = Gauge(
+    "ppp_api_db_replica_lag_seconds", "How far the read replica was behind the primary at its last check", multiprocess_mode="livemax",
+)
+REPLICA_USABLE = Gauge(
+    "ppp_api_db_replica_usable", "1 while reads go to the read replica, 0 while they fall back to the primary", multiprocess_mode="livemin",
+)
+ASK_QUESTION_STAGE_DURATION = Histogram(
+    "ppp_api_ask_question_stage_duration_seconds", "Time /ask-question spent in each stage",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+CHAT_CACHE_LOOKUPS = Counter(
+    "ppp_api_chat_cache_lookups", "/ask-question cache lookups, by cache (sql, answer) and outcome (hit, miss)",
+    ["cache", "outcome"],
+)
+CHAT_INTENTS = Counter(
+    "ppp_api_chat_intents", "/ask-question questions by the intent template that answered them, llm for the rest",
+    ["intent"],
+)
+CHAT_QUERY_PLANS = Counter(
+    "ppp_api_chat_query_plans", "Chatbot queries by what their EXPLAIN decided (as_is, limited, rejected)",
+    ["plan"],
+)
+
+@dataclass
+class RequestStats:
+    """SQL time and rows of the request being served, filled in by the engine events."""
+    db_seconds: float = 0.0
+    db_rows: int = 0
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+class MetricsMiddleware:
+    """ASGI middleware that records the latency, SQL time and SQL rows of every HTTP request.
+
+    Requests are labelled with their route template (e.g. /loans/search/by-borrower), not the raw path.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        REQUESTS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            REQUESTS_IN_PROGRESS.dec()
+            _request_stats.reset(token)
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            route = getattr(route, "path", UNMATCHED_ROUTE)
+            method = scope["method"]
+            REQUEST_DURATION.labels(method, route, str(status)).observe(duration)
+            REQUEST_DB_DURATION.labels(method, route).observe(stats.db_seconds)
+            REQUEST_DB_ROWS.labels(method, route).observe(stats.db_rows)
+
+def instrument_engine(engine: Engine) -> None:
+    """Times every statement the engine executes and adds its time and rows to the current request's stats.
+
+    Args:
+        engine (Engine): The synchronous engine (AsyncEngine.sync_engine for the async one).
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        DB_STATEMENTS.inc()
+        stats = _request_stats.get()
+        if stats is None:
+            return
+        stats.db_seconds += elapsed
+        # rowcount is the number of rows fetched for statements that return rows, affected rows otherwise
+        if cursor.description is not None and cursor.rowcount > 0:
+            stats.db_rows += cursor.rowcount
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long checkouts wait for a connection and how many are in use."""
+
+    def _do_get(self):
+        POOL_CHECKOUTS_WAITING.inc()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        finally:
+            POOL_CHECKOUTS_WAITING.dec()
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+        POOL_CONNECTIONS_CHECKED_OUT.inc()
+        return connection
+
+    def _do_return_conn(self, record) -> None:
+        POOL_CONNECTIONS_CHECKED_OUT.dec()
+        super()._do_return_conn(record)
+
+@contextmanager
+def ask_question_stage(stage: str) -> Iterator[None]:
+    """Times one stage of /ask-question, see ASK_QUESTION_STAGES."""
+    with ASK_QUESTION_STAGE_DURATION.labels(stage).time():
+        yield
+
+def count_chat_cache_lookup(cache: str, hit: bool) -> None:
+    """Counts a lookup in one of the /ask-question caches."""
+    CHAT_CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+def count_chat_intent(intent: Optional[str]) -> None:
+    """Counts a question answered by an intent template, or by the LLM when intent is None."""
+    CHAT_INTENTS.labels(intent or "llm").inc()
+
+def count_chat_query_plan(plan: str) -> None:
+    """Counts a chatbot query checked by its EXPLAIN, see server.query_chat_database."""
+    CHAT_QUERY_PLANS.labels(plan).inc()
+
+def render_metrics() -> bytes:
+    """Returns every metric in the Prometheus text format.
+
+    With several worker processes each one only sees its own metrics, set PROMETHEUS_MULTIPROC_DIR to a
+    directory shared by the workers (emptied before they start) and any worker reports them all.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
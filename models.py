@@ -1,8 +1,11 @@
+import re
 import datetime
 
-from typing import List, Dict, Any, ClassVar, Optional
+from typing import List, Dict, Any, ClassVar, Optional, Tuple
 from pydantic import ConfigDict, Field, computed_field, field_validator
+from sql import CATEGORY_COLUMNS
 from utils import (
+    SerializableBaseModel,
     ValidatedBaseModel,
     normalize,
     concatenate_fields
@@ -14,6 +17,32 @@ DATE_FORMATS = [
     "%-m/%-d/%Y", # 6/1/2020
 ]
 
+# -- LOAN NUMBER FORMAT --- #
+# the compact schema stores loan numbers as BIGINT, so they must read back the same: no leading zeros, at most 18 digits
+LOAN_NUMBER_PATTERN = re.compile(r"[1-9][0-9]{0,17}")
+
+# -- BATCH LOOKUP LIMIT --- #
+MAX_LOAN_NUMBER_BATCH = 10_000
+
+# -- COMPACT SCHEMA ENUM VALUES --- #
+INDICATOR_VALUES = {"Y", "N"}
+RURAL_URBAN_VALUES = {"R", "U"}
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    """Returns the value as an int if it is all digits, otherwise None."""
+    value = (value or "").strip()
+    return int(value) if value.isdigit() else None
+
+def _parse_state(value: Optional[str]) -> Optional[str]:
+    """Returns the value as a two letter state code, otherwise None."""
+    value = (value or "").strip().upper()
+    return value if len(value) == 2 else None
+
+def _parse_enum(value: Optional[str], allowed: set) -> Optional[str]:
+    """Returns the value if it is one of the enum labels, otherwise None."""
+    value = (value or "").strip().upper()
+    return value if value in allowed else None
+
 class PPPLoanDataSchema(ValidatedBaseModel):
     """Schema for PPP Loan Data."""
     model_config = ConfigDict(
@@ -108,6 +137,8 @@ class PPPLoanDataSchema(ValidatedBaseModel):
     def validate_loan_number(cls, loan_number: str) -> str:
         if not loan_number or not loan_number.strip():
             raise ValueError("Loan number cannot be empty")
+        if not LOAN_NUMBER_PATTERN.fullmatch(loan_number.strip()):
+            raise ValueError(f"Loan number must be at most 18 digits without leading zeros: {loan_number!r}")
         return loan_number
 
     @field_validator("date_approved", mode="before")
@@ -115,6 +146,9 @@ class PPPLoanDataSchema(ValidatedBaseModel):
         #If the date is already a datetime object, return it as is
         if isinstance(date_approved, datetime.datetime):
             return date_approved
+        #The compact storage schema stores plain dates, widen them to midnight
+        if isinstance(date_approved, datetime.date):
+            return datetime.datetime.combine(date_approved, datetime.time())
         if not date_approved or not str(date_approved).strip():
             raise ValueError("Date cannot be empty")
         date_approved = str(date_approved).strip()
@@ -130,6 +164,9 @@ class PPPLoanDataSchema(ValidatedBaseModel):
         #If the date is already a datetime object, return it as is
         if isinstance(date_being_validated, datetime.datetime):
             return date_being_validated
+        #The compact storage schema stores plain dates, widen them to midnight
+        if isinstance(date_being_validated, datetime.date):
+            return datetime.datetime.combine(date_being_validated, datetime.time())
         if not date_being_validated or not str(date_being_validated).strip():
             return None
         date_being_validated = str(date_being_validated).strip()
@@ -197,17 +234,220 @@ class PPPLoanDataSchema(ValidatedBaseModel):
             ", "
         )
     
+    @property
+    def borrower_name_normalized(self) -> Optional[str]:
+        """Returns the normalized borrower name used for indexed substring and fuzzy search.
+
+        A plain property rather than a computed field: the loan table stores it for its index, responses and exports leave it out.
+        """
+        return normalize(self.borrower_name)
+
     @computed_field
     def shard_id(self) -> int:
         """Compute shard ID based on hash of loan number."""
         return abs(hash(self.loan_number))
 
+    # -- Compact Schema Encoding -- #
+    def category_values(self) -> List[Tuple[str, str]]:
+        """Returns the (column, value) pairs the compact schema stores as ppp_category codes."""
+        return [
+            (column, value)
+            for column in CATEGORY_COLUMNS
+            if (value := (getattr(self, column) or "").strip())
+        ]
+
+    def lenders(self) -> List["LenderSchema"]:
+        """Returns the servicing and originating lenders of the loan as lender dimension rows."""
+        lenders = []
+        servicing_location_id = _parse_int(self.servicing_lender_location_id)
+        if servicing_location_id is not None:
+            lenders.append(LenderSchema(
+                location_id=servicing_location_id,
+                name=self.servicing_lender_name or None,
+                address=self.servicing_lender_address or None,
+                city=self.servicing_lender_city or None,
+                state=_parse_state(self.servicing_lender_state),
+                zip=self.servicing_lender_zip or None,
+            ))
+        originating_location_id = _parse_int(self.originating_lender_location_id)
+        if originating_location_id is not None:
+            lenders.append(LenderSchema(
+                location_id=originating_location_id,
+                name=self.originating_lender or None,
+                city=self.originating_lender_city or None,
+                state=_parse_state(self.originating_lender_state),
+            ))
+        return lenders
+
+    def to_compact(self, category_codes: Dict[Tuple[str, str], int]) -> "PPPLoanCompactSchema":
+        """Encodes the loan as a row of the compact storage schema.
+
+        Args:
+            category_codes (Dict[Tuple[str, str], int]): (column, value) -> ppp_category code.
+
+        Returns:
+            PPPLoanCompactSchema: The compact row, lender columns reduced to lender location ids.
+        """
+        codes = {
+            f"{column}_code": category_codes.get((column, value))
+            for column, value in self.category_values()
+        }
+        return PPPLoanCompactSchema(
+            loan_number=int(self.loan_number),
+            date_approved=self.date_approved.date(),
+            borrower_name=self.borrower_name,
+            borrower_name_normalized=self.borrower_name_normalized,
+            borrower_address=self.borrower_address,
+            borrower_city=self.borrower_city,
+            borrower_state=_parse_state(self.borrower_state),
+            borrower_zip=self.borrower_zip,
+            loan_status_date=self.loan_status_date.date() if self.loan_status_date else None,
+            term=self.term,
+            sba_guaranty_percentage=self.sba_guaranty_percentage,
+            initial_approval_amount=self.initial_approval_amount,
+            current_approval_amount=self.current_approval_amount,
+            undisbursed_amount=self.undisbursed_amount,
+            franchise_name=self.franchise_name or None,
+            servicing_lender_location_id=_parse_int(self.servicing_lender_location_id),
+            rural_urban_indicator=_parse_enum(self.rural_urban_indicator, RURAL_URBAN_VALUES),
+            hubzone_indicator=_parse_enum(self.hubzone_indicator, INDICATOR_VALUES),
+            lmi_indicator=_parse_enum(self.lmi_indicator, INDICATOR_VALUES),
+            project_city=self.project_city,
+            project_county_name=self.project_county_name,
+            project_state=_parse_state(self.project_state),
+            project_zip=self.project_zip,
+            jobs_reported=self.jobs_reported,
+            naics_code=self.naics_code or None,
+            utilities_proceed=self.utilities_proceed,
+            payroll_proceed=self.payroll_proceed,
+            mortgage_interest_proceed=self.mortgage_interest_proceed,
+            rent_proceed=self.rent_proceed,
+            refinance_eidl_proceed=self.refinance_eidl_proceed,
+            health_care_proceed=self.health_care_proceed,
+            debt_interest_proceed=self.debt_interest_proceed,
+            originating_lender_location_id=_parse_int(self.originating_lender_location_id),
+            non_profit=_parse_enum(self.non_profit, INDICATOR_VALUES),
+            forgiveness_amount=self.forgiveness_amount,
+            forgiveness_date=self.forgiveness_date.date() if self.forgiveness_date else None,
+            shard_id=self.shard_id,
+            **codes,
+        )
+
+class PPPLoanCompactSchema(SerializableBaseModel):
+    """Schema for a row of the compact PPP loan table (ppp_loan_data_compact).
+
+    Field order matches the COPY column order used by the pipeline.
+    """
+    loan_number: int
+    date_approved: datetime.date
+    borrower_name: str
+    borrower_name_normalized: Optional[str] = None
+    borrower_address: Optional[str] = None
+    borrower_city: Optional[str] = None
+    borrower_state: Optional[str] = None
+    borrower_zip: Optional[str] = None
+    loan_status_date: Optional[datetime.date] = None
+    term: Optional[int] = None
+    sba_guaranty_percentage: Optional[float] = None
+    initial_approval_amount: Optional[float] = None
+    current_approval_amount: Optional[float] = None
+    undisbursed_amount: Optional[float] = None
+    franchise_name: Optional[str] = None
+    servicing_lender_location_id: Optional[int] = None
+    rural_urban_indicator: Optional[str] = None
+    hubzone_indicator: Optional[str] = None
+    lmi_indicator: Optional[str] = None
+    project_city: Optional[str] = None
+    project_county_name: Optional[str] = None
+    project_state: Optional[str] = None
+    project_zip: Optional[str] = None
+    jobs_reported: Optional[int] = None
+    naics_code: Optional[str] = None
+    utilities_proceed: Optional[float] = None
+    payroll_proceed: Optional[float] = None
+    mortgage_interest_proceed: Optional[float] = None
+    rent_proceed: Optional[float] = None
+    refinance_eidl_proceed: Optional[float] = None
+    health_care_proceed: Optional[float] = None
+    debt_interest_proceed: Optional[float] = None
+    originating_lender_location_id: Optional[int] = None
+    non_profit: Optional[str] = None
+    forgiveness_amount: Optional[float] = None
+    forgiveness_date: Optional[datetime.date] = None
+
+    # -- Category Codes (see sql.CATEGORY_COLUMNS) -- #
+    sba_office_code_code: Optional[int] = None
+    processing_method_code: Optional[int] = None
+    loan_status_code: Optional[int] = None
+    business_age_description_code: Optional[int] = None
+    cd_code: Optional[int] = None
+    race_code: Optional[int] = None
+    ethnicity_code: Optional[int] = None
+    gender_code: Optional[int] = None
+    veteran_code: Optional[int] = None
+    business_type_code: Optional[int] = None
+
+    shard_id: int
+
+class LenderSchema(SerializableBaseModel):
+    """Schema for a row of the deduplicated lender dimension (ppp_lender)."""
+    location_id: int
+    name: Optional[str] = None
+    address: Optional[str] = None
+    city: Optional[str] = None
+    state: Optional[str] = None
+    zip: Optional[str] = None
+
+    @property
+    def shard_id(self) -> int:
+        """Compute shard ID from the lender location id."""
+        return self.location_id
+
+    def completeness(self) -> Tuple[int, Tuple[str, ...]]:
+        """Returns a sort key preferring the most complete record, ties broken deterministically."""
+        values = (self.name, self.address, self.city, self.state, self.zip)
+        return sum(value is not None for value in values), tuple(value or "" for value in values)
+
+class CategoryCodeSchema(SerializableBaseModel):
+    """Schema for a row of the ppp_category lookup table."""
+    category: str
+    code: int
+    label: str
+
+class LoanRollupSchema(ValidatedBaseModel):
+    """Schema for a pre-aggregated rollup row (per state, lender, NAICS code or business type)."""
+    model_config = ConfigDict(from_attributes=True)
+
+    group_key: str = Field(..., description="Value the loans were grouped by, 'Unknown' when it was missing")
+    loan_count: int = Field(..., description="Number of loans in the group")
+    approval_count: int = Field(..., description="Number of loans in the group with an approval amount")
+    total_approval_amount: Optional[float] = Field(None, description="Sum of the current approval amounts")
+    avg_approval_amount: Optional[float] = Field(None, description="Average current approval amount")
+    total_forgiveness_amount: Optional[float] = Field(None, description="Sum of the forgiveness amounts")
+    total_jobs_reported: Optional[int] = Field(None, description="Sum of the jobs reported")
+
+class LoanNumbersRequest(ValidatedBaseModel):
+    loan_numbers: List[str] = Field(..., min_length=1, max_length=MAX_LOAN_NUMBER_BATCH, description="The loan numbers to look up")
+
+class LoanNumbersResponse(ValidatedBaseModel):
+    loans: List[PPPLoanDataSchema] = Field(..., description="The loans found, in the order they were asked for")
+    missing: List[str] = Field(..., description="The loan numbers that weren't found")
+
+class BorrowerSuggestion(ValidatedBaseModel):
+    borrower_name: str = Field(..., description="A borrower name starting with the typed prefix")
+    loan_count: int = Field(..., description="Number of loans under that (normalized) name")
+
 class QuestionRequest(ValidatedBaseModel):
     question: str = Field(..., min_length=1, max_length=500, description="The question to ask the database")
 
 class QuestionResponse(ValidatedBaseModel):
     question: str
     postgres_sql_query: str
+    # the template that answered the question, None when the LLM wrote the SQL
+    intent: Optional[str] = None
     result: list
+    # whether the query returned more rows than result holds, and how many it returned (None if counting was too slow)
+    truncated: bool = False
+    row_count: Optional[int] = None
     response: str
     success: bool = True
\ No newline at end of file
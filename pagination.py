@@ -0,0 +1,50 @@
+import json
+import base64
+import datetime as dt
+
+from typing import Any, Callable, List, Sequence
+
+# Response header carrying the cursor of the next page, absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def _to_json(value: Any) -> Any:
+    """Convert a sort key value to something JSON can carry (dates as ISO strings)."""
+    if isinstance(value, dt.datetime):
+        return value.date().isoformat()
+    if isinstance(value, dt.date):
+        return value.isoformat()
+    return value
+
+def encode_cursor(kind: str, values: Sequence[Any]) -> str:
+    """Encodes the sort key of the last row of a page as an opaque cursor.
+
+    Args:
+        kind (str): Which listing the cursor belongs to, so a cursor can't be replayed against another sort.
+        values (Sequence[Any]): The sort key values of the last row returned.
+
+    Returns:
+        str: URL safe base64 cursor.
+    """
+    payload = json.dumps({"k": kind, "v": [_to_json(value) for value in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(kind: str, cursor: str, types: Sequence[Callable[[Any], Any]]) -> List[Any]:
+    """Decodes a cursor produced by encode_cursor back into its sort key values.
+
+    Args:
+        kind (str): The listing the cursor is expected to belong to.
+        cursor (str): The cursor from the X-Next-Cursor header.
+        types (Sequence[Callable]): One converter per sort key column (e.g. dt.date.fromisoformat, str).
+
+    Raises:
+        ValueError: If the cursor is malformed or belongs to another listing.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["v"]
+        if payload["k"] != kind or len(values) != len(types):
+            raise ValueError
+        return [convert(value) for convert, value in zip(types, values)]
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}") from None
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from metrics import REPLICA_LAG, REPLICA_USABLE
+from sql import DATASET_GENERATION_TABLE
+
+# set up logging
+logger = logging.getLogger(__name__)
+
+# seconds the replica is behind the primary, 0 when it has replayed everything it received (an idle primary
+# doesn't make a caught up replica look stale) or when it isn't a streaming standby at all. After a restart the
+# received position starts over at the beginning of the WAL segment, behind what was already replayed.
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+class ReplicaMonitor:
+    """Tracks whether the read replica can serve reads.
+
+    It can while it answers, is at most max_lag seconds behind the primary and has replayed the dataset generation
+    the primary announced, otherwise a reload the primary already finished would be served (and cached under the
+    new generation) from the old rows. check() runs every interval seconds, callers that fail to reach the replica
+    in between report it with mark_unavailable().
+    """
+
+    def __init__(self, engine: AsyncEngine, max_lag: float, interval: float, timeout: float) -> None:
+        self.engine = engine
+        self.max_lag = max_lag
+        self.interval = interval
+        self.timeout = timeout
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.generation: Optional[int] = None
+
+    def usable(self, generation: Optional[int]) -> bool:
+        """Whether reads can go to the replica, given the primary's current dataset generation (None if unknown)."""
+        if not self.healthy:
+            return False
+        return generation is None or (self.generation is not None and self.generation >= generation)
+
+    def mark_unavailable(self, error: Exception) -> None:
+        """Sends reads to the primary until the next successful check."""
+        if self.healthy:
+            logger.warning(f"Read replica unavailable, reading from the primary: {error!r}")
+        self.healthy = False
+        REPLICA_USABLE.set(0)
+
+    async def check(self) -> None:
+        """Measures the replica's lag and dataset generation, and whether it is healthy."""
+        async def measure() -> None:
+            async with self.engine.connect() as conn:
+                self.lag = float(await conn.scalar(REPLICA_LAG_SQL))
+                exists = await conn.scalar(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": DATASET_GENERATION_TABLE})
+                self.generation = await conn.scalar(
+                    text(f"SELECT coalesce(max(generation), 0) FROM {DATASET_GENERATION_TABLE}")
+                ) if exists else 0
+
+        try:
+            await asyncio.wait_for(measure(), self.timeout)
+        except Exception as e:
+            self.mark_unavailable(e)
+            return
+        REPLICA_LAG.set(self.lag)
+        if self.lag > self.max_lag:
+            self.mark_unavailable(RuntimeError(f"replica is {self.lag:.1f}s behind, more than {self.max_lag}s"))
+            return
+        if not self.healthy:
+            logger.info(f"Read replica usable, {self.lag:.1f}s behind at dataset generation {self.generation}")
+        self.healthy = True
+        REPLICA_USABLE.set(1)
+
+    async def monitor(self) -> None:
+        """Runs check() every interval seconds until cancelled."""
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
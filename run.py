@@ -8,6 +8,7 @@ from models import PPPLoanDataSchema
 from typing import List, Optional
 
 from sql import CreateTempTables
+from snapshot import write_snapshot
 
 from utils import (
     ReadAndMapToPydanticSingle,
@@ -96,11 +97,34 @@ def run(argv: Optional[List[str]] = None) -> None:
             }
             | "Write to Postgres/CSV" >> WritePPPLoanDataToPostgresAndCSV(pipeline_options)
         )
+
+    ############################################################################
+    #                           ROLLUP STEP                                    #
+    ############################################################################
+    # the pipeline has finished writing once the `with` block exits
+    CreateTempTables().create_rollup_tables()
+    # the load recreated the loan and rollup tables, let the chatbot's read-only role read the new one
+    if os.getenv("CHAT_DB_USER"):
+        CreateTempTables().grant_chat_role()
+    # only now is the new data complete, tell the API to drop what it cached
+    CreateTempTables().bump_dataset_generation()
+    ############################################################################
+    #                           SNAPSHOT STEP                                  #
+    ############################################################################
+    # taken after the bump so the snapshot carries the new generation
+    if pipeline_options.ppp_snapshot_path:
+        write_snapshot(pipeline_options.ppp_snapshot_path)
         
 def main():
     full_argv = sys.argv[1:] + config_to_argv("config.conf")
 
-    if CreateTempTables().create_tables():
+    # the DDL has to match how the sink routes rows to partitions, so both read the same option
+    table_options = construct_template_options()(flags=full_argv)
+    if CreateTempTables(
+        partition_by=table_options.ppp_partition_by.get(),
+        storage_schema=table_options.ppp_storage_schema,
+        date_index=table_options.ppp_date_index.get(),
+    ).create_tables():
         run(full_argv)
     else:
         logging.error("Table creation failed; aborting pipeline run.")
@@ -1,17 +1,35 @@
 import os
+import anyio
+import asyncio
+import asyncpg
 import logging
-from typing import List, AsyncGenerator, Optional
-from datetime import date
+from typing import Any, List, AsyncGenerator, AsyncIterator, Literal, Optional, Tuple
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
+from datetime import date, datetime, time
 
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
+from pydantic_core import to_jsonable_python
 
-from models import PPPLoanDataSchema, QuestionRequest, QuestionResponse
-from machine_learning_application.query_generator import generate_query, query_database, generate_response
+from models import LOAN_NUMBER_PATTERN, PPPLoanDataSchema, BorrowerSuggestion, LoanNumbersRequest, LoanNumbersResponse, LoanRollupSchema, QuestionRequest, QuestionResponse
+from sql import DEFAULT_CHAT_STATEMENT_TIMEOUT, UNKNOWN_ROLLUP_KEY
+from utils import normalize
+from pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
+from cache import MISSING, DatasetGeneration, PersistentCache, TTLCache
+from encoding import dumps, dumps_loan, dumps_loans, loan_to_dict
+from typeahead import BorrowerNameIndex
+from replica import ReplicaMonitor
+from snapshot import LoanSnapshot, snapshot_filters
+from http_cache import CompressionMiddleware, ConditionalGetMiddleware
+from metrics import CONTENT_TYPE_LATEST, InstrumentedAsyncPool, MetricsMiddleware, ask_question_stage, count_chat_cache_lookup, count_chat_intent, count_chat_query_plan, instrument_engine, render_metrics
+from machine_learning_application.intents import match_intent
+from machine_learning_application.query_generator import PROMPT_VERSION, RESPONSE_ERROR_PREFIX, generate_query, generate_response, new_openai_client, normalize_question, stream_response
 
-from sqlalchemy import String, Float, Date, Integer
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import String, Text, Float, Date, Integer, BigInteger, TypeDecorator, and_, any_, case, cast, func, literal, literal_column, or_, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncConnection, AsyncEngine, AsyncSession
 from sqlalchemy.orm import declarative_base, mapped_column, Mapped
 from sqlalchemy.future import select
 
@@ -25,16 +43,198 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "postgres")
+PPP_STORAGE_SCHEMA = os.getenv("PPP_STORAGE_SCHEMA", "wide")
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# serving profile, "production" turns off the SQL echo, sizes the pool for load and warms it at startup.
+# Every setting can still be overridden on its own. Each worker process has its own pool.
+API_PROFILES = ("dev", "production")
+API_PROFILE = os.getenv("API_PROFILE", "dev")
+if API_PROFILE not in API_PROFILES:
+    raise ValueError(f"Unknown API_PROFILE: {API_PROFILE}. Expected one of {API_PROFILES}")
+PRODUCTION = API_PROFILE == "production"
+
+def env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes")
+
+DB_ECHO = env_flag("DB_ECHO", not PRODUCTION)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10" if PRODUCTION else "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# pinging costs a round trip per checkout, recycling already retires connections before the server side times them out
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", False)
+# asyncpg prepared statements cached per connection, set it to 0 behind a transaction pooling pgbouncer
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500" if PRODUCTION else "100"))
+DB_WARMUP = env_flag("DB_WARMUP", PRODUCTION)
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))
+
+# optional streaming read replica, the read-only endpoints and the chatbot use it while it is reachable and caught up,
+# so API reads don't compete with the pipeline's bulk loads on the primary. Unset DB_REPLICA_HOST to read from the primary.
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", DB_PORT)
+DB_REPLICA_USER = os.getenv("DB_REPLICA_USER", DB_USER)
+DB_REPLICA_PASSWORD = os.getenv("DB_REPLICA_PASSWORD", DB_PASSWORD)
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "30"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+DB_REPLICA_CONNECT_TIMEOUT = float(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "2"))
+REPLICA_DATABASE_URL = f"postgresql+asyncpg://{DB_REPLICA_USER}:{DB_REPLICA_PASSWORD}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+
+# serve the /loans endpoints from a memory-mapped Arrow snapshot (see snapshot.py) instead of the database, for demo
+# and edge deployments without Postgres. The analytics endpoints and the chatbot need the database and answer 503.
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+
+# response cache for the hot read endpoints, keyed by the dataset generation so a reload invalidates it
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# /ask-question caches the SQL generated for a question, and the rows and summary of a SQL query per dataset generation.
+# With CHAT_CACHE_PATH both are kept in that SQLite file too, so they survive restarts and the workers share them.
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1024"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "86400"))
+CHAT_CACHE_PATH = os.getenv("CHAT_CACHE_PATH")
+
+# the chatbot's generated SQL runs on its own small pool whose sessions are read only with a statement timeout, as the
+# role sql.CreateTempTables.grant_chat_role creates (CHAT_DB_USER), or as DB_USER when there is none.
+# At most CHAT_MAX_ROWS rows are fetched, a truncated result is counted if that takes under CHAT_COUNT_TIMEOUT seconds.
+CHAT_DB_USER = os.getenv("CHAT_DB_USER", DB_USER)
+CHAT_DB_PASSWORD = os.getenv("CHAT_DB_PASSWORD", DB_PASSWORD if CHAT_DB_USER == DB_USER else "")
+CHAT_STATEMENT_TIMEOUT = float(os.getenv("CHAT_STATEMENT_TIMEOUT", str(DEFAULT_CHAT_STATEMENT_TIMEOUT)))
+CHAT_MAX_ROWS = int(os.getenv("CHAT_MAX_ROWS", "1000"))
+CHAT_COUNT_TIMEOUT = float(os.getenv("CHAT_COUNT_TIMEOUT", "1"))
+CHAT_POOL_SIZE = int(os.getenv("CHAT_POOL_SIZE", "5"))
+# the chatbot's SQL is EXPLAINed before it runs. A plan estimated to cost more than CHAT_MAX_COST (planner cost units,
+# reading a page sequentially costs 1) or to return more than CHAT_MAX_ROWS rows is planned again under a LIMIT,
+# and the query is rejected if that still costs too much. The default lets a few scans of the full table through.
+CHAT_MAX_COST = float(os.getenv("CHAT_MAX_COST", "10000000"))
+CHAT_DATABASE_URL = f"postgresql+asyncpg://{CHAT_DB_USER}:{CHAT_DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+CHAT_REPLICA_DATABASE_URL = f"postgresql+asyncpg://{CHAT_DB_USER}:{CHAT_DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+
+# borrower name typeahead, held in memory by every worker and rebuilt whenever the dataset generation changes
+TYPEAHEAD = env_flag("TYPEAHEAD", True)
+TYPEAHEAD_RETRY_DELAY = float(os.getenv("TYPEAHEAD_RETRY_DELAY", "30"))
+TYPEAHEAD_FETCH_SIZE = 50000
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 25
+
+# responses of at least this many bytes are compressed (brotli or gzip, whichever the client prefers)
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+# part of every ETag, bump it when the response format of an endpoint changes so clients don't keep the old one
+RESPONSE_FORMAT_VERSION = "1"
+
+# search result limits (page sizes for the keyset paginated listings)
+DEFAULT_LOANS_LIMIT = 10
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+DEFAULT_ROLLUP_LIMIT = 25
+MAX_ROLLUP_LIMIT = 1000
+
+# export streaming (rows per server side cursor fetch, COPY chunks buffered ahead of a slow client)
+EXPORT_BATCH_SIZE = 5000
+EXPORT_QUEUE_SIZE = 16
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
 # set up SQLAlchemy
-engine = create_async_engine(DATABASE_URL, echo=True)
+def make_engine(
+    url: str,
+    pool_pre_ping: bool = DB_POOL_PRE_PING,
+    pool_size: int = DB_POOL_SIZE,
+    max_overflow: int = DB_MAX_OVERFLOW,
+    **connect_args,
+) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        echo=DB_ECHO,
+        poolclass=InstrumentedAsyncPool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=pool_pre_ping,
+        connect_args={"prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE, **connect_args},
+    )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+engine = make_engine(DATABASE_URL)
 async_session = async_sessionmaker(engine, expire_on_commit=False)
+replica_engine: Optional[AsyncEngine] = None
+replica: Optional[ReplicaMonitor] = None
+if DB_REPLICA_HOST:
+    # read only at the session level too, a replica pointed at the primary by mistake still can't be written to.
+    # Pinged on checkout, a pooled connection to a replica that went away has to fail there to fall back.
+    replica_engine = make_engine(
+        REPLICA_DATABASE_URL,
+        pool_pre_ping=True,
+        timeout=DB_REPLICA_CONNECT_TIMEOUT,
+        server_settings={"default_transaction_read_only": "on"},
+    )
+    replica = ReplicaMonitor(replica_engine, DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_CONNECT_TIMEOUT)
+
+# the chatbot's pools, no overflow so a burst of slow generated queries can't take more than CHAT_POOL_SIZE connections.
+# Its SQL is different every time, caching prepared statements would only fill the cache.
+def make_chat_engine(url: str, **connect_args) -> AsyncEngine:
+    return make_engine(
+        url,
+        pool_size=CHAT_POOL_SIZE,
+        max_overflow=0,
+        prepared_statement_cache_size=0,
+        server_settings={
+            "default_transaction_read_only": "on",
+            "statement_timeout": f"{round(CHAT_STATEMENT_TIMEOUT * 1000)}ms",
+        },
+        **connect_args,
+    )
+
+chat_engine = make_chat_engine(CHAT_DATABASE_URL)
+chat_replica_engine: Optional[AsyncEngine] = None
+if DB_REPLICA_HOST:
+    chat_replica_engine = make_chat_engine(CHAT_REPLICA_DATABASE_URL, pool_pre_ping=True, timeout=DB_REPLICA_CONNECT_TIMEOUT)
 Base = declarative_base()
 
+# response cache, only used while the dataset generation listener is connected
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+# normalized question -> SQL, the schema only changes with PROMPT_VERSION so this doesn't depend on the generation
+chat_sql_cache = PersistentCache(CHAT_CACHE_PATH, "chat_sql", CHAT_CACHE_SIZE, CHAT_CACHE_TTL)
+# (generation, SQL) -> {"result": rows as JSON, "response": summary}, only used while the generation is known
+chat_answer_cache = PersistentCache(CHAT_CACHE_PATH, "chat_answers", CHAT_CACHE_SIZE, CHAT_CACHE_TTL)
+dataset_generation = DatasetGeneration(f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+# None until the first build finished
+borrower_names: Optional[BorrowerNameIndex] = None
+# opening a snapshot only maps its files, the pages are read (once for every worker) as requests touch them
+snapshot: Optional[LoanSnapshot] = None
+if SNAPSHOT_PATH:
+    snapshot = LoanSnapshot(SNAPSHOT_PATH)
+    dataset_generation.pin(snapshot.generation)
+    logger.info(f"Serving {len(snapshot)} loans from the snapshot at {SNAPSHOT_PATH}, dataset generation {snapshot.generation}")
+# the chatbot's OpenAI calls share one client, so concurrent questions reuse its connections
+openai_client = new_openai_client()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tasks = []
+    if snapshot is None:
+        tasks.append(asyncio.create_task(dataset_generation.listen()))
+    if replica is not None and snapshot is None:
+        await replica.check()
+        tasks.append(asyncio.create_task(replica.monitor()))
+    if TYPEAHEAD:
+        tasks.append(asyncio.create_task(maintain_borrower_names()))
+    if DB_WARMUP and snapshot is None:
+        try:
+            await warm_pool()
+        except Exception as e:
+            # not fatal, /ready reports the database as unavailable until it is reachable
+            logger.warning(f"Could not warm the database pool: {e}")
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await openai_client.aclose()
+
 # intialize the app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # only allow local dev and production domain (once i make one) to access the API
 origins = [
@@ -44,20 +244,65 @@ origins = [
     "http://localhost:80",
     "http://localhost:8001",
 ]
+# the responses of these endpoints only change with the dataset, they get ETags derived from the dataset generation
+# and the query, and a matching If-None-Match is answered with 304 before the endpoint runs
+CONDITIONAL_GET_PATHS = [
+    "/loans",
+    "/loans/search",
+    "/loans/search/by-borrower",
+    "/loans/search/by-loan-number",
+    "/loans/search/by-date-range",
+    "/loans/search/by-forgiveness-amount",
+    "/loans/top-borrowers",
+    "/loans/export",
+    "/analytics/by-state",
+    "/analytics/by-lender",
+    "/analytics/by-naics",
+    "/analytics/by-business-type",
+]
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+app.add_middleware(
+    ConditionalGetMiddleware,
+    router=app.router,
+    paths=CONDITIONAL_GET_PATHS,
+    generation=lambda: dataset_generation.current,
+    version=RESPONSE_FORMAT_VERSION,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+# per route latency, SQL time and rows of every request, exposed at /metrics
+app.add_middleware(MetricsMiddleware)
+# The compact storage schema keeps loan numbers as BIGINT, comparing them as integers keeps its primary key usable
+class LoanNumber(TypeDecorator):
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        # a loan number the loader would have rejected (not digits, leading zeros) can't exist in the compact table,
+        # NULL matches nothing where comparing it as an integer would match another loan
+        if value is None or not LOAN_NUMBER_PATTERN.fullmatch(str(value)):
+            return None
+        return int(value)
+
+    def process_result_value(self, value, dialect):
+        return str(value) if value is not None else None
+
+LoanNumberType = LoanNumber if PPP_STORAGE_SCHEMA == "compact" else String
+
 # SQLAlchemy Model
 class PPPLoanData(Base):
-    __tablename__ = "ppp_loan_data_airflow" #sql table name for the ppp loan data
+    __tablename__ = "ppp_loan_data_airflow" #sql table name for the ppp loan data (a view over the compact table in compact mode)
 
-    loan_number: Mapped[str] = mapped_column(String, primary_key=True)
+    loan_number: Mapped[str] = mapped_column(LoanNumberType, primary_key=True)
     date_approved: Mapped[Optional[Date]] = mapped_column(Date)
     borrower_name: Mapped[Optional[str]] = mapped_column(String)
+    borrower_name_normalized: Mapped[Optional[str]] = mapped_column(String)
 
     sba_office_code: Mapped[Optional[str]] = mapped_column(String)
     processing_method: Mapped[Optional[str]] = mapped_column(String)
@@ -116,11 +361,143 @@ class PPPLoanData(Base):
     forgiveness_amount: Mapped[Optional[float]] = mapped_column(Float)
     forgiveness_date: Mapped[Optional[Date]] = mapped_column(Date)
 
+# SQLAlchemy Models for the rollup tables built by sql.CreateTempTables.create_rollup_tables
+class LoanRollup:
+    group_key: Mapped[str] = mapped_column(String, primary_key=True)
+    loan_count: Mapped[int] = mapped_column(BigInteger)
+    approval_count: Mapped[int] = mapped_column(BigInteger)
+    total_approval_amount: Mapped[Optional[float]] = mapped_column(Float)
+    avg_approval_amount: Mapped[Optional[float]] = mapped_column(Float)
+    total_forgiveness_amount: Mapped[Optional[float]] = mapped_column(Float)
+    total_jobs_reported: Mapped[Optional[int]] = mapped_column(BigInteger)
+
+class StateRollup(LoanRollup, Base):
+    __tablename__ = "ppp_rollup_state"
+
+class ServicingLenderRollup(LoanRollup, Base):
+    __tablename__ = "ppp_rollup_servicing_lender"
+
+class OriginatingLenderRollup(LoanRollup, Base):
+    __tablename__ = "ppp_rollup_originating_lender"
+
+class NAICSRollup(LoanRollup, Base):
+    __tablename__ = "ppp_rollup_naics"
+
+class BusinessTypeRollup(LoanRollup, Base):
+    __tablename__ = "ppp_rollup_business_type"
+
+RollupOrder = Literal["loan_count", "total_approval_amount", "avg_approval_amount", "total_forgiveness_amount", "total_jobs_reported"]
+
 # get the db session
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
 
+async def connect_for_read(chat: bool = False) -> AsyncConnection:
+    """Checks out a connection for a read: on the replica while it is usable, on the primary otherwise.
+
+    Reaching the replica is tried up front, so when it went away since its last check the read falls back to the
+    primary instead of failing. chat checks it out of the chatbot's read-only pools instead.
+    """
+    primary, secondary = (chat_engine, chat_replica_engine) if chat else (engine, replica_engine)
+    if replica is not None and replica.usable(dataset_generation.current):
+        try:
+            return await secondary.connect()
+        except Exception as e:
+            replica.mark_unavailable(e)
+    return await primary.connect()
+
+def require_database() -> None:
+    if snapshot is not None:
+        raise HTTPException(status_code=503, detail="Not available while serving a snapshot, this endpoint needs the database")
+
+# get a db session for the read-only endpoints, see connect_for_read
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    require_database()
+    conn = await connect_for_read()
+    try:
+        async with AsyncSession(bind=conn, expire_on_commit=False) as session:
+            yield session
+    finally:
+        await conn.close()
+
+# the /loans endpoints read the snapshot instead when there is one, they get no session then
+async def get_loan_session() -> AsyncGenerator[Optional[AsyncSession], None]:
+    if snapshot is not None:
+        yield None
+        return
+    async for session in get_read_session():
+        yield session
+
+async def warm_pool() -> None:
+    """Opens pool_size connections and prepares the hot queries on each one before the first request arrives.
+
+    Prepared statements are per connection, the statements are the ones the endpoints run for a first page so
+    they hit the same asyncpg statement cache entries (and SQLAlchemy's compiled cache).
+    """
+    statements = [
+        select(PPPLoanData).order_by(PPPLoanData.loan_number).limit(DEFAULT_LOANS_LIMIT + 1),
+        select(PPPLoanData).where(PPPLoanData.loan_number == ""),
+        select(PPPLoanData).where(PPPLoanData.forgiveness_amount != None).order_by(PPPLoanData.forgiveness_amount.desc()).limit(10),
+        select(PPPLoanData).where(
+            PPPLoanData.date_approved >= date.min, PPPLoanData.date_approved <= date.min,
+        ).order_by(PPPLoanData.date_approved, PPPLoanData.loan_number).limit(DEFAULT_SEARCH_LIMIT + 1),
+    ]
+    for target in (engine, replica_engine):
+        if target is None:
+            continue
+        async with AsyncExitStack() as stack:
+            # checked out all at once, otherwise the pool would hand the same connection back every time
+            connections = await asyncio.gather(*(stack.enter_async_context(target.connect()) for _ in range(DB_POOL_SIZE)))
+            for conn in connections:
+                for stmt in statements:
+                    await conn.execute(stmt)
+        logger.info(f"Warmed {len(connections)} connections to {target.url.host}")
+
+async def load_borrower_names() -> BorrowerNameIndex:
+    """Builds the typeahead index from one GROUP BY over the loans.
+
+    The names come back in "C" collation order, which is the order Python compares them in, so indexing them
+    doesn't have to sort them again.
+    """
+    if snapshot is not None:
+        entries = await anyio.to_thread.run_sync(snapshot.borrower_names)
+        return await anyio.to_thread.run_sync(BorrowerNameIndex, entries)
+    name = PPPLoanData.borrower_name_normalized
+    stmt = (
+        select(name, func.min(PPPLoanData.borrower_name), func.count())
+        .where(name.is_not(None))
+        .group_by(name)
+        .order_by(name.collate("C"))
+    )
+    conn = await connect_for_read()
+    try:
+        result = await conn.stream(stmt.execution_options(yield_per=TYPEAHEAD_FETCH_SIZE))
+        entries = [tuple(row) async for row in result]
+    finally:
+        await conn.close()
+    return await anyio.to_thread.run_sync(BorrowerNameIndex, entries)
+
+async def refresh_borrower_names() -> None:
+    global borrower_names
+    borrower_names = await load_borrower_names()
+    logger.info(f"Borrower name typeahead holds {len(borrower_names)} names")
+
+async def maintain_borrower_names() -> None:
+    """Builds the typeahead index at startup, then again every time the dataset generation changes."""
+    # give the generation listener a moment to connect, a build under an unknown generation is redone once it is known
+    with suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(dataset_generation.changed(None), 5)
+    while True:
+        generation = dataset_generation.current
+        try:
+            await refresh_borrower_names()
+        except Exception as e:
+            logger.warning(f"Could not build the borrower name typeahead, retrying in {TYPEAHEAD_RETRY_DELAY}s: {e}")
+            await asyncio.sleep(TYPEAHEAD_RETRY_DELAY)
+            continue
+        await dataset_generation.changed(generation)
+
 # fastapi app routes
 """
 This endpoint just reutns a health check for the API.
@@ -129,26 +506,209 @@ This endpoint just reutns a health check for the API.
 async def health_check():
     return {"status": "ok"}
 """
-This endpoint retrieves a list of PPP loans from the database.
+This endpoint reports whether the API can serve requests, i.e. whether the database answers within READY_TIMEOUT.
+Returns 503 when it doesn't, so a load balancer or orchestrator stops routing to this worker until it does.
+A worker serving a snapshot is ready as soon as it started, and reports the snapshot's dataset generation.
+"""
+@app.get("/ready")
+async def readiness_check():
+    if snapshot is not None:
+        return {"status": "ready", "snapshot": snapshot.generation}
+
+    async def ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    try:
+        await asyncio.wait_for(ping(), READY_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Readiness check failed: {e!r}")
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    if replica is not None:
+        # not part of readiness, reads fall back to the primary without it
+        return {"status": "ready", "replica": "usable" if replica.usable(dataset_generation.current) else "unavailable"}
+    return {"status": "ready"}
+"""
+This endpoint exposes the API's metrics in the Prometheus text format: request latency per route and status code,
+SQL time and rows per request, in-flight requests, pool checkout waits and the /ask-question stages.
+"""
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+"""
+Every listing is keyset paginated: it returns at most `limit` loans in a fixed order and, when there are more,
+an opaque cursor in the X-Next-Cursor header. Passing it back as `cursor` continues right after the last row
+with an index range scan, so a deep page costs the same as the first one.
+"""
+def parse_cursor(kind: str, cursor: Optional[str], types) -> Optional[list]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(kind, cursor, types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def keyset_row(*columns_and_values):
+    # bind the cursor values with their column's type (loan_number is a BIGINT in the compact schema)
+    return tuple_(*(literal(value, column.type) for column, value in columns_and_values))
+
+def paginate(rows, limit: int, response: Response, kind: str, cursor_values) -> list:
+    # the queries fetch one row past the page to know whether there is a next page
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(kind, cursor_values(rows[-1]))
+    return rows
+
+"""
+Every loan endpoint takes an optional `fields` projection, a comma separated list of response keys
+(e.g. fields=BorrowerName,BorrowerCity,ForgivenessAmount, the column names work too).
+Only those columns are selected and the response objects are built straight from the rows, skipping the ORM
+and the full schema, so a client that shows six fields doesn't pay for all 53 of them.
+"""
+# response key of every stored column, the keys the full schema serializes them to, borrower_name_normalized is only
+# stored for the search index and isn't served
+LOAN_FIELD_KEYS = {
+    column.name: field.alias if (field := PPPLoanDataSchema.model_fields.get(column.name)) else column.name
+    for column in PPPLoanData.__table__.columns
+    if column.name != "borrower_name_normalized"
+}
+LOAN_FIELD_COLUMNS = {**{name: name for name in LOAN_FIELD_KEYS}, **{key: name for name, key in LOAN_FIELD_KEYS.items()}}
+
+def loan_projection(
+    fields: Optional[str] = Query(None, description="Comma separated response keys to return, e.g. LoanNumber,BorrowerName"),
+) -> Optional[Tuple[str, ...]]:
+    if fields is None:
+        return None
+    projection = []
+    for field in filter(None, (field.strip() for field in fields.split(","))):
+        name = LOAN_FIELD_COLUMNS.get(field)
+        if name is None:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+        if name not in projection:
+            projection.append(name)
+    if not projection:
+        raise HTTPException(status_code=400, detail="fields must name at least one field")
+    return tuple(projection)
+
+def project(stmt, projection: Tuple[str, ...], *sort_columns):
+    # keeps the filters and the order, the sort columns come last so the cursor can still be built from the row
+    return stmt.with_only_columns(*(getattr(PPPLoanData, name) for name in projection), *sort_columns)
+
+def projected_value(value):
+    # dates are returned the way the schema's datetime fields serialize them
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, time()).isoformat()
+    return value
+
+def projected_loan(row, projection: Tuple[str, ...]) -> dict:
+    return {LOAN_FIELD_KEYS[name]: projected_value(value) for name, value in zip(projection, row)}
+
+"""
+Loans read from the database were validated at ingest, so the loan endpoints encode them straight to JSON bytes
+(encoding.py) instead of letting FastAPI validate every row through PPPLoanDataSchema again.
+The response shape is the same, response_model is kept for the API docs.
+"""
+def json_response(body: bytes, response: Response) -> Response:
+    # returning a response skips response_model, the headers already set (the next cursor) are carried over
+    return Response(body, media_type="application/json", headers=dict(response.headers))
+
+"""
+While serving a snapshot (SNAPSHOT_PATH) the loan endpoints answer from it instead of the database, with the same
+responses and cursors. The snapshot's queries return row numbers in the endpoint's order (see snapshot.LoanSnapshot).
+"""
+def snapshot_loans(rows, projection: Optional[Tuple[str, ...]], *sort_columns: str) -> list:
+    # a projection only reads its own columns and the ones the cursor is built from
+    return snapshot.records(rows, None if projection is None else (*projection, *sort_columns))
+
+def snapshot_loan(loan, projection: Optional[Tuple[str, ...]]) -> dict:
+    if projection is not None:
+        return projected_loan([getattr(loan, name) for name in projection], projection)
+    return loan_to_dict(loan)
+
+def snapshot_page(rows, limit: int, response: Response, kind: str, projection: Optional[Tuple[str, ...]], *sort_columns: str) -> Response:
+    loans = snapshot_loans(rows[: limit + 1], projection, *sort_columns)
+    loans = paginate(loans, limit, response, kind, lambda loan: tuple(getattr(loan, column) for column in sort_columns))
+    return json_response(dumps([snapshot_loan(loan, projection) for loan in loans]), response)
+
+"""
+This endpoint retrieves a list of PPP loans from the database, ordered by loan number.
 """
 @app.get("/loans", response_model=List[PPPLoanDataSchema])
-async def get_loans(limit: int = 10, session: AsyncSession = Depends(get_session)):
-    stmt = select(PPPLoanData).limit(limit)
+async def get_loans(
+    response: Response,
+    limit: int = Query(DEFAULT_LOANS_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    cursor: Optional[str] = None,
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
+):
+    after = parse_cursor("loans", cursor, (str,))
+    if snapshot is not None:
+        return snapshot_page(snapshot.by_loan_number(after and after[0]), limit, response, "loans", projection, "loan_number")
+    stmt = select(PPPLoanData)
+    if after is not None:
+        stmt = stmt.where(PPPLoanData.loan_number > after[0])
+    stmt = stmt.order_by(PPPLoanData.loan_number).limit(limit + 1)
+    if projection is not None:
+        result = await session.execute(project(stmt, projection, PPPLoanData.loan_number))
+        rows = paginate(result.all(), limit, response, "loans", lambda row: (row[-1],))
+        return json_response(dumps([projected_loan(row, projection) for row in rows]), response)
     result = await session.execute(stmt)
-    return result.scalars().all()
+    loans = paginate(result.scalars().all(), limit, response, "loans", lambda loan: (loan.loan_number,))
+    return json_response(dumps_loans(loans), response)
 """
 This endpoint allows you to search for PPP loans by borrower name. 
+The name is normalized the same way as at ingest and matched against the trigram indexed
+borrower_name_normalized column, both as a substring and fuzzily (pg_trgm similarity).
+borrower_state and borrower_city narrow the matches down (see /loans/search for more filters).
 Returns a empty list if no loans are found under that borrower name.
-Returns the list of loans if found.
+Returns the list of loans if found, most similar names first.
 """
 @app.get("/loans/search/by-borrower", response_model=List[PPPLoanDataSchema])
 async def search_loans_by_borrower(
     borrower_name: str,
-    session: AsyncSession = Depends(get_session),
+    response: Response,
+    borrower_state: Optional[str] = None,
+    borrower_city: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    cursor: Optional[str] = None,
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
 ):
-    stmt = select(PPPLoanData).where(PPPLoanData.borrower_name.ilike(f"%{borrower_name}%"))
+    normalized_name = normalize(borrower_name)
+    if not normalized_name:
+        return []
+
+    after = parse_cursor("by-borrower", cursor, (float, str))
+    if snapshot is not None:
+        filters = snapshot_filters(borrower_state=borrower_state, borrower_city=borrower_city)
+        similarities, rows = await anyio.to_thread.run_sync(snapshot.by_borrower, normalized_name, filters, after)
+        loans = snapshot_loans(rows[: limit + 1], projection, "loan_number")
+        matches = paginate(
+            list(zip(similarities[: limit + 1].tolist(), loans)), limit, response, "by-borrower",
+            lambda match: (match[0], match[1].loan_number),
+        )
+        return json_response(dumps([snapshot_loan(loan, projection) for _, loan in matches]), response)
+
+    similarity = func.similarity(PPPLoanData.borrower_name_normalized, normalized_name)
+    stmt = select(PPPLoanData, similarity).where(
+        or_(
+            PPPLoanData.borrower_name_normalized.contains(normalized_name, autoescape=True),
+            PPPLoanData.borrower_name_normalized.op("%")(normalized_name),
+        ),
+        *loan_filters(borrower_state=borrower_state, borrower_city=borrower_city),
+    )
+    if after is not None:
+        # most similar first, ties broken by loan number
+        stmt = stmt.where(
+            or_(similarity < after[0], and_(similarity == after[0], PPPLoanData.loan_number > after[1]))
+        )
+    stmt = stmt.order_by(similarity.desc(), PPPLoanData.loan_number).limit(limit + 1)
+    if projection is not None:
+        result = await session.execute(project(stmt, projection, similarity, PPPLoanData.loan_number))
+        rows = paginate(result.all(), limit, response, "by-borrower", lambda row: (row[-2], row[-1]))
+        return json_response(dumps([projected_loan(row, projection) for row in rows]), response)
     result = await session.execute(stmt)
-    return result.scalars().all()
+    rows = paginate(result.all(), limit, response, "by-borrower", lambda row: (row[1], row[0].loan_number))
+    return json_response(dumps_loans(loan for loan, _ in rows), response)
 """
 This endpoint allows you to search for PPP loans by loan number.
 Raises an HTTPException if no loans are found under that loan number.
@@ -157,17 +717,78 @@ Returns a single loan if found.
 @app.get("/loans/search/by-loan-number", response_model=PPPLoanDataSchema)
 async def search_loans_by_loan_number(
     loan_number: str,
-    session: AsyncSession = Depends(get_session),
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
 ):
-    stmt = select(PPPLoanData).where(PPPLoanData.loan_number == loan_number)
-    result = await session.execute(stmt)
-    loan = result.scalar_one_or_none()
-    if loan is None:
+    # the encoded response is cached, misses too (as None), repeated lookups of a loan that doesn't exist are just as common
+    cache_key = dataset_generation.key("by-loan-number", loan_number, projection)
+    body = response_cache.get(cache_key) if cache_key else MISSING
+    if body is MISSING:
+        stmt = select(PPPLoanData).where(PPPLoanData.loan_number == loan_number)
+        if snapshot is not None:
+            row = snapshot.find(loan_number)
+            body = dumps(snapshot_loan(snapshot_loans([row], projection)[0], projection)) if row is not None else None
+        elif projection is not None:
+            result = await session.execute(project(stmt, projection))
+            row = result.first()
+            body = dumps(projected_loan(row, projection)) if row is not None else None
+        else:
+            result = await session.execute(stmt)
+            loan = result.scalar_one_or_none()
+            body = dumps_loan(loan) if loan is not None else None
+        if cache_key:
+            response_cache.set(cache_key, body)
+    if body is None:
         raise HTTPException(status_code=404, detail="Loan not found in the database.")
-    return loan
+    return Response(body, media_type="application/json")
 
 """
-This endpoint allows you to search for PPP loans by date range.
+This endpoint looks up a batch of loan numbers (at most MAX_LOAN_NUMBER_BATCH, 10,000) in a single query.
+Returns the loans found, in the order they were asked for, and the loan numbers that weren't found.
+"""
+@app.post("/loans/search/by-loan-numbers", response_model=LoanNumbersResponse)
+async def search_loans_by_loan_numbers(
+    request: LoanNumbersRequest,
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
+):
+    loan_numbers = list(dict.fromkeys(request.loan_numbers))
+    # the whole batch is bound as one array, loan_number = ANY($1) probes idx_loan_number once per loan number
+    batch = literal(loan_numbers, ARRAY(PPPLoanData.loan_number.type))
+    stmt = select(PPPLoanData).where(PPPLoanData.loan_number == any_(batch))
+    if snapshot is not None:
+        rows = {loan_number: row for loan_number in loan_numbers if (row := snapshot.find(loan_number)) is not None}
+        loans = snapshot_loans(list(rows.values()), projection)
+        found = {loan_number: snapshot_loan(loan, projection) for loan_number, loan in zip(rows, loans)}
+    elif projection is not None:
+        result = await session.execute(project(stmt, projection, PPPLoanData.loan_number))
+        found = {row[-1]: projected_loan(row, projection) for row in result.all()}
+    else:
+        result = await session.execute(stmt)
+        found = {loan.loan_number: loan_to_dict(loan) for loan in result.scalars().all()}
+    return Response(dumps({
+        "loans": [found[loan_number] for loan_number in loan_numbers if loan_number in found],
+        "missing": [loan_number for loan_number in loan_numbers if loan_number not in found],
+    }), media_type="application/json")
+
+"""
+This endpoint suggests borrower names as the user types, answered from the in-memory typeahead index
+without querying the database. Returns the names starting with `q` (normalized), most loans first,
+or 503 while the index is still being built.
+"""
+@app.get("/loans/suggest", response_model=List[BorrowerSuggestion])
+async def suggest_borrower_names(
+    q: str,
+    limit: int = Query(DEFAULT_SUGGEST_LIMIT, ge=1, le=MAX_SUGGEST_LIMIT),
+):
+    if borrower_names is None:
+        raise HTTPException(status_code=503, detail="Borrower name suggestions are not available yet")
+    return Response(dumps([
+        {"borrower_name": name, "loan_count": count} for name, count in borrower_names.complete(q, limit)
+    ]), media_type="application/json")
+
+"""
+This endpoint allows you to search for PPP loans by date range, ordered by approval date then loan number.
 Returns an empty list if no loans are found within that date range.
 Returns the list of loans if found.
 """
@@ -175,34 +796,177 @@ Returns the list of loans if found.
 async def search_loans_by_date_range(
     start_date: date,
     end_date: date,
-    session: AsyncSession = Depends(get_session),
+    response: Response,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    cursor: Optional[str] = None,
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
 ):
     stmt = select(PPPLoanData).where(
         PPPLoanData.date_approved >= start_date,
         PPPLoanData.date_approved <= end_date,
     )
+    after = parse_cursor("by-date-range", cursor, (date.fromisoformat, str))
+    if snapshot is not None:
+        rows = snapshot.by_date(start_date, end_date, after)
+        return snapshot_page(rows, limit, response, "by-date-range", projection, "date_approved", "loan_number")
+    if after is not None:
+        # row comparison, served by idx_date_approved_loan_number
+        stmt = stmt.where(tuple_(PPPLoanData.date_approved, PPPLoanData.loan_number) > keyset_row(
+            (PPPLoanData.date_approved, after[0]), (PPPLoanData.loan_number, after[1]),
+        ))
+    stmt = stmt.order_by(PPPLoanData.date_approved, PPPLoanData.loan_number).limit(limit + 1)
+    if projection is not None:
+        result = await session.execute(project(stmt, projection, PPPLoanData.date_approved, PPPLoanData.loan_number))
+        rows = paginate(result.all(), limit, response, "by-date-range", lambda row: (row[-2], row[-1]))
+        return json_response(dumps([projected_loan(row, projection) for row in rows]), response)
     result = await session.execute(stmt)
-    return result.scalars().all()
+    loans = paginate(
+        result.scalars().all(), limit, response, "by-date-range",
+        lambda loan: (loan.date_approved, loan.loan_number),
+    )
+    return json_response(dumps_loans(loans), response)
 
 """
-This endpoint allows you to search for PPP loans by forgiveness amount.
+This endpoint allows you to search for PPP loans by forgiveness amount, largest forgiveness first.
 Returns an empty list if no loans are found with a forgiveness amount greater than or equal to the specified amount.
 Returns the list of loans if found.
+`limti` is the original (misspelled) name of `limit` and is still accepted.
 """
 @app.get("/loans/search/by-forgiveness-amount", response_model=List[PPPLoanDataSchema])
 async def search_loans_by_forgiveness_amount(
     min_forgiveness_amount: float,
-    limti: int = 5,
-    session: AsyncSession = Depends(get_session),
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_SEARCH_LIMIT),
+    limti: Optional[int] = Query(None, ge=1, le=MAX_SEARCH_LIMIT, deprecated=True),
+    cursor: Optional[str] = None,
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
 ):
-    stmt = ( select(PPPLoanData).where(
-            PPPLoanData.forgiveness_amount != None,
-            PPPLoanData.forgiveness_amount >= min_forgiveness_amount,
-        )
-        .limit(limti)
+    limit = limit or limti or 5
+    stmt = select(PPPLoanData).where(
+        PPPLoanData.forgiveness_amount != None,
+        PPPLoanData.forgiveness_amount >= min_forgiveness_amount,
     )
+    after = parse_cursor("by-forgiveness-amount", cursor, (float, str))
+    if snapshot is not None:
+        rows = snapshot.by_forgiveness(min_forgiveness_amount, after)
+        return snapshot_page(rows, limit, response, "by-forgiveness-amount", projection, "forgiveness_amount", "loan_number")
+    if after is not None:
+        # both columns descending so the row comparison walks idx_forgiveness_amount_loan_number backwards
+        stmt = stmt.where(tuple_(PPPLoanData.forgiveness_amount, PPPLoanData.loan_number) < keyset_row(
+            (PPPLoanData.forgiveness_amount, after[0]), (PPPLoanData.loan_number, after[1]),
+        ))
+    stmt = stmt.order_by(PPPLoanData.forgiveness_amount.desc(), PPPLoanData.loan_number.desc()).limit(limit + 1)
+    if projection is not None:
+        result = await session.execute(project(stmt, projection, PPPLoanData.forgiveness_amount, PPPLoanData.loan_number))
+        rows = paginate(result.all(), limit, response, "by-forgiveness-amount", lambda row: (row[-2], row[-1]))
+        return json_response(dumps([projected_loan(row, projection) for row in rows]), response)
     result = await session.execute(stmt)
-    return result.scalars().all()
+    loans = paginate(
+        result.scalars().all(), limit, response, "by-forgiveness-amount",
+        lambda loan: (loan.forgiveness_amount, loan.loan_number),
+    )
+    return json_response(dumps_loans(loans), response)
+
+"""
+This endpoint searches PPP loans by any combination of filters, ordered by approval date then loan number.
+borrower_name is a substring match on the normalized name, borrower_city is case insensitive, borrower_zip matches
+on the 5 digit ZIP code, approval amounts are current approval amounts and lender is the exact lender name
+(as /analytics/by-lender lists them) of the servicing or originating lender, depending on lender_role.
+All filters go into one query as bind parameters. State, state + city, ZIP, NAICS code and lender each have a
+composite index ending in (date_approved, loan_number), so a narrow search reads only its own matches, in order.
+Returns an empty list if no loans match.
+"""
+def loan_filters(
+    borrower_name: Optional[str] = None,
+    borrower_state: Optional[str] = None,
+    borrower_city: Optional[str] = None,
+    borrower_zip: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    min_approval_amount: Optional[float] = None,
+    max_approval_amount: Optional[float] = None,
+    min_forgiveness_amount: Optional[float] = None,
+    lender: Optional[str] = None,
+    lender_role: Literal["servicing", "originating"] = "servicing",
+    naics_code: Optional[str] = None,
+) -> list:
+    # each comparison is written like the index expression it should use (see sql.CreateTempTables._get_search_index_sql)
+    filters = []
+    if borrower_name and normalize(borrower_name):
+        filters.append(PPPLoanData.borrower_name_normalized.contains(normalize(borrower_name), autoescape=True))
+    if borrower_state:
+        filters.append(PPPLoanData.borrower_state == borrower_state.strip().upper())
+    if borrower_city:
+        filters.append(func.upper(PPPLoanData.borrower_city) == borrower_city.strip().upper())
+    if borrower_zip:
+        # the length is inlined, a bound parameter wouldn't match the left(borrower_zip, 5) index expression
+        filters.append(func.left(PPPLoanData.borrower_zip, literal_column("5")) == borrower_zip.strip()[:5])
+    if start_date is not None:
+        filters.append(PPPLoanData.date_approved >= start_date)
+    if end_date is not None:
+        filters.append(PPPLoanData.date_approved <= end_date)
+    if min_approval_amount is not None:
+        filters.append(PPPLoanData.current_approval_amount >= min_approval_amount)
+    if max_approval_amount is not None:
+        filters.append(PPPLoanData.current_approval_amount <= max_approval_amount)
+    if min_forgiveness_amount is not None:
+        filters.append(PPPLoanData.forgiveness_amount >= min_forgiveness_amount)
+    if lender:
+        lender_name = PPPLoanData.servicing_lender_name if lender_role == "servicing" else PPPLoanData.originating_lender
+        filters.append(lender_name == lender)
+    if naics_code:
+        filters.append(PPPLoanData.naics_code == naics_code.strip())
+    return filters
+
+@app.get("/loans/search", response_model=List[PPPLoanDataSchema])
+async def search_loans(
+    response: Response,
+    borrower_name: Optional[str] = None,
+    borrower_state: Optional[str] = None,
+    borrower_city: Optional[str] = None,
+    borrower_zip: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    min_approval_amount: Optional[float] = None,
+    max_approval_amount: Optional[float] = None,
+    min_forgiveness_amount: Optional[float] = None,
+    lender: Optional[str] = None,
+    lender_role: Literal["servicing", "originating"] = "servicing",
+    naics_code: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    cursor: Optional[str] = None,
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
+):
+    stmt = select(PPPLoanData).where(*loan_filters(
+        borrower_name, borrower_state, borrower_city, borrower_zip, start_date, end_date,
+        min_approval_amount, max_approval_amount, min_forgiveness_amount, lender, lender_role, naics_code,
+    ))
+    after = parse_cursor("search", cursor, (date.fromisoformat, str))
+    if snapshot is not None:
+        filters = snapshot_filters(
+            borrower_name, borrower_state, borrower_city, borrower_zip,
+            min_approval_amount, max_approval_amount, min_forgiveness_amount, lender, lender_role, naics_code,
+        )
+        rows = await anyio.to_thread.run_sync(snapshot.scan, snapshot.by_date(start_date, end_date, after), filters, limit + 1)
+        return snapshot_page(rows, limit, response, "search", projection, "date_approved", "loan_number")
+    if after is not None:
+        stmt = stmt.where(tuple_(PPPLoanData.date_approved, PPPLoanData.loan_number) > keyset_row(
+            (PPPLoanData.date_approved, after[0]), (PPPLoanData.loan_number, after[1]),
+        ))
+    stmt = stmt.order_by(PPPLoanData.date_approved, PPPLoanData.loan_number).limit(limit + 1)
+    if projection is not None:
+        result = await session.execute(project(stmt, projection, PPPLoanData.date_approved, PPPLoanData.loan_number))
+        rows = paginate(result.all(), limit, response, "search", lambda row: (row[-2], row[-1]))
+        return json_response(dumps([projected_loan(row, projection) for row in rows]), response)
+    result = await session.execute(stmt)
+    loans = paginate(
+        result.scalars().all(), limit, response, "search",
+        lambda loan: (loan.date_approved, loan.loan_number),
+    )
+    return json_response(dumps_loans(loans), response)
 
 """
 This endpoint retrieves the top 10 borrowers with the highest forgiveness amounts.
@@ -210,23 +974,384 @@ Returns an empty list if no loans are found with a forgiveness amount.
 Returns a list of loans with the highest forgiveness amounts.
 """
 @app.get("/loans/top-borrowers", response_model=List[PPPLoanDataSchema])
-async def get_top_borrowers(session: AsyncSession = Depends(get_session)):
-    stmt = (
-        select(PPPLoanData)
-        .where(PPPLoanData.forgiveness_amount != None)
-        .order_by(PPPLoanData.forgiveness_amount.desc())
-        .limit(10)
+async def get_top_borrowers(
+    projection: Optional[Tuple[str, ...]] = Depends(loan_projection),
+    session: Optional[AsyncSession] = Depends(get_loan_session),
+):
+    # the homepage loads this on every visit and it only changes when the pipeline reloads the data
+    cache_key = dataset_generation.key("top-borrowers", projection)
+    body = response_cache.get(cache_key) if cache_key else MISSING
+    if body is MISSING:
+        stmt = (
+            select(PPPLoanData)
+            .where(PPPLoanData.forgiveness_amount != None)
+            .order_by(PPPLoanData.forgiveness_amount.desc())
+            .limit(10)
+        )
+        if snapshot is not None:
+            body = dumps([snapshot_loan(loan, projection) for loan in snapshot_loans(snapshot.by_forgiveness(None)[:10], projection)])
+        elif projection is not None:
+            result = await session.execute(project(stmt, projection))
+            body = dumps([projected_loan(row, projection) for row in result.all()])
+        else:
+            result = await session.execute(stmt)
+            body = dumps_loans(result.scalars().all())
+        if cache_key:
+            response_cache.set(cache_key, body)
+    return Response(body, media_type="application/json")
+    
+"""
+This endpoint streams every loan matching the filters as NDJSON or CSV, ordered by approval date then loan number.
+The filters are the ones of the search endpoints and can be combined.
+The result is never held in memory: CSV is written by Postgres itself (COPY ... TO STDOUT) and NDJSON is read
+through a server side cursor with each line built by row_to_json, so the server holds one batch at a time.
+NDJSON lines use the same keys as the JSON endpoints, CSV columns use the table's column names.
+"""
+def export_query(
+    start_date: Optional[date],
+    end_date: Optional[date],
+    state: Optional[str],
+    borrower_name: Optional[str],
+    min_forgiveness_amount: Optional[float],
+    json_keys: bool,
+):
+    columns = [column for column in PPPLoanData.__table__.columns if column.name != "borrower_name_normalized"]
+    labels = [PPPLoanDataSchema.model_fields[column.name].alias if json_keys else column.name for column in columns]
+    # loan numbers are exported as text like the JSON endpoints return them, even where they are stored as BIGINT
+    exported = [cast(column, Text) if column.name == "loan_number" else column for column in columns]
+    stmt = select(*(column.label(label) for column, label in zip(exported, labels))).where(*loan_filters(
+        borrower_name=borrower_name,
+        borrower_state=state,
+        start_date=start_date,
+        end_date=end_date,
+        min_forgiveness_amount=min_forgiveness_amount,
+    ))
+    return stmt.order_by(PPPLoanData.date_approved, PPPLoanData.loan_number)
+
+@asynccontextmanager
+async def export_connection() -> AsyncGenerator[AsyncConnection, None]:
+    # the stream outlives the request's session, so it checks out its own connection
+    conn = await connect_for_read()
+    finished = False
+    try:
+        yield conn
+        finished = True
+    finally:
+        # when the client goes away the request is cancelled, the cleanup is shielded or it would be cut short
+        # and leave a half closed connection in the pool. A stream that didn't finish can't be reused.
+        with anyio.CancelScope(shield=True):
+            if not finished:
+                await conn.invalidate()
+            await conn.close()
+
+def compile_for_asyncpg(stmt) -> Tuple[str, list]:
+    # the streams talk to asyncpg directly, so render the query with its $n placeholders and positional arguments
+    compiled = stmt.compile(dialect=engine.dialect)
+    params = compiled.construct_params()
+    return compiled.string, [params[name] for name in compiled.positiontup]
+
+async def stream_ndjson(stmt) -> AsyncGenerator[str, None]:
+    loans = stmt.subquery("loan")
+    # cast to text so the driver hands the JSON through instead of decoding it
+    query, args = compile_for_asyncpg(select(cast(func.row_to_json(loans.table_valued()), Text)))
+    async with export_connection() as conn:
+        driver_connection = (await conn.get_raw_connection()).driver_connection
+        # server side cursors only live inside a transaction
+        async with driver_connection.transaction():
+            cursor = await driver_connection.cursor(query, *args)
+            while rows := await cursor.fetch(EXPORT_BATCH_SIZE):
+                yield "".join(f"{row[0]}\n" for row in rows)
+
+async def stream_csv(stmt) -> AsyncGenerator[bytes, None]:
+    query, args = compile_for_asyncpg(stmt)
+
+    # COPY pushes chunks as fast as Postgres sends them, the bounded queue holds it back while the client catches up
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_QUEUE_SIZE)
+
+    async def buffer_chunk(chunk: bytearray) -> None:
+        # asyncpg reuses its buffer, so keep a copy
+        await chunks.put(bytes(chunk))
+
+    async with export_connection() as conn:
+        driver_connection = (await conn.get_raw_connection()).driver_connection
+        copy = asyncio.create_task(driver_connection.copy_from_query(
+            query, *args, output=buffer_chunk, format="csv", header=True,
+        ))
+        try:
+            while True:
+                next_chunk = asyncio.ensure_future(chunks.get())
+                done, _ = await asyncio.wait({next_chunk, copy}, return_when=asyncio.FIRST_COMPLETED)
+                if next_chunk in done:
+                    yield next_chunk.result()
+                    continue
+                while not chunks.empty():
+                    yield chunks.get_nowait()
+                copy.result()
+                return
+        finally:
+            next_chunk.cancel()
+            copy.cancel()
+            with anyio.CancelScope(shield=True):
+                await asyncio.gather(copy, next_chunk, return_exceptions=True)
+
+async def stream_snapshot(rows, filters, format: str) -> AsyncGenerator[bytes, None]:
+    # batches are found and encoded one at a time in a worker thread, so a slow client holds back the scan
+    batches = snapshot.scan_batches(rows, filters, EXPORT_BATCH_SIZE)
+    header = True
+    while (batch := await anyio.to_thread.run_sync(next, batches, None)) is not None:
+        yield await anyio.to_thread.run_sync(snapshot.export, batch, format, header)
+        header = False
+    if header and format == "csv":
+        # nothing matched, the CSV still gets its header row
+        yield snapshot.export(rows[:0], format, True)
+
+@app.get("/loans/export")
+async def export_loans(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    state: Optional[str] = None,
+    borrower_name: Optional[str] = None,
+    min_forgiveness_amount: Optional[float] = None,
+):
+    if snapshot is not None:
+        filters = snapshot_filters(borrower_name=borrower_name, borrower_state=state, min_forgiveness_amount=min_forgiveness_amount)
+        content = stream_snapshot(snapshot.by_date(start_date, end_date), filters, format)
+    else:
+        stmt = export_query(start_date, end_date, state, borrower_name, min_forgiveness_amount, json_keys=format == "ndjson")
+        content = stream_ndjson(stmt) if format == "ndjson" else stream_csv(stmt)
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="ppp_loans.{format}"'},
     )
+
+"""
+These endpoints serve the rollup tables built at the end of every pipeline run.
+Each one reads a small pre-aggregated table (one row per group) instead of grouping the loan table.
+Filtering by a group key is a primary key lookup.
+"""
+async def get_rollup(session: AsyncSession, model, group_key: Optional[str], order_by: RollupOrder, limit: int):
+    stmt = select(model)
+    if group_key is not None:
+        stmt = stmt.where(model.group_key == group_key)
+    stmt = stmt.order_by(getattr(model, order_by).desc().nulls_last(), model.group_key).limit(limit)
     result = await session.execute(stmt)
     return result.scalars().all()
-    
+
+@app.get("/analytics/by-state", response_model=List[LoanRollupSchema])
+async def get_state_rollup(
+    state: Optional[str] = None,
+    order_by: RollupOrder = "total_approval_amount",
+    limit: int = Query(DEFAULT_ROLLUP_LIMIT, ge=1, le=MAX_ROLLUP_LIMIT),
+    session: AsyncSession = Depends(get_read_session),
+):
+    return await get_rollup(session, StateRollup, state.upper() if state else None, order_by, limit)
+
+@app.get("/analytics/by-lender", response_model=List[LoanRollupSchema])
+async def get_lender_rollup(
+    role: Literal["servicing", "originating"] = "servicing",
+    lender: Optional[str] = None,
+    order_by: RollupOrder = "total_approval_amount",
+    limit: int = Query(DEFAULT_ROLLUP_LIMIT, ge=1, le=MAX_ROLLUP_LIMIT),
+    session: AsyncSession = Depends(get_read_session),
+):
+    model = ServicingLenderRollup if role == "servicing" else OriginatingLenderRollup
+    return await get_rollup(session, model, lender, order_by, limit)
+
+@app.get("/analytics/by-naics", response_model=List[LoanRollupSchema])
+async def get_naics_rollup(
+    naics_code: Optional[str] = None,
+    level: Literal["code", "sector"] = "code",
+    order_by: RollupOrder = "total_approval_amount",
+    limit: int = Query(DEFAULT_ROLLUP_LIMIT, ge=1, le=MAX_ROLLUP_LIMIT),
+    session: AsyncSession = Depends(get_read_session),
+):
+    if level == "code":
+        return await get_rollup(session, NAICSRollup, naics_code, order_by, limit)
+
+    # NAICS sectors are the first two digits of the code, re-aggregated from the (small) per-code rollup
+    sector = case(
+        (NAICSRollup.group_key == UNKNOWN_ROLLUP_KEY, UNKNOWN_ROLLUP_KEY),
+        else_=func.left(NAICSRollup.group_key, 2),
+    ).label("group_key")
+    # the average is over the loans with an approval amount, like AVG in the per-code rollup
+    approval_count = func.sum(NAICSRollup.approval_count)
+    total_approval_amount = func.sum(NAICSRollup.total_approval_amount)
+    columns = {
+        "loan_count": func.sum(NAICSRollup.loan_count).label("loan_count"),
+        "approval_count": approval_count.label("approval_count"),
+        "total_approval_amount": total_approval_amount.label("total_approval_amount"),
+        "avg_approval_amount": (total_approval_amount / func.nullif(approval_count, 0)).label("avg_approval_amount"),
+        "total_forgiveness_amount": func.sum(NAICSRollup.total_forgiveness_amount).label("total_forgiveness_amount"),
+        "total_jobs_reported": func.sum(NAICSRollup.total_jobs_reported).label("total_jobs_reported"),
+    }
+    stmt = select(sector, *columns.values()).group_by(sector)
+    if naics_code is not None:
+        stmt = stmt.having(sector == naics_code[:2])
+    stmt = stmt.order_by(columns[order_by].desc().nulls_last(), sector).limit(limit)
+    result = await session.execute(stmt)
+    return result.mappings().all()
+
+@app.get("/analytics/by-business-type", response_model=List[LoanRollupSchema])
+async def get_business_type_rollup(
+    business_type: Optional[str] = None,
+    order_by: RollupOrder = "total_approval_amount",
+    limit: int = Query(DEFAULT_ROLLUP_LIMIT, ge=1, le=MAX_ROLLUP_LIMIT),
+    session: AsyncSession = Depends(get_read_session),
+):
+    return await get_rollup(session, BusinessTypeRollup, business_type, order_by, limit)
+
+async def count_chat_rows(driver_connection, sql_query: str, *args) -> Optional[int]:
+    """Counts the rows of the chatbot's query, or returns None when that takes longer than CHAT_COUNT_TIMEOUT."""
+    try:
+        # a savepoint, so a count that times out doesn't abort the surrounding transaction
+        async with driver_connection.transaction():
+            await driver_connection.execute(f"SET LOCAL statement_timeout = {max(1, round(CHAT_COUNT_TIMEOUT * 1000))}")
+            return await driver_connection.fetchval(f"SELECT count(*) FROM ({sql_query}) AS chat_query", *args)
+    except asyncpg.PostgresError as e:
+        logger.info(f"Not counting the rows of the chatbot's query: {e}")
+        return None
+
+async def explain_chat_query(driver_connection, sql_query: str, *args) -> Tuple[float, float]:
+    """Returns the planner's estimated total cost and number of rows of the chatbot's query."""
+    # SQLAlchemy sets up its connections to decode json
+    plan = (await driver_connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql_query}", *args))[0]["Plan"]
+    return plan["Total Cost"], plan["Plan Rows"]
+
+async def query_chat_database(sql_query: str, *args) -> Tuple[list[tuple], bool, Optional[int]]:
+    """Runs the chatbot's query (with args bound to its $n parameters) on the read-only chat pool, on the replica
+    while it is usable (see connect_for_read).
+
+    Returns the rows, whether there were more than CHAT_MAX_ROWS (only the first CHAT_MAX_ROWS are returned then)
+    and the number of rows, None when it couldn't be counted in time.
+    A server side cursor fetches the rows, so a query without a LIMIT doesn't pull the whole table into memory.
+    Queries the planner expects to be too expensive run under a LIMIT, or not at all (see CHAT_MAX_COST).
+    """
+    # a cursor can't be declared over a query ending with ;
+    sql_query = sql_query.strip().rstrip(";").strip()
+    conn = await connect_for_read(chat=True)
+    try:
+        driver_connection = (await conn.get_raw_connection()).driver_connection
+        # read only on top of the session default, the query is sent as is (asyncpg gives % no meaning)
+        async with driver_connection.transaction(readonly=True):
+            cost, estimated_rows = await explain_chat_query(driver_connection, sql_query, *args)
+            plan = "as_is"
+            run_query = sql_query
+            if cost > CHAT_MAX_COST or estimated_rows > CHAT_MAX_ROWS:
+                # the cursor stops after CHAT_MAX_ROWS + 1 rows anyway, under a LIMIT the planner knows that and can
+                # pick a plan that gets there early (an index scan or a top-N sort instead of sorting everything)
+                plan = "limited"
+                run_query = f"SELECT * FROM ({sql_query}) AS chat_query LIMIT {CHAT_MAX_ROWS + 1}"
+                cost, estimated_rows = await explain_chat_query(driver_connection, run_query, *args)
+            if cost > CHAT_MAX_COST:
+                count_chat_query_plan("rejected")
+                logger.warning(f"Rejected the chatbot's query, estimated cost {cost:.0f} (max {CHAT_MAX_COST:.0f}): {sql_query}")
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"The generated query is too expensive to run (estimated cost {cost:.0f}), try a more specific question",
+                )
+            count_chat_query_plan(plan)
+
+            started = asyncio.get_running_loop().time()
+            cursor = await driver_connection.cursor(run_query, *args)
+            rows = [tuple(row) for row in await cursor.fetch(CHAT_MAX_ROWS + 1)]
+            # estimate next to actual, to tune CHAT_MAX_COST by
+            logger.info(
+                f"Chatbot query ({plan}): estimated cost {cost:.0f} and {estimated_rows:.0f} rows,"
+                f" took {(asyncio.get_running_loop().time() - started) * 1000:.1f} ms for {len(rows)} rows"
+            )
+            truncated = len(rows) > CHAT_MAX_ROWS
+            if not truncated:
+                return rows, False, len(rows)
+            return rows[:CHAT_MAX_ROWS], True, await count_chat_rows(driver_connection, sql_query, *args)
+    finally:
+        await conn.close()
+
+async def answer_question(question: str, stream: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+    """Answers a question to the chatbot, yielding (event, data) as each stage completes:
+        - ("sql", {"postgres_sql_query", "intent"}) once the SQL is known,
+        - ("rows", {"result", "truncated", "row_count"}) once the query ran,
+        - with stream, ("token", text) for every piece of the summary as the LLM generates it,
+        - ("response", {"response"}) with the whole summary.
+    A cached answer yields the same events, without tokens.
+    """
+    # a common question is answered by its template, without the LLM
+    intent = match_intent(question)
+    count_chat_intent(intent.intent if intent else None)
+    generated = False
+    if intent is not None:
+        postgres_sql_query, args = intent.sql, intent.args
+        logger.info(f"Matched the {intent.intent} intent: {postgres_sql_query} {args}")
+    else:
+        # generate the query, unless the same question was asked before
+        args = ()
+        sql_key = (PROMPT_VERSION, normalize_question(question))
+        postgres_sql_query = chat_sql_cache.get(sql_key)
+        count_chat_cache_lookup("sql", postgres_sql_query is not MISSING)
+        generated = postgres_sql_query is MISSING
+        if generated:
+            with ask_question_stage("generate_query"):
+                postgres_sql_query = await generate_query(question, openai_client)
+            logger.info(f"PostgreSQL Query generated by the LLM: {postgres_sql_query}")
+    yield "sql", {"postgres_sql_query": postgres_sql_query, "intent": intent.intent if intent else None}
+
+    # the rows and summary of this query on the current data, if they were cached
+    answer_key = dataset_generation.key("chat-answer", postgres_sql_query, *args)
+    answer = chat_answer_cache.get(answer_key) if answer_key else MISSING
+    count_chat_cache_lookup("answer", answer is not MISSING)
+    if answer is not MISSING:
+        # answers cached before truncated and row_count were recorded don't have them
+        yield "rows", {"result": answer["result"], "truncated": answer.get("truncated", False), "row_count": answer.get("row_count")}
+        yield "response", {"response": answer["response"]}
+        return
+
+    # query the database
+    with ask_question_stage("query_database"):
+        rows, truncated, row_count = await query_chat_database(postgres_sql_query, *args)
+    logger.info(f"Result: {row_count if row_count is not None else 'unknown'} rows{', truncated' if truncated else ''}: {rows[:10]}")
+    # only SQL that ran is worth reusing
+    if generated:
+        chat_sql_cache.set(sql_key, postgres_sql_query)
+    # cached the way the response serializes them, so a cached answer reads back the same
+    answer = {"result": to_jsonable_python(rows), "truncated": truncated, "row_count": row_count}
+    yield "rows", answer
+
+    # send the data back to the llm to get a nice response to send back to the frontend
+    if intent is not None:
+        response: str = intent.summarize(rows, row_count)
+    elif stream:
+        pieces = []
+        with ask_question_stage("generate_response"):
+            async for piece in stream_response(rows, question, openai_client, row_count=row_count, truncated=truncated):
+                pieces.append(piece)
+                yield "token", piece
+        response = "".join(pieces).strip()
+    else:
+        with ask_question_stage("generate_response"):
+            response = await generate_response(rows, question, openai_client, row_count=row_count, truncated=truncated)
+    logger.info(f"Response: {response}")
+    yield "response", {"response": response}
+
+    answer["response"] = response
+    if answer_key and RESPONSE_ERROR_PREFIX not in response:
+        chat_answer_cache.set(answer_key, answer)
+
 """
 [ CHATBOT ENDPOINT ]
 This endpoint allows you to ask the database a question.
-Returns the result of the query.
+Returns the result of the query, at most CHAT_MAX_ROWS rows (truncated says whether there were more, row_count how
+many, when counting them was cheap). The query runs read only, with a statement timeout.
+Every stage awaits (the OpenAI calls on a shared httpx.AsyncClient, the query on the async pool), so questions
+in flight never hold up the other endpoints.
+Common questions (top borrowers, totals by state, a company's loans, the average loan in a city) skip OpenAI: they
+are matched to vetted SQL templates and summarized locally (see machine_learning_application/intents.py).
+Repeated questions skip the OpenAI calls and the query: the SQL of a question is cached once it ran, and the
+rows and summary of a SQL query are cached for the dataset generation they were read from (see chat_sql_cache).
 """
 @app.post("/ask-question", response_model=QuestionResponse)
 async def ask_question_to_database(request: QuestionRequest):
+    require_database()
     try:
         # Extract question from request body
         question = request.question.strip()
@@ -234,29 +1359,57 @@ async def ask_question_to_database(request: QuestionRequest):
         # log the question
         logger.info(f"Question: {question}")
 
-        # generate the query
-        postgres_sql_query: str = generate_query(question)
-        logger.info(f"PostgreSQL Query generated by the LLM: {postgres_sql_query}")
-
-        # query the database
-        result: list[tuple] = query_database(postgres_sql_query)
-        logger.info(f"Result: {result}")
-
-        # send the data back to the llm to get a nice response to send back to the frontend
-        response: str = generate_response(result, question)
-        logger.info(f"Response: {response}")
+        # run every stage, collecting what they give
+        answer = {}
+        async for event, data in answer_question(question):
+            if event != "token":
+                answer.update(data)
 
         # return everything back to the frontend
-        return QuestionResponse(
-            question=question,
-            postgres_sql_query=postgres_sql_query,
-            result=result,
-            response=response
-        )
+        return QuestionResponse(question=question, **answer)
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing question: {str(e)}")
         raise HTTPException(
             status_code=500, 
             detail=f"Error processing your question: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+def sse_event(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+"""
+[ STREAMING CHATBOT ENDPOINT ]
+The /ask-question pipeline as server-sent events, sent as each stage completes:
+    - event: sql, the generated SQL (and the intent, for a question answered by a template)
+    - event: rows, the result, truncated and row_count
+    - event: token, the next piece of the summary while the LLM generates it
+    - event: response, the whole summary, the last event
+    - event: error, {"status_code", "detail"} instead of the rest when a stage fails
+Every data line is JSON. The frontend shows the SQL and rows as soon as they arrive and types the summary out,
+instead of waiting for all of it.
+"""
+@app.post("/ask-question/stream")
+async def ask_question_stream(request: QuestionRequest):
+    require_database()
+    question = request.question.strip()
+    logger.info(f"Question: {question}")
+
+    async def events() -> AsyncIterator[bytes]:
+        try:
+            async for event, data in answer_question(question, stream=True):
+                yield sse_event(event, data)
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Error processing question: {str(e)}")
+            yield sse_event("error", {"status_code": 500, "detail": f"Error processing your question: {str(e)}"})
+
+    # proxies must pass every event on as it comes instead of buffering the response
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
\ No newline at end of file
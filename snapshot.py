@@ -0,0 +1,505 @@
+"""
+Read-only columnar snapshot of the loan table, for serving the /loans endpoints without Postgres.
+
+A snapshot is a directory of uncompressed Arrow IPC (Feather v2) files:
+    - loans.arrow: every loan column, sorted by loan number, with the dataset generation in its metadata.
+    - by_date.arrow: the row numbers of the loans in (date_approved, loan_number) order, with their dates.
+    - by_forgiveness.arrow: the row numbers of the forgiven loans in (forgiveness_amount, loan_number) order,
+      with their amounts.
+    - names.arrow: the distinct normalized borrower names in order, each with the rows of its loans, a spelling
+      of it and its number of trigrams.
+    - trigrams.arrow: every trigram of the names in order, with the names it occurs in (an inverted index like
+      pg_trgm's GIN index, for the fuzzy borrower name search).
+The server memory-maps the files, so opening a snapshot reads no data, columns are used in place (zero copy)
+and every uvicorn worker shares the same pages of the OS page cache.
+
+Usage (from the repo root, against the database in the DB_* env vars): python snapshot.py <snapshot directory>
+The pipeline writes one after every load with --ppp_snapshot_path.
+"""
+import os
+import re
+import sys
+import shutil
+import typing
+import logging
+import datetime as dt
+
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from models import PPPLoanDataSchema
+from encoding import dumps
+from sql import DATASET_GENERATION_TABLE, LOAN_TABLE, CreateTempTables
+from utils import normalize
+
+# set up logging
+logger = logging.getLogger(__name__)
+
+LOANS_FILE = "loans.arrow"
+BY_DATE_FILE = "by_date.arrow"
+BY_FORGIVENESS_FILE = "by_forgiveness.arrow"
+NAMES_FILE = "names.arrow"
+TRIGRAMS_FILE = "trigrams.arrow"
+GENERATION_METADATA_KEY = b"generation"
+
+# rows per record batch, and per server side cursor fetch while writing
+SNAPSHOT_BATCH_SIZE = 65536
+# candidate rows a filtered scan checks at first, doubled up to SCAN_MAX_WINDOW until the page is full
+SCAN_WINDOW = 1024
+SCAN_MAX_WINDOW = 262144
+# pg_trgm.similarity_threshold's default, the threshold of the database search's % operator
+SIMILARITY_THRESHOLD = np.float32(0.3)
+
+EPOCH = dt.date(1970, 1, 1)
+
+def _arrow_type(annotation) -> pa.DataType:
+    types = typing.get_args(annotation) or (annotation,)
+    if dt.datetime in types:
+        # every date column holds a day (the wide schema's TIMESTAMPs are at midnight)
+        return pa.date32()
+    if float in types:
+        return pa.float64()
+    if int in types:
+        return pa.int32()
+    return pa.string()
+
+# the loan table's columns, named like PPPLoanData's attributes
+SNAPSHOT_SCHEMA = pa.schema(
+    [(name, _arrow_type(field.annotation)) for name, field in PPPLoanDataSchema.model_fields.items()]
+    + [("borrower_name_normalized", pa.string())]
+)
+# exported like server.export_query exports them, JSON keys are the schema's aliases
+EXPORT_COLUMNS = [name for name in SNAPSHOT_SCHEMA.names if name != "borrower_name_normalized"]
+EXPORT_JSON_KEYS = [PPPLoanDataSchema.model_fields[name].alias for name in EXPORT_COLUMNS]
+
+def _days(day: dt.date) -> int:
+    return (day - EPOCH).days
+
+def _snapshot_query() -> str:
+    columns = []
+    for field in SNAPSHOT_SCHEMA:
+        if field.name == "loan_number":
+            # BIGINT in the compact schema, the snapshot sorts and searches loan numbers as text
+            columns.append("loan_number::text")
+        elif field.type == pa.date32():
+            columns.append(f"{field.name}::date")
+        else:
+            columns.append(field.name)
+    # byte order, the order the snapshot is binary searched in
+    return f'SELECT {", ".join(columns)} FROM {LOAN_TABLE} ORDER BY loan_number::text COLLATE "C"'
+
+def write_snapshot(path: str, db_config: Optional[dict] = None, batch_size: int = SNAPSHOT_BATCH_SIZE) -> int:
+    """Writes a snapshot of the loan table to the directory path, replacing the snapshot already there.
+
+    The rows are streamed through a server side cursor, one record batch at a time, and read in the same
+    transaction as the dataset generation, so the snapshot's generation is the one of its rows.
+    The snapshot is written next to path and moved into place once complete.
+
+    Args:
+        path (str): The snapshot directory.
+        db_config (Optional[dict]): psycopg2 connection parameters, defaults to the DB_* env vars.
+        batch_size (int): Rows per record batch.
+
+    Returns:
+        int: The dataset generation of the snapshot.
+    """
+    db_config = db_config or CreateTempTables().db_config
+    staging = f"{path.rstrip(os.sep)}.staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    conn = psycopg2.connect(**db_config)
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (DATASET_GENERATION_TABLE,))
+            generation = 0
+            if cursor.fetchone()[0]:
+                cursor.execute(f"SELECT coalesce(max(generation), 0) FROM {DATASET_GENERATION_TABLE}")
+                generation = cursor.fetchone()[0]
+        schema = SNAPSHOT_SCHEMA.with_metadata({GENERATION_METADATA_KEY: str(generation).encode()})
+        with conn.cursor(name="ppp_snapshot") as cursor, pa.ipc.new_file(os.path.join(staging, LOANS_FILE), schema) as writer:
+            cursor.itersize = batch_size
+            cursor.execute(_snapshot_query())
+            rows = 0
+            while batch := cursor.fetchmany(batch_size):
+                columns = list(zip(*batch))
+                writer.write_batch(pa.record_batch(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, SNAPSHOT_SCHEMA)], schema=schema,
+                ))
+                rows += len(batch)
+    finally:
+        conn.close()
+
+    loans = _read(os.path.join(staging, LOANS_FILE))
+    _write_index(os.path.join(staging, BY_DATE_FILE), loans["date_approved"].cast(pa.int32()))
+    _write_index(os.path.join(staging, BY_FORGIVENESS_FILE), loans["forgiveness_amount"])
+    _write_names(os.path.join(staging, NAMES_FILE), os.path.join(staging, TRIGRAMS_FILE), loans)
+    del loans
+
+    previous = f"{path.rstrip(os.sep)}.previous"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        # servers that mapped the old files keep reading them until they restart
+        os.rename(path, previous)
+    os.rename(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+    logger.info(f"Wrote a snapshot of {rows} loans at dataset generation {generation} to {path}")
+    return generation
+
+def _write_index(path: str, key: pa.ChunkedArray) -> None:
+    """Writes the row numbers in key order (rows without a key left out) and the sorted keys, as one record batch."""
+    # a stable sort, so rows with the same key stay in loan number order
+    order = pc.array_sort_indices(key, null_placement="at_end")[: len(key) - key.null_count]
+    _write_table(path, pa.table({"key": pc.take(key, order), "row": order.cast(pa.uint32())}))
+
+def _write_names(names_path: str, trigrams_path: str, loans: pa.Table) -> None:
+    """Writes the distinct borrower names with the rows of their loans, and the trigram index of the names."""
+    encoded = loans["borrower_name_normalized"].combine_chunks().dictionary_encode()
+    order = pc.array_sort_indices(encoded.dictionary).to_numpy()
+    names = encoded.dictionary.take(order)
+    # the dictionary is in order of appearance, number the names in sorted order instead
+    name_ids = np.empty(len(order), dtype=np.int64)
+    name_ids[order] = np.arange(len(order))
+    codes = pc.fill_null(encoded.indices, -1).to_numpy()
+    named_rows = np.flatnonzero(codes >= 0)
+    name_of_row = name_ids[codes[named_rows]]
+    # stable, so the rows of a name stay in loan number order
+    rows = named_rows[np.argsort(name_of_row, kind="stable")].astype(np.uint32)
+    row_offsets = np.concatenate([[0], np.cumsum(np.bincount(name_of_row, minlength=len(names)))]).astype(np.int32)
+    spellings = (
+        pa.table({"name": name_of_row, "spelling": loans["borrower_name"].take(named_rows)})
+        .group_by("name").aggregate([("spelling", "min")]).sort_by("name")
+    )
+
+    trigram_ids: Dict[str, int] = {}
+    trigram_counts = np.zeros(len(names), dtype=np.int32)
+    posting_trigrams, posting_names = array("I"), array("I")
+    for name_id, name in enumerate(names.to_pylist()):
+        trigrams = _trigrams(name)
+        trigram_counts[name_id] = len(trigrams)
+        for trigram in trigrams:
+            posting_trigrams.append(trigram_ids.setdefault(trigram, len(trigram_ids)))
+            posting_names.append(name_id)
+    trigrams = sorted(trigram_ids)
+    trigram_ranks = np.empty(len(trigrams), dtype=np.int64)
+    trigram_ranks[[trigram_ids[trigram] for trigram in trigrams]] = np.arange(len(trigrams))
+    posting_ranks = trigram_ranks[np.frombuffer(posting_trigrams, dtype=np.uint32)]
+    # stable, so every trigram lists its names in order
+    postings = np.frombuffer(posting_names, dtype=np.uint32)[np.argsort(posting_ranks, kind="stable")]
+    posting_offsets = np.concatenate([[0], np.cumsum(np.bincount(posting_ranks, minlength=len(trigrams)))]).astype(np.int32)
+
+    _write_table(names_path, pa.table({
+        "name": names,
+        "spelling": spellings["spelling_min"],
+        "rows": pa.ListArray.from_arrays(pa.array(row_offsets), pa.array(rows)),
+        "trigrams": trigram_counts,
+    }))
+    _write_table(trigrams_path, pa.table({
+        "trigram": pa.array(trigrams, pa.string()),
+        "names": pa.ListArray.from_arrays(pa.array(posting_offsets), pa.array(postings)),
+    }))
+
+def _write_table(path: str, table: pa.Table) -> None:
+    # as a single record batch, so the reader gets every column as one contiguous array
+    table = table.combine_chunks()
+    with pa.ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(len(table), 1))
+
+def _read(path: str) -> pa.Table:
+    # memory-mapped, the table's buffers point into the file
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+def _array(column: pa.ChunkedArray) -> pa.Array:
+    # the index files are a single batch, so this is a view of the mapped file (no batch at all if it's empty)
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+def _numpy(column: pa.ChunkedArray) -> np.ndarray:
+    return _array(column).to_numpy()
+
+def _lists(column: pa.ChunkedArray) -> Tuple[np.ndarray, np.ndarray]:
+    """The offsets and the values of a list column of an index file, list i is values[offsets[i]:offsets[i + 1]]."""
+    lists = _array(column)
+    return lists.offsets.to_numpy(), lists.values.to_numpy()
+
+class _ColumnValues(Sequence):
+    """The values of a chunked column as a sequence, for bisect."""
+
+    def __init__(self, column: pa.ChunkedArray) -> None:
+        self.chunks = column.chunks
+        self.ends = list(accumulate(len(chunk) for chunk in self.chunks))
+
+    def __len__(self) -> int:
+        return self.ends[-1] if self.ends else 0
+
+    def __getitem__(self, i: int):
+        chunk = bisect_right(self.ends, i)
+        start = self.ends[chunk - 1] if chunk else 0
+        return self.chunks[chunk][i - start].as_py()
+
+def _csv_lines(table: pa.Table) -> pa.ChunkedArray:
+    """The rows of the table as CSV lines the way COPY writes them: NULL is empty, values are only quoted
+    when they have to be (and empty strings, to tell them from NULL), whole floats have no trailing .0."""
+    fields = []
+    for column in table.columns:
+        if pa.types.is_string(column.type):
+            needs_quotes = pc.or_(pc.match_substring_regex(column, '[",\r\n]'), pc.equal(column, ""))
+            quoted = pc.binary_join_element_wise('"', pc.replace_substring(column, '"', '""'), '"', "")
+            fields.append(pc.if_else(needs_quotes, quoted, column))
+        else:
+            fields.append(column.cast(pa.string()))
+    return pc.binary_join_element_wise(*fields, ",", null_handling="replace", null_replacement="")
+
+def trigram_similarity(a: str, b: str) -> float:
+    """pg_trgm's similarity(): the shared trigrams of the two strings' words over all their trigrams."""
+    trigrams_a, trigrams_b = _trigrams(a), _trigrams(b)
+    if not trigrams_a or not trigrams_b:
+        return 0.0
+    shared = len(trigrams_a & trigrams_b)
+    return shared / (len(trigrams_a) + len(trigrams_b) - shared)
+
+def _trigrams(text: str) -> set:
+    # every word is padded with two spaces in front and one behind, like pg_trgm does
+    return {f"  {word} "[i:i + 3] for word in re.findall(r"[^\W_]+", text.lower()) for i in range(len(word) + 1)}
+
+# (column, predicate over that column's values) pairs, all of which a loan has to match
+SnapshotFilters = List[Tuple[str, Callable[[pa.ChunkedArray], pa.ChunkedArray]]]
+
+def snapshot_filters(
+    borrower_name: Optional[str] = None,
+    borrower_state: Optional[str] = None,
+    borrower_city: Optional[str] = None,
+    borrower_zip: Optional[str] = None,
+    min_approval_amount: Optional[float] = None,
+    max_approval_amount: Optional[float] = None,
+    min_forgiveness_amount: Optional[float] = None,
+    lender: Optional[str] = None,
+    lender_role: str = "servicing",
+    naics_code: Optional[str] = None,
+) -> SnapshotFilters:
+    """The filters of server.loan_filters over a snapshot, dates are ranges of the date index instead."""
+    filters: SnapshotFilters = []
+    if borrower_name and normalize(borrower_name):
+        name = normalize(borrower_name)
+        filters.append(("borrower_name_normalized", lambda values: pc.match_substring(values, name)))
+    if borrower_state:
+        state = borrower_state.strip().upper()
+        filters.append(("borrower_state", lambda values: pc.equal(values, state)))
+    if borrower_city:
+        city = borrower_city.strip().upper()
+        filters.append(("borrower_city", lambda values: pc.equal(pc.utf8_upper(values), city)))
+    if borrower_zip:
+        zip_code = borrower_zip.strip()[:5]
+        filters.append(("borrower_zip", lambda values: pc.equal(pc.utf8_slice_codeunits(values, 0, 5), zip_code)))
+    if min_approval_amount is not None:
+        filters.append(("current_approval_amount", lambda values: pc.greater_equal(values, min_approval_amount)))
+    if max_approval_amount is not None:
+        filters.append(("current_approval_amount", lambda values: pc.less_equal(values, max_approval_amount)))
+    if min_forgiveness_amount is not None:
+        filters.append(("forgiveness_amount", lambda values: pc.greater_equal(values, min_forgiveness_amount)))
+    if lender:
+        column = "servicing_lender_name" if lender_role == "servicing" else "originating_lender"
+        filters.append((column, lambda values: pc.equal(values, lender)))
+    if naics_code:
+        naics = naics_code.strip()
+        filters.append(("naics_code", lambda values: pc.equal(values, naics)))
+    return filters
+
+class LoanSnapshot:
+    """A memory-mapped snapshot (see write_snapshot), answering the queries of the /loans endpoints.
+
+    Queries return row numbers in the order the endpoint returns the loans, records() turns them into loans.
+    Row numbers are in loan number order, so within a run of equal dates (or amounts) an index lists its rows
+    in loan number order too, and the keyset cursors of the endpoints become positions in the index.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.loans = _read(os.path.join(path, LOANS_FILE))
+        self.generation = int((self.loans.schema.metadata or {}).get(GENERATION_METADATA_KEY, b"0"))
+        self.loan_numbers = _ColumnValues(self.loans["loan_number"])
+        self.batches = self.loans.to_batches()
+        self.batch_ends = np.cumsum([len(batch) for batch in self.batches])
+        by_date = _read(os.path.join(path, BY_DATE_FILE))
+        self.date_keys, self.date_rows = _numpy(by_date["key"]), _numpy(by_date["row"])
+        by_forgiveness = _read(os.path.join(path, BY_FORGIVENESS_FILE))
+        self.forgiveness_keys, self.forgiveness_rows = _numpy(by_forgiveness["key"]), _numpy(by_forgiveness["row"])
+        names = _read(os.path.join(path, NAMES_FILE))
+        self.names, self.name_spellings = names["name"], names["spelling"]
+        self.name_row_offsets, self.name_rows = _lists(names["rows"])
+        self.name_trigram_counts = _numpy(names["trigrams"])
+        trigrams = _read(os.path.join(path, TRIGRAMS_FILE))
+        self.trigrams = _ColumnValues(trigrams["trigram"])
+        self.trigram_name_offsets, self.trigram_names = _lists(trigrams["names"])
+
+    def __len__(self) -> int:
+        return self.loans.num_rows
+
+    def take(self, rows: Sequence[int], columns: Optional[Sequence[str]] = None) -> pa.Table:
+        """The rows (and columns) of the loans, in the order of rows.
+
+        Rows are taken record batch by record batch, taking from the whole chunked table at once costs
+        about ten times as much.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = self.loans.column_names if columns is None else list(dict.fromkeys(columns))
+        batch_of = np.searchsorted(self.batch_ends, rows, "right")
+        order = np.argsort(batch_of, kind="stable")
+        rows, batch_of = rows[order], batch_of[order]
+        batches, starts = np.unique(batch_of, return_index=True)
+        parts = []
+        for batch, start, stop in zip(batches, starts, [*starts[1:], len(rows)]):
+            first = self.batch_ends[batch] - len(self.batches[batch])
+            parts.append(self.batches[batch].select(columns).take(rows[start:stop] - first))
+        taken = pa.Table.from_batches(parts, self.loans.select(columns).schema).combine_chunks()
+        if np.any(order[1:] < order[:-1]):
+            taken = taken.take(np.argsort(order))
+        return taken
+
+    def records(self, rows: Sequence[int], columns: Optional[Sequence[str]] = None) -> List[SimpleNamespace]:
+        """The loans of the rows, in the same order, as objects with the attributes of PPPLoanData."""
+        loans = self.take(rows, columns).to_pydict()
+        return [SimpleNamespace(**dict(zip(loans, values))) for values in zip(*loans.values())]
+
+    def find(self, loan_number: str) -> Optional[int]:
+        """The row of a loan number, None if it isn't in the snapshot."""
+        row = bisect_left(self.loan_numbers, loan_number)
+        return row if row < len(self.loan_numbers) and self.loan_numbers[row] == loan_number else None
+
+    def by_loan_number(self, after: Optional[str]) -> range:
+        """The rows in loan number order, after the loan number `after`."""
+        start = bisect_right(self.loan_numbers, after) if after is not None else 0
+        return range(start, len(self))
+
+    def by_date(
+        self, start_date: Optional[dt.date], end_date: Optional[dt.date], after: Optional[Tuple[dt.date, str]] = None,
+    ) -> np.ndarray:
+        """The rows approved from start_date through end_date in (date_approved, loan_number) order, after `after`."""
+        start = np.searchsorted(self.date_keys, _days(start_date), "left") if start_date is not None else 0
+        stop = np.searchsorted(self.date_keys, _days(end_date), "right") if end_date is not None else len(self.date_keys)
+        if after is not None:
+            start = max(start, self._position(self.date_keys, self.date_rows, _days(after[0]), bisect_right(self.loan_numbers, after[1])))
+        return self.date_rows[start:stop]
+
+    def by_forgiveness(self, min_forgiveness_amount: Optional[float], after: Optional[Tuple[float, str]] = None) -> np.ndarray:
+        """The forgiven rows from min_forgiveness_amount up, in descending (forgiveness_amount, loan_number) order,
+        after `after`."""
+        start = np.searchsorted(self.forgiveness_keys, min_forgiveness_amount, "left") if min_forgiveness_amount is not None else 0
+        stop = len(self.forgiveness_keys)
+        if after is not None:
+            stop = min(stop, self._position(self.forgiveness_keys, self.forgiveness_rows, after[0], bisect_left(self.loan_numbers, after[1])))
+        return self.forgiveness_rows[start:stop][::-1]
+
+    @staticmethod
+    def _position(keys: np.ndarray, rows: np.ndarray, key, row: int) -> int:
+        """The position of (key, row) in an index, i.e. of the first entry that isn't before it."""
+        start, stop = np.searchsorted(keys, key, "left"), np.searchsorted(keys, key, "right")
+        return int(start + np.searchsorted(rows[start:stop], row, "left"))
+
+    def matches(self, rows: np.ndarray, filters: SnapshotFilters) -> np.ndarray:
+        """Which of the rows match every filter."""
+        matched = np.ones(len(rows), dtype=bool)
+        for column, predicate in filters:
+            matched &= pc.fill_null(predicate(self.loans[column].take(rows)), False).to_numpy(zero_copy_only=False)
+        return matched
+
+    def scan(self, rows: np.ndarray, filters: SnapshotFilters, limit: int) -> np.ndarray:
+        """The first `limit` of the rows (an index range) that match the filters."""
+        if not filters:
+            return rows[:limit]
+        return next(self.scan_batches(rows, filters, limit), rows[:0])
+
+    def scan_batches(self, rows: np.ndarray, filters: SnapshotFilters, batch_size: int) -> Iterator[np.ndarray]:
+        """Every row of rows that matches the filters, in batches of batch_size rows (the last one may be smaller).
+
+        Only the filtered columns of the candidate rows are read, in windows that grow while few of them match.
+        """
+        if not filters:
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+            return
+        pending: List[np.ndarray] = []
+        pending_rows = 0
+        start, window = 0, SCAN_WINDOW
+        while start < len(rows):
+            candidates = rows[start:start + window]
+            matched = candidates[self.matches(candidates, filters)]
+            start += len(candidates)
+            window = min(window * 2, SCAN_MAX_WINDOW)
+            pending.append(matched)
+            pending_rows += len(matched)
+            while pending_rows >= batch_size:
+                combined = np.concatenate(pending)
+                yield combined[:batch_size]
+                pending, pending_rows = [combined[batch_size:]], len(combined) - batch_size
+        if pending_rows:
+            yield np.concatenate(pending)
+
+    def by_borrower(
+        self, name: str, filters: SnapshotFilters, after: Optional[Tuple[float, str]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The similarities and rows of the loans whose normalized borrower name contains name or is similar to it,
+        most similar first, ties in loan number order, after `after`.
+
+        Matches like the database's search (contains or pg_trgm's %): the names sharing a trigram with name are
+        counted up from the trigram index, which gives their similarity, and the names are searched for substrings.
+        Similarities are float4 like pg_trgm's, so they compare equal to the database's in cursors.
+        """
+        trigrams = _trigrams(name)
+        postings = [np.empty(0, dtype=np.uint32)]
+        for trigram in trigrams:
+            i = bisect_left(self.trigrams, trigram)
+            if i < len(self.trigrams) and self.trigrams[i] == trigram:
+                postings.append(self.trigram_names[self.trigram_name_offsets[i]:self.trigram_name_offsets[i + 1]])
+        candidates, shared = np.unique(np.concatenate(postings), return_counts=True)
+        similarities = shared.astype(np.float32) / (len(trigrams) + self.name_trigram_counts[candidates] - shared).astype(np.float32)
+        containing = np.flatnonzero(pc.match_substring(self.names, name).to_numpy(zero_copy_only=False))
+        matched = np.union1d(candidates[similarities >= SIMILARITY_THRESHOLD], containing)
+        # names that contain name without sharing a trigram with it (too short to have one of its own) have similarity 0
+        name_similarities = np.zeros(len(matched), dtype=np.float32)
+        shares_trigrams = np.isin(matched, candidates, assume_unique=True)
+        name_similarities[shares_trigrams] = similarities[np.searchsorted(candidates, matched[shares_trigrams])]
+
+        starts = self.name_row_offsets[matched].astype(np.int64)
+        counts = self.name_row_offsets[matched + 1] - starts
+        # the positions starts[i]:starts[i] + counts[i] of every matched name, concatenated
+        positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        rows = self.name_rows[positions].astype(np.int64)
+        row_similarities = np.repeat(name_similarities, counts)
+        if filters:
+            keep = self.matches(rows, filters)
+            rows, row_similarities = rows[keep], row_similarities[keep]
+        if after is not None:
+            first = bisect_right(self.loan_numbers, after[1])
+            keep = (row_similarities < after[0]) | ((row_similarities == after[0]) & (rows >= first))
+            rows, row_similarities = rows[keep], row_similarities[keep]
+        order = np.lexsort((rows, -row_similarities))
+        return row_similarities[order], rows[order]
+
+    def borrower_names(self) -> List[Tuple[str, str, int]]:
+        """(normalized name, a spelling of it, loan count) of every borrower, for typeahead.BorrowerNameIndex."""
+        # the names are sorted by byte, which for UTF-8 is code point order, the order Python compares strings in
+        return list(zip(self.names.to_pylist(), self.name_spellings.to_pylist(), np.diff(self.name_row_offsets).tolist()))
+
+    def export(self, rows: np.ndarray, format: str, header: bool) -> bytes:
+        """The loans of the rows as NDJSON lines or CSV, like the database export of the compact schema writes them."""
+        loans = self.take(rows, EXPORT_COLUMNS)
+        if format == "csv":
+            lines = _csv_lines(loans).to_pylist()
+            return "".join(f"{line}\n" for line in ([",".join(EXPORT_COLUMNS)] if header else []) + lines).encode()
+        columns = loans.to_pydict().values()
+        return b"".join(dumps(dict(zip(EXPORT_JSON_KEYS, values))) + b"\n" for values in zip(*columns))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    write_snapshot(sys.argv[1])
@@ -1,15 +1,146 @@
 import os
+import re
+import datetime as dt
 import psycopg2
 
+from typing import List, Optional
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path="/app/.env")
 
+# -- PARTITIONING CONSTANTS -- #
+LOAN_TABLE = "ppp_loan_data_airflow"
+PARTITION_STRATEGIES = ("none", "date_approved", "project_state")
+DEFAULT_PARTITION = "default"
+
+# PPP approvals ran from April 2020 through May 2021, anything outside lands in the default partition
+DATE_PARTITION_START = dt.date(2020, 4, 1)
+DATE_PARTITION_END = dt.date(2021, 6, 1)  # exclusive
+
+# 50 states, DC and the territories that show up in ProjectState
+STATE_PARTITIONS = [
+    "AK", "AL", "AR", "AZ", "CA", "CO", "CT", "DC", "DE", "FL", "GA", "HI", "IA", "ID", "IL", "IN", "KS",
+    "KY", "LA", "MA", "MD", "ME", "MI", "MN", "MO", "MS", "MT", "NC", "ND", "NE", "NH", "NJ", "NM", "NV",
+    "NY", "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VA", "VT", "WA", "WI", "WV", "WY",
+    "AS", "GU", "MP", "PR", "VI",
+]
+
+# -- STORAGE SCHEMA CONSTANTS -- #
+STORAGE_SCHEMAS = ("wide", "compact")
+COMPACT_LOAN_TABLE = "ppp_loan_data_compact"
+LENDER_TABLE = "ppp_lender"
+CATEGORY_TABLE = "ppp_category"
+
+# Low-cardinality text columns the compact schema stores as SMALLINT codes into ppp_category
+CATEGORY_COLUMNS = [
+    "sba_office_code",
+    "processing_method",
+    "loan_status",
+    "business_age_description",
+    "cd",
+    "race",
+    "ethnicity",
+    "gender",
+    "veteran",
+    "business_type",
+]
+
+# -- PHYSICAL LAYOUT CONSTANTS -- #
+# Columns each COPY shard can be sorted by so rows land in the heap in that order
+LOAD_SORT_KEYS = ("none", "date_approved", "loan_number")
+# btree indexes every row, brin only stores the min/max of each block range and relies on the load order
+DATE_INDEX_METHODS = ("btree", "brin")
+
+# -- ROLLUP CONSTANTS -- #
+# Materialized rollup table -> ppp_loan_data_airflow column it groups by
+ROLLUP_TABLES = {
+    "ppp_rollup_state": "borrower_state",
+    "ppp_rollup_servicing_lender": "servicing_lender_name",
+    "ppp_rollup_originating_lender": "originating_lender",
+    "ppp_rollup_naics": "naics_code",
+    "ppp_rollup_business_type": "business_type",
+}
+UNKNOWN_ROLLUP_KEY = "Unknown"
+
+# -- DATASET GENERATION CONSTANTS -- #
+# Single row counter bumped (and NOTIFY'd on the channel of the same name) every time the loan data changes,
+# the API keys its response cache by it
+DATASET_GENERATION_TABLE = "ppp_dataset_generation"
+DATASET_GENERATION_CHANNEL = "ppp_dataset_generation"
+
+# -- CHAT ROLE CONSTANTS -- #
+# statement timeout (seconds) of the read-only role the chatbot's generated SQL runs as, see grant_chat_role
+DEFAULT_CHAT_STATEMENT_TIMEOUT = 10.0
+
+def _month_starts(start: dt.date, end: dt.date) -> List[dt.date]:
+    """Return the first day of every month in [start, end)."""
+    months = []
+    current = start.replace(day=1)
+    while current < end:
+        months.append(current)
+        current = (current.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+    return months
+
+def partition_suffix(partition_by: str, value) -> Optional[str]:
+    """Returns the leaf partition suffix a row with the given partition key value belongs to.
+
+    Args:
+        partition_by (str): One of PARTITION_STRATEGIES.
+        value: The row's date_approved (date/datetime) or project_state (str).
+
+    Returns:
+        Optional[str]: Suffix such as "p2020_05" or "ca", "default" when no leaf matches,
+            or None when the table is not partitioned.
+    """
+    if partition_by == "date_approved":
+        if value is None:
+            return DEFAULT_PARTITION
+        day = value.date() if isinstance(value, dt.datetime) else value
+        if not (DATE_PARTITION_START <= day < DATE_PARTITION_END):
+            return DEFAULT_PARTITION
+        return f"p{day.year}_{day.month:02d}"
+    if partition_by == "project_state":
+        state = (value or "").strip().upper()
+        return state.lower() if state in STATE_PARTITIONS else DEFAULT_PARTITION
+    return None
+
+def partition_table_name(table: str, suffix: Optional[str]) -> str:
+    """Returns the physical table name for a partition suffix (the parent table when suffix is None)."""
+    return f"{table}_{suffix}" if suffix else table
+
 class CreateTempTables:
-    def __init__(self):
+    def __init__(
+        self,
+        partition_by: Optional[str] = None,
+        storage_schema: Optional[str] = None,
+        date_index: Optional[str] = None,
+    ):
         """
         Initialize the CreateTempTables class.
+
+        Args:
+            partition_by (Optional[str]): How ppp_loan_data_airflow is partitioned, one of
+                PARTITION_STRATEGIES. Defaults to the PPP_PARTITION_BY env var, or "none".
+            storage_schema (Optional[str]): "wide" (one TEXT/FLOAT/TIMESTAMP column per CSV column)
+                or "compact" (narrow types, coded categoricals and a lender dimension behind a
+                ppp_loan_data_airflow view). Defaults to the PPP_STORAGE_SCHEMA env var, or "wide".
+            date_index (Optional[str]): Index method for date_approved, "btree" or "brin". The btree is
+                idx_date_approved_loan_number (which keyset pagination needs anyway), brin adds a small
+                idx_date_approved and is only worth it when the load is sorted by date
+                (--ppp_load_sort_key date_approved).
+                Defaults to the PPP_DATE_INDEX env var, or "btree".
         """
+        self.partition_by = partition_by or os.getenv("PPP_PARTITION_BY", "none")
+        if self.partition_by not in PARTITION_STRATEGIES:
+            raise ValueError(f"Unknown partition strategy: {self.partition_by}. Expected one of {PARTITION_STRATEGIES}")
+        self.storage_schema = storage_schema or os.getenv("PPP_STORAGE_SCHEMA", "wide")
+        if self.storage_schema not in STORAGE_SCHEMAS:
+            raise ValueError(f"Unknown storage schema: {self.storage_schema}. Expected one of {STORAGE_SCHEMAS}")
+        self.date_index = date_index or os.getenv("PPP_DATE_INDEX", "btree")
+        if self.date_index not in DATE_INDEX_METHODS:
+            raise ValueError(f"Unknown date index method: {self.date_index}. Expected one of {DATE_INDEX_METHODS}")
+        self.loan_table = COMPACT_LOAN_TABLE if self.storage_schema == "compact" else LOAN_TABLE
+
         #Default database configuration
         self.db_config = {
             "dbname":  os.getenv("DB_NAME", "postgres"),
@@ -25,39 +156,253 @@ class CreateTempTables:
     
     def create_tables(self):
         """Create all temporary tables for the PPP Loan Data."""
-        # Format the SQL with the state
-        sql = self._get_sql_template().format(self=self)
-        
-        # Execute the SQL commands
+        return self._execute(
+            self._get_sql_template(),
+            "Successfully created temporary tables for the PPP Loan Data.",
+            "Error creating tables",
+        )
+
+    def create_rollup_tables(self):
+        """(Re)build the materialized rollup tables served by the /analytics endpoints.
+
+        Each rollup is built under a temporary name and renamed over the old one in the same
+        transaction, so readers never see a missing or half-built rollup.
+        """
+        return self._execute(
+            "\n".join(self._get_rollup_sql(table, column) for table, column in ROLLUP_TABLES.items()),
+            "Successfully built rollup tables for the PPP Loan Data.",
+            "Error building rollup tables",
+        )
+
+    def bump_dataset_generation(self):
+        """Mark the loan data as changed, invalidating everything the API cached for the previous generation."""
+        return self._execute(
+            self._get_dataset_generation_sql(),
+            "Bumped the PPP dataset generation.",
+            "Error bumping the PPP dataset generation",
+        )
+
+    def grant_chat_role(
+        self,
+        role: Optional[str] = None,
+        password: Optional[str] = None,
+        statement_timeout: Optional[float] = None,
+    ):
+        """Create (or update) the role the API runs the chatbot's generated SQL as, and let it read the loan table.
+
+        The role can log in and read ppp_loan_data_airflow and the rollups, nothing else, and its sessions are read only with a
+        statement timeout. Loads recreate these tables and drop their grants with them, so run this after every load.
+
+        Args:
+            role (Optional[str]): Defaults to the CHAT_DB_USER env var.
+            password (Optional[str]): Defaults to the CHAT_DB_PASSWORD env var.
+            statement_timeout (Optional[float]): Seconds, defaults to the CHAT_STATEMENT_TIMEOUT env var, or 10.
+        """
+        role = role or os.getenv("CHAT_DB_USER")
+        password = password if password is not None else os.getenv("CHAT_DB_PASSWORD", "")
+        if statement_timeout is None:
+            statement_timeout = float(os.getenv("CHAT_STATEMENT_TIMEOUT", DEFAULT_CHAT_STATEMENT_TIMEOUT))
+        return self._execute(
+            self._get_chat_role_sql(role, password, statement_timeout),
+            f"Granted the chat role {role} read access to the PPP Loan Data and its rollups.",
+            f"Error granting the chat role {role}",
+        )
+
+    def create_partition_staging_table(self, suffix: str):
+        """Create an empty staging table shaped like a single leaf partition.
+
+        Load it (e.g. run the pipeline with --ppp_loan_table pointing at it and
+        --ppp_partition_by none), then call swap_partition to replace the live leaf.
+        """
+        parent = self.loan_table
+        staging = f"{partition_table_name(parent, suffix)}_staging"
+        check = self._partition_check_constraint(suffix)
+        sql = f"""
+            DROP TABLE IF EXISTS {staging};
+            CREATE TABLE {staging} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+            {f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_bounds CHECK ({check});" if check else ""}
+            {self._get_leaf_unique_index_sql(staging)}
+        """
+        return self._execute(sql, f"Created staging table {staging}.", f"Error creating staging table {staging}")
+
+    def swap_partition(self, suffix: str):
+        """Atomically replace a leaf partition with its loaded staging table."""
+        parent = self.loan_table
+        leaf = partition_table_name(parent, suffix)
+        staging = f"{leaf}_staging"
+        sql = f"""
+            ALTER TABLE {parent} DETACH PARTITION {leaf};
+            DROP TABLE {leaf};
+            ALTER TABLE {staging} RENAME TO {leaf};
+            {self._get_leaf_unique_index_sql(staging, rename_to=leaf)}
+            ALTER TABLE {parent} ATTACH PARTITION {leaf} {self._partition_bounds(suffix)};
+            {self._get_dataset_generation_sql()}
+        """
+        return self._execute(sql, f"Swapped partition {leaf}.", f"Error swapping partition {leaf}")
+
+    def _execute(self, sql: str, success_message: str, error_message: str) -> bool:
+        """Execute SQL in a single transaction, returning whether it committed."""
         conn = None
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute(sql)
             conn.commit()
-            print(f"Successfully created temporary tables for the PPP Loan Data.")
+            print(success_message)
             return True
         except Exception as e:
             if conn:
                 conn.rollback()
-            print(f"Error creating tables: {str(e)}")
+            print(f"{error_message}: {str(e)}")
             return False
         finally:
             if conn:
                 conn.close()
 
+    def _get_dataset_generation_sql(self) -> str:
+        """Return the SQL that increments the dataset generation and notifies listeners.
+
+        The table is never dropped, so the generation keeps increasing across reloads. NOTIFY is only
+        delivered when the surrounding transaction commits, together with the data change.
+        """
+        return f"""
+            CREATE TABLE IF NOT EXISTS {DATASET_GENERATION_TABLE} (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                generation BIGINT NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO {DATASET_GENERATION_TABLE} (generation) VALUES (1)
+            ON CONFLICT (id) DO UPDATE
+                SET generation = {DATASET_GENERATION_TABLE}.generation + 1, updated_at = CURRENT_TIMESTAMP;
+            SELECT pg_notify('{DATASET_GENERATION_CHANNEL}', generation::text) FROM {DATASET_GENERATION_TABLE};
+        """
+
+    def _get_chat_role_sql(self, role: str, password: str, statement_timeout: float) -> str:
+        """Return the SQL that creates the chatbot's read-only role, see grant_chat_role."""
+        if not role or not re.fullmatch(r"[a-z_][a-z0-9_]*", role):
+            raise ValueError(f"Not a plain lowercase role name: {role!r}")
+        password = password.replace("'", "''")
+        return f"""
+            DO $$ BEGIN
+                IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = '{role}') THEN
+                    CREATE ROLE {role};
+                END IF;
+            END $$;
+            ALTER ROLE {role} WITH LOGIN NOSUPERUSER NOCREATEDB NOCREATEROLE NOINHERIT PASSWORD '{password}';
+            ALTER ROLE {role} SET default_transaction_read_only = on;
+            ALTER ROLE {role} SET statement_timeout = '{round(statement_timeout * 1000)}ms';
+            GRANT USAGE ON SCHEMA public TO {role};
+            GRANT SELECT ON {", ".join([LOAN_TABLE, *ROLLUP_TABLES])} TO {role};
+        """
+
+    def _partition_bounds(self, suffix: str) -> str:
+        """Return the FOR VALUES clause of a leaf partition."""
+        if suffix == DEFAULT_PARTITION:
+            return "DEFAULT"
+        if self.partition_by == "date_approved":
+            start = dt.date(int(suffix[1:5]), int(suffix[6:8]), 1)
+            end = (start.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+            return f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        if self.partition_by == "project_state":
+            return f"FOR VALUES IN ('{suffix.upper()}')"
+        raise ValueError(f"Table {self.loan_table} is not partitioned")
+
+    def _partition_check_constraint(self, suffix: str) -> Optional[str]:
+        """Return a CHECK expression matching the partition bounds so ATTACH can skip its validation scan."""
+        if suffix == DEFAULT_PARTITION:
+            return None
+        if self.partition_by == "date_approved":
+            start = dt.date(int(suffix[1:5]), int(suffix[6:8]), 1)
+            end = (start.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+            return f"date_approved >= '{start.isoformat()}' AND date_approved < '{end.isoformat()}'"
+        return f"project_state = '{suffix.upper()}'"
+
+    def _partition_suffixes(self) -> List[str]:
+        """Return every leaf partition suffix for the configured strategy."""
+        if self.partition_by == "date_approved":
+            suffixes = [partition_suffix("date_approved", month) for month in _month_starts(DATE_PARTITION_START, DATE_PARTITION_END)]
+        elif self.partition_by == "project_state":
+            suffixes = [state.lower() for state in STATE_PARTITIONS]
+        else:
+            return []
+        return suffixes + [DEFAULT_PARTITION]
+
+    def _get_partition_sql(self) -> str:
+        """Return the DDL for every leaf partition of the loan table."""
+        return "\n".join(
+            f"CREATE TABLE IF NOT EXISTS {partition_table_name(self.loan_table, suffix)} "
+            f"PARTITION OF {self.loan_table} {self._partition_bounds(suffix)};"
+            f"{self._get_leaf_unique_index_sql(partition_table_name(self.loan_table, suffix))}"
+            for suffix in self._partition_suffixes()
+        )
+
+    def _get_leaf_unique_index_sql(self, leaf: str, rename_to: Optional[str] = None) -> str:
+        """Return the unique index of a list partition's key, which stands in for the primary key it can't have.
+
+        A loan has a single project_state, so its rows always land in the same leaf and a unique index per leaf
+        keeps the key unique across the table. With rename_to, return the rename of a staging table's index
+        instead, for when the staging table is swapped in as that leaf.
+        """
+        if self.partition_by != "project_state":
+            return ""
+        key = "loan_number" if self.storage_schema == "compact" else "id"
+        if rename_to:
+            return f"ALTER INDEX {leaf}_{key}_key RENAME TO {rename_to}_{key}_key;"
+        return f"\nCREATE UNIQUE INDEX IF NOT EXISTS {leaf}_{key}_key ON {leaf} ({key});"
+
+    def _get_rollup_sql(self, table: str, column: str) -> str:
+        """Return the SQL that rebuilds one rollup table grouped by `column`."""
+        return f"""
+            DROP TABLE IF EXISTS {table}_new;
+            CREATE TABLE {table}_new AS
+            SELECT
+                COALESCE(NULLIF(TRIM({column}), ''), '{UNKNOWN_ROLLUP_KEY}') AS group_key,
+                COUNT(*) AS loan_count,
+                COUNT(current_approval_amount) AS approval_count,
+                SUM(current_approval_amount) AS total_approval_amount,
+                AVG(current_approval_amount) AS avg_approval_amount,
+                SUM(forgiveness_amount) AS total_forgiveness_amount,
+                SUM(jobs_reported) AS total_jobs_reported
+            FROM {LOAN_TABLE}
+            GROUP BY 1;
+            ALTER TABLE {table}_new ADD PRIMARY KEY (group_key);
+            DROP TABLE IF EXISTS {table};
+            ALTER TABLE {table}_new RENAME TO {table};
+            ALTER INDEX {table}_new_pkey RENAME TO {table}_pkey;
+        """
+
     def _get_sql_template(self):
         """Return the SQL template for creating temporary PPP Loan Data Table."""
+        loan_table_sql = self._get_compact_table_sql() if self.storage_schema == "compact" else self._get_wide_table_sql()
+        view_sql = self._get_compact_view_sql() if self.storage_schema == "compact" else ""
+        # the compact schema's primary key already leads with loan_number
+        loan_number_index_sql = f"CREATE INDEX IF NOT EXISTS idx_loan_number ON {self.loan_table} (loan_number);"
+        if self.storage_schema == "compact" and self._loan_primary_key():
+            loan_number_index_sql = ""
+        # a btree on date_approved alone would duplicate idx_date_approved_loan_number, brin is the only reason for a second one
+        date_index_sql = ""
+        if self.date_index == "brin":
+            date_index_sql = f"CREATE INDEX IF NOT EXISTS idx_date_approved ON {self.loan_table} USING brin (date_approved);"
+
         return f"""
             -- Allow Extensions for UUID and Random UUID
             CREATE EXTENSION IF NOT EXISTS pgcrypto;
 
+            -- Allow Extension for trigram indexes (substring and fuzzy borrower name search)
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
             -- Drop existing tables if they exist to reset the schema (in reverse dependency order)
+            -- The compact schema is dropped first since ppp_loan_data_airflow is a view over it
+            DROP TABLE IF EXISTS {COMPACT_LOAN_TABLE} CASCADE;
             DROP TABLE IF EXISTS ppp_loan_data_airflow CASCADE;
             DROP TABLE IF EXISTS ppp_loan_data_error CASCADE;
+            DROP TABLE IF EXISTS {LENDER_TABLE} CASCADE;
+            DROP TABLE IF EXISTS {CATEGORY_TABLE} CASCADE;
 
             -- Drop Custom Enum Types to allow recreation
             DROP TYPE IF EXISTS error_type_enum CASCADE;
+            DROP TYPE IF EXISTS indicator_enum CASCADE;
+            DROP TYPE IF EXISTS rural_urban_enum CASCADE;
 
             -- Create Custom Enum Types for PPP Loan Data
             CREATE TYPE error_type_enum as ENUM ('parsing', 'processing', 'validation', 'blanket');
@@ -73,12 +418,94 @@ class CreateTempTables:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
 
+            {loan_table_sql}
+
+            -- Create the leaf partitions (no-op when the table is not partitioned)
+            {self._get_partition_sql()}
+
+            -- Create Indexes for the PPP Loan Data Table
+            {loan_number_index_sql}
+            CREATE INDEX IF NOT EXISTS idx_borrower_name ON {self.loan_table} (borrower_name);
+            CREATE INDEX IF NOT EXISTS idx_borrower_name_trgm ON {self.loan_table} USING gin (borrower_name_normalized gin_trgm_ops);
+            {date_index_sql}
+            -- Keyset pagination walks these in (sort key, loan_number) order, the first also serves date range filters
+            CREATE INDEX IF NOT EXISTS idx_date_approved_loan_number ON {self.loan_table} (date_approved, loan_number);
+            CREATE INDEX IF NOT EXISTS idx_forgiveness_amount_loan_number ON {self.loan_table} (forgiveness_amount, loan_number);
+            {self._get_search_index_sql()}
+
+            {view_sql}
+
+            -- The loan data was just emptied, anything cached for it is stale
+            {self._get_dataset_generation_sql()}
+        """
+
+    def _get_search_index_sql(self) -> str:
+        """Return the composite indexes behind the /loans/search filters.
+
+        Each one leads with a filter column (or expression, matching how the API compares it) and ends with
+        (date_approved, loan_number), so a narrow search reads its matches already in keyset order, date
+        range included, instead of sorting or post-filtering everything the borrower name matched.
+        Lender names live in the lender dimension in the compact schema, loans are reached by location id.
+        """
+        if self.storage_schema == "compact":
+            lender_columns = {
+                "servicing_lender": "servicing_lender_location_id",
+                "originating_lender": "originating_lender_location_id",
+            }
+            lender_name_sql = f"CREATE INDEX IF NOT EXISTS idx_lender_name ON {LENDER_TABLE} (name);"
+        else:
+            lender_columns = {"servicing_lender": "servicing_lender_name", "originating_lender": "originating_lender"}
+            lender_name_sql = ""
+        columns = {
+            "borrower_state": "borrower_state",
+            "borrower_state_city": "borrower_state, upper(borrower_city)",
+            "borrower_zip5": "left(borrower_zip, 5)",
+            "naics_code": "naics_code",
+            **lender_columns,
+        }
+        return "\n            ".join([
+            "-- Composite indexes for the /loans/search filters, each ends in the keyset order",
+            *(
+                f"CREATE INDEX IF NOT EXISTS idx_{name}_date_approved ON {self.loan_table} ({column}, date_approved, loan_number);"
+                for name, column in columns.items()
+            ),
+            lender_name_sql,
+        ])
+
+    def _loan_primary_key(self) -> Optional[str]:
+        """Return the primary key columns of the loan table.
+
+        A partitioned table's primary key must include the partition key. project_state is
+        nullable, so list-partitioned tables get no primary key at all, each leaf gets a unique
+        index on the key instead (see _get_leaf_unique_index_sql).
+        """
+        key = "loan_number" if self.storage_schema == "compact" else "id"
+        if self.partition_by == "date_approved":
+            return f"{key}, date_approved"
+        if self.partition_by == "project_state":
+            return None
+        return key
+
+    def _partition_clause(self) -> str:
+        """Return the PARTITION BY clause of the loan table."""
+        if self.partition_by == "date_approved":
+            return " PARTITION BY RANGE (date_approved)"
+        if self.partition_by == "project_state":
+            return " PARTITION BY LIST (project_state)"
+        return ""
+
+    def _get_wide_table_sql(self) -> str:
+        """Return the DDL of the wide loan table, one TEXT/FLOAT/TIMESTAMP column per CSV column."""
+        primary_key = self._loan_primary_key()
+        primary_key_sql = f",\n                PRIMARY KEY ({primary_key})" if primary_key else ""
+        return f"""
             -- Create Table to store the PPP Loan Data
             CREATE TABLE IF NOT EXISTS ppp_loan_data_airflow (
-                id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+                id uuid NOT NULL DEFAULT gen_random_uuid(),
                 loan_number TEXT NOT NULL,
                 date_approved TIMESTAMP NOT NULL,
                 borrower_name TEXT NOT NULL,
+                borrower_name_normalized TEXT,
                 sba_office_code TEXT,
                 processing_method TEXT,
                 borrower_address TEXT,
@@ -129,12 +556,154 @@ class CreateTempTables:
                 non_profit TEXT,
                 forgiveness_amount FLOAT,
                 forgiveness_date TIMESTAMP,
-                shard_id BIGINT
+                shard_id BIGINT{primary_key_sql}
+            ){self._partition_clause()};
+        """
+
+    def _get_compact_table_sql(self) -> str:
+        """Return the DDL of the compact loan table and its lender and category dimensions.
+
+        Dates are DATE, states VARCHAR(2), loan numbers BIGINT, Y/N style indicators are enums,
+        low-cardinality text columns are SMALLINT codes into ppp_category, and lender name/address
+        columns live once per lender location in ppp_lender instead of on every loan.
+        """
+        primary_key = self._loan_primary_key()
+        primary_key_sql = f",\n                PRIMARY KEY ({primary_key})" if primary_key else ""
+        category_columns = ",\n".join(
+            f"                {column}_code SMALLINT" for column in CATEGORY_COLUMNS
+        )
+        return f"""
+            -- Create Enum Types for the compact schema indicators
+            CREATE TYPE indicator_enum as ENUM ('Y', 'N');
+            CREATE TYPE rural_urban_enum as ENUM ('R', 'U');
+
+            -- Create the lookup table for SMALLINT coded categoricals
+            CREATE TABLE IF NOT EXISTS {CATEGORY_TABLE} (
+                category TEXT NOT NULL,
+                code SMALLINT NOT NULL,
+                label TEXT NOT NULL,
+                PRIMARY KEY (category, code)
             );
 
-            -- Create Indexes for the PPP Loan Data Table
-            CREATE INDEX IF NOT EXISTS idx_loan_number ON ppp_loan_data_airflow (loan_number);
-            CREATE INDEX IF NOT EXISTS idx_borrower_name ON ppp_loan_data_airflow (borrower_name);
-            CREATE INDEX IF NOT EXISTS idx_date_approved ON ppp_loan_data_airflow (date_approved);
+            -- Create the deduplicated lender dimension (servicing and originating lenders share location ids)
+            CREATE TABLE IF NOT EXISTS {LENDER_TABLE} (
+                location_id INTEGER PRIMARY KEY,
+                name TEXT,
+                address TEXT,
+                city TEXT,
+                state VARCHAR(2),
+                zip TEXT
+            );
+
+            -- Create the compact Table to store the PPP Loan Data
+            CREATE TABLE IF NOT EXISTS {COMPACT_LOAN_TABLE} (
+                loan_number BIGINT NOT NULL,
+                date_approved DATE NOT NULL,
+                borrower_name TEXT NOT NULL,
+                borrower_name_normalized TEXT,
+                borrower_address TEXT,
+                borrower_city TEXT,
+                borrower_state VARCHAR(2),
+                borrower_zip TEXT,
+                loan_status_date DATE,
+                term SMALLINT,
+                sba_guaranty_percentage REAL,
+                initial_approval_amount FLOAT,
+                current_approval_amount FLOAT,
+                undisbursed_amount FLOAT,
+                franchise_name TEXT,
+                servicing_lender_location_id INTEGER,
+                rural_urban_indicator rural_urban_enum,
+                hubzone_indicator indicator_enum,
+                lmi_indicator indicator_enum,
+                project_city TEXT,
+                project_county_name TEXT,
+                project_state VARCHAR(2),
+                project_zip TEXT,
+                jobs_reported INTEGER,
+                naics_code TEXT,
+                utilities_proceed FLOAT,
+                payroll_proceed FLOAT,
+                mortgage_interest_proceed FLOAT,
+                rent_proceed FLOAT,
+                refinance_eidl_proceed FLOAT,
+                health_care_proceed FLOAT,
+                debt_interest_proceed FLOAT,
+                originating_lender_location_id INTEGER,
+                non_profit indicator_enum,
+                forgiveness_amount FLOAT,
+                forgiveness_date DATE,
+{category_columns},
+                shard_id BIGINT{primary_key_sql}
+            ){self._partition_clause()};
+        """
+
+    def _get_compact_view_sql(self) -> str:
+        """Return the DDL of the ppp_loan_data_airflow view that decodes the compact table.
+
+        The view has the same columns as the wide table, so the API, the chatbot and the rollups
+        read the compact schema unchanged.
+        """
+        category_joins = "\n".join(
+            f"            LEFT JOIN {CATEGORY_TABLE} {column}_category "
+            f"ON {column}_category.category = '{column}' AND {column}_category.code = l.{column}_code"
+            for column in CATEGORY_COLUMNS
+        )
+        category_labels = "\n".join(
+            f"                {column}_category.label AS {column}," for column in CATEGORY_COLUMNS
+        )
+        return f"""
+            -- Create the view that decodes the compact table back to the wide column layout
+            CREATE VIEW ppp_loan_data_airflow AS
+            SELECT
+                l.loan_number,
+                l.date_approved,
+                l.borrower_name,
+                l.borrower_name_normalized,
+                l.borrower_address,
+                l.borrower_city,
+                l.borrower_state,
+                l.borrower_zip,
+                l.loan_status_date,
+                l.term,
+                l.sba_guaranty_percentage,
+                l.initial_approval_amount,
+                l.current_approval_amount,
+                l.undisbursed_amount,
+                l.franchise_name,
+                l.servicing_lender_location_id::text AS servicing_lender_location_id,
+                servicing_lender.name AS servicing_lender_name,
+                servicing_lender.address AS servicing_lender_address,
+                servicing_lender.city AS servicing_lender_city,
+                servicing_lender.state AS servicing_lender_state,
+                servicing_lender.zip AS servicing_lender_zip,
+                l.rural_urban_indicator::text AS rural_urban_indicator,
+                l.hubzone_indicator::text AS hubzone_indicator,
+                l.lmi_indicator::text AS lmi_indicator,
+                l.project_city,
+                l.project_county_name,
+                l.project_state,
+                l.project_zip,
+                l.jobs_reported,
+                l.naics_code,
+                l.utilities_proceed,
+                l.payroll_proceed,
+                l.mortgage_interest_proceed,
+                l.rent_proceed,
+                l.refinance_eidl_proceed,
+                l.health_care_proceed,
+                l.debt_interest_proceed,
+                l.originating_lender_location_id::text AS originating_lender_location_id,
+                originating_lender.name AS originating_lender,
+                originating_lender.city AS originating_lender_city,
+                originating_lender.state AS originating_lender_state,
+                l.non_profit::text AS non_profit,
+                l.forgiveness_amount,
+                l.forgiveness_date,
+{category_labels}
+                l.shard_id
+            FROM {COMPACT_LOAN_TABLE} l
+            LEFT JOIN {LENDER_TABLE} servicing_lender ON servicing_lender.location_id = l.servicing_lender_location_id
+            LEFT JOIN {LENDER_TABLE} originating_lender ON originating_lender.location_id = l.originating_lender_location_id
+{category_joins};
         """
-    
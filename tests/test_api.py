@@ -1,12 +1,19 @@
+import io
 import os
+import csv
+import json
+import httpx
 import pytest
+import asyncio
 import logging
 import pytest_asyncio
 
 from typing import Any, List
 from datetime import datetime
 from dotenv import load_dotenv
-from models import DATE_FORMATS
+from models import DATE_FORMATS, MAX_LOAN_NUMBER_BATCH
+from utils import normalize
+from sqlalchemy import text
 from httpx import (
     AsyncClient,
     ASGITransport,
@@ -24,26 +31,38 @@ os.environ["DB_HOST"] = "localhost"
 os.environ["DB_PORT"] = "5434"
 
 # now import the app, Base, and engine
+import server
+from replica import ReplicaMonitor
 from server import (
+    LoanNumber,
     PPPLoanData,
     app,
     Base,
     engine,
     async_session,
+    dataset_generation,
+    response_cache,
+    refresh_borrower_names,
+    warm_pool,
 )
 from models import PPPLoanDataSchema
+from cache import PersistentCache
+from snapshot import LoanSnapshot, write_snapshot
+from sql import CreateTempTables
 
 # setup test database and client
 @pytest_asyncio.fixture(autouse=True)
 async def setup_database():
     async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
     yield
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
-    # Dispose the engine to clear connection pool tied to the current event loop.
+    # Dispose the engines to clear connection pools tied to the current event loop.
     await engine.dispose()
+    await server.chat_engine.dispose()
 
 # make a test client
 @pytest_asyncio.fixture
@@ -81,6 +100,67 @@ async def test_health_check(async_client: AsyncClient):
     assert response.status_code == 200
     assert response.json() == {"status": "ok"}
 
+# Test the readiness check and the startup pool warmup against the test database
+@pytest.mark.asyncio
+async def test_ready_and_warm_pool(async_client: AsyncClient):
+    await warm_pool()
+    response: Response = await async_client.get("/ready")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+# Test the metrics endpoint reports the requests served per route, with their SQL rows
+@pytest.mark.asyncio
+async def test_metrics(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    assert (await async_client.get("/loans/search/by-loan-number", params={"loan_number": test_loan_data["LoanNumber"]})).status_code == 200
+    assert (await async_client.get("/no-such-route")).status_code == 404
+    response: Response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    route = 'method="GET",route="/loans/search/by-loan-number"'
+    assert f'ppp_api_request_duration_seconds_count{{{route},status="200"}}' in response.text
+    assert f'ppp_api_request_db_rows_count{{{route}}}' in response.text
+    assert 'ppp_api_request_duration_seconds_count{method="GET",route="unmatched",status="404"}' in response.text
+    assert "ppp_api_db_pool_checkout_wait_seconds_count" in response.text
+
+# Test reads go to the replica while it is usable, and fall back to the primary when it lags a reload or is unreachable
+@pytest.mark.asyncio
+async def test_replica_routing(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan, monkeypatch):
+    # a second, read only engine on the test database stands in for the replica
+    replica_engine = server.make_engine(engine.url, server_settings={"default_transaction_read_only": "on"})
+    replica = ReplicaMonitor(replica_engine, max_lag=30, interval=5, timeout=2)
+    monkeypatch.setattr(server, "replica_engine", replica_engine)
+    monkeypatch.setattr(server, "replica", replica)
+    monkeypatch.setattr(dataset_generation, "current", None)
+    try:
+        await replica.check()
+        assert replica.healthy and replica.lag == 0
+        conn = await server.connect_for_read()
+        assert conn.engine is replica_engine
+        await conn.close()
+        response: Response = await async_client.get("/loans/search/by-loan-number", params={"loan_number": test_loan_data["LoanNumber"]})
+        assert response.status_code == 200
+        assert (await async_client.get("/ready")).json() == {"status": "ready", "replica": "usable"}
+
+        # the primary announced a generation the replica hasn't replayed yet
+        monkeypatch.setattr(dataset_generation, "current", replica.generation + 1)
+        conn = await server.connect_for_read()
+        assert conn.engine is engine
+        await conn.close()
+        monkeypatch.setattr(dataset_generation, "current", None)
+    finally:
+        await replica_engine.dispose()
+
+    # nothing listens on port 1
+    unreachable = server.make_engine(engine.url.set(host="127.0.0.1", port=1), timeout=1)
+    monkeypatch.setattr(server, "replica_engine", unreachable)
+    monkeypatch.setattr(replica, "engine", unreachable)
+    conn = await server.connect_for_read()
+    assert conn.engine is engine and not replica.healthy
+    await conn.close()
+    await replica.check()
+    assert not replica.healthy
+    assert (await async_client.get("/loans")).status_code == 200
+
 # Test get loans endpoint
 @pytest.mark.asyncio
 async def test_get_loans(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
@@ -112,6 +192,23 @@ async def test_search_by_borrower(async_client: AsyncClient, test_loan_data: dic
     assert len(data) == 1
     assert data[0]["BorrowerName"] == test_loan_data["BorrowerName"]
 
+# Test that borrower search normalizes the query and matches substrings and misspellings
+@pytest.mark.asyncio
+async def test_search_by_borrower_fuzzy(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    for borrower_name in ["coatings", "Sumter-Coatings", "sumtr coatings"]:
+        response: Response = await async_client.get("/loans/search/by-borrower", params={"borrower_name": borrower_name})
+        assert response.status_code == 200
+        data: List[PPPLoanDataSchema] = response.json()
+        assert len(data) == 1
+        assert data[0]["LoanNumber"] == test_loan_data["LoanNumber"]
+
+    response = await async_client.get("/loans/search/by-borrower", params={"borrower_name": "delta leasing"})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = await async_client.get("/loans/search/by-borrower", params={"borrower_name": "coatings", "limit": 0})
+    assert response.status_code == 422
+
 # Test search by loan number
 @pytest.mark.asyncio
 async def test_search_by_loan_number(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
@@ -120,6 +217,492 @@ async def test_search_by_loan_number(async_client: AsyncClient, test_loan_data:
     data: PPPLoanDataSchema = response.json()
     assert data["LoanNumber"] == test_loan_data["LoanNumber"]
 
+# Test that the compact schema's BIGINT loan numbers read back as the loan number that was looked up,
+# and that one with leading zeros matches nothing rather than the loan without them
+def test_compact_loan_number_round_trip():
+    loan_number = LoanNumber()
+    assert loan_number.process_result_value(loan_number.process_bind_param("9547507704", None), None) == "9547507704"
+    assert loan_number.process_bind_param("0009547507704", None) is None
+    assert loan_number.process_bind_param("9547-507704", None) is None
+
+# Test that the listings page through every loan exactly once with the X-Next-Cursor header
+@pytest.mark.asyncio
+async def test_keyset_pagination(async_client: AsyncClient):
+    async with async_session() as session:
+        for i in range(5):
+            session.add(PPPLoanData(
+                loan_number=f"95475077{i:02d}",
+                date_approved=datetime(2020, 5, 1 + i % 2).date(),
+                borrower_name=f"COMPANY {i} LLC",
+                borrower_name_normalized=normalize(f"COMPANY {i} LLC"),
+                forgiveness_amount=1000.0 * (i % 3),
+            ))
+        await session.commit()
+
+    async def collect(path: str, params: dict[str, Any]) -> List[str]:
+        loan_numbers, cursor = [], None
+        while True:
+            response: Response = await async_client.get(path, params={**params, "limit": 2, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            assert len(response.json()) <= 2
+            loan_numbers += [loan["LoanNumber"] for loan in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return loan_numbers
+
+    assert await collect("/loans", {}) == [f"95475077{i:02d}" for i in range(5)]
+    # ordered by (date_approved, loan_number)
+    assert await collect("/loans/search/by-date-range", {"start_date": "2020-05-01", "end_date": "2020-05-02"}) == [
+        "9547507700", "9547507702", "9547507704", "9547507701", "9547507703",
+    ]
+    # ordered by forgiveness amount then loan number, both descending
+    assert await collect("/loans/search/by-forgiveness-amount", {"min_forgiveness_amount": 1000}) == [
+        "9547507702", "9547507704", "9547507701",
+    ]
+    assert sorted(await collect("/loans/search/by-borrower", {"borrower_name": "company llc"})) == [f"95475077{i:02d}" for i in range(5)]
+
+    # a cursor only continues the listing it came from
+    response = await async_client.get("/loans", params={"limit": 2})
+    cursor = response.headers["X-Next-Cursor"]
+    response = await async_client.get("/loans/search/by-date-range", params={"start_date": "2020-05-01", "end_date": "2020-05-02", "cursor": cursor})
+    assert response.status_code == 400
+    response = await async_client.get("/loans", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    response = await async_client.get("/loans", params={"limit": 10_000})
+    assert response.status_code == 422
+
+# Test that a snapshot of the database serves the same loans, pages and cursors as the database itself
+@pytest.mark.asyncio
+async def test_snapshot_serving(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan, tmp_path, monkeypatch):
+    async with async_session() as session:
+        for i in range(4):
+            session.add(PPPLoanData(
+                loan_number=f"95475077{i:02d}",
+                date_approved=datetime(2020, 5, 1 + i % 2).date(),
+                borrower_name=f"COMPANY {i} LLC",
+                borrower_name_normalized=normalize(f"COMPANY {i} LLC"),
+                borrower_state="SC" if i % 2 else "NC",
+                forgiveness_amount=1000.0 * (i % 3),
+            ))
+        await session.commit()
+    generation = write_snapshot(str(tmp_path / "snapshot"))
+
+    requests = [
+        ("/loans", {"limit": 2}),
+        ("/loans/search/by-loan-number", {"loan_number": test_loan_data["LoanNumber"]}),
+        ("/loans/search/by-date-range", {"start_date": "2020-05-01", "end_date": "2020-05-02", "limit": 2}),
+        ("/loans/search/by-forgiveness-amount", {"min_forgiveness_amount": 1000, "limit": 2}),
+        ("/loans/search/by-borrower", {"borrower_name": "company llc", "limit": 2}),
+        ("/loans/search/by-borrower", {"borrower_name": "sumter", "borrower_state": "SC"}),
+        ("/loans/search", {"state": "SC", "fields": "BorrowerName,ForgivenessAmount"}),
+    ]
+
+    async def collect(path: str, params: dict[str, Any]) -> List[Any]:
+        # every page, and the cursors that lead to them
+        pages, cursor = [], None
+        while True:
+            response: Response = await async_client.get(path, params={**params, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            body = response.json()
+            pages.append([{k: v for k, v in loan.items() if k != "shard_id"} for loan in body] if isinstance(body, list) else body)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return pages
+
+    async def by_loan_numbers() -> Any:
+        response: Response = await async_client.post("/loans/search/by-loan-numbers", json={
+            "loan_numbers": [test_loan_data["LoanNumber"], "9547507701", "1111111111"],
+        })
+        assert response.status_code == 200
+        return response.json()
+
+    expected = [await collect(path, params) for path, params in requests]
+    expected_by_loan_numbers = await by_loan_numbers()
+    # the database breaks ties between equal amounts arbitrarily
+    top_amounts = [loan["ForgivenessAmount"] for loan in (await async_client.get("/loans/top-borrowers")).json()]
+    exported = (await async_client.get("/loans/export", params={"state": "SC"})).text
+    monkeypatch.setattr(server, "snapshot", LoanSnapshot(str(tmp_path / "snapshot")))
+    assert [await collect(path, params) for path, params in requests] == expected
+    assert len(expected[0]) == 3
+    response = await async_client.get("/loans", params={"fields": "borrower_name_normalized"})
+    assert response.status_code == 400
+    assert await by_loan_numbers() == expected_by_loan_numbers
+    assert [loan["ForgivenessAmount"] for loan in (await async_client.get("/loans/top-borrowers")).json()] == top_amounts
+
+    # the snapshot holds days, the wide schema's timestamps are exported as dates
+    response: Response = await async_client.get("/loans/export", params={"state": "SC"})
+    loans = [PPPLoanDataSchema.model_validate_json(line) for line in response.text.splitlines()]
+    assert loans == [PPPLoanDataSchema.model_validate_json(line) for line in exported.splitlines()]
+    response = await async_client.get("/loans/export", params={"format": "csv", "state": "CA"})
+    assert response.text.splitlines() == [response.text.splitlines()[0]]
+
+    response = await async_client.get("/ready")
+    assert response.json() == {"status": "ready", "snapshot": generation}
+    response = await async_client.get("/analytics/by-state")
+    assert response.status_code == 503
+
+# Test that the multi filter search combines its filters and that the borrower search honours state and city
+@pytest.mark.asyncio
+async def test_search_loans(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    loan_number = test_loan_data["LoanNumber"]
+
+    async def search(path: str = "/loans/search", **params) -> List[str]:
+        response: Response = await async_client.get(path, params=params)
+        assert response.status_code == 200
+        return [loan["LoanNumber"] for loan in response.json()]
+
+    assert await search(borrower_state="sc", borrower_city="SUMTER", borrower_zip="29150") == [loan_number]
+    assert await search(borrower_name="coatings", start_date="2020-05-01", end_date="2020-05-01") == [loan_number]
+    assert await search(min_approval_amount=700000, max_approval_amount=800000) == [loan_number]
+    assert await search(borrower_state="SC", max_approval_amount=1000) == []
+    assert await search(borrower_zip="29151") == []
+    assert await search(lender="Synovus Bank") == []
+
+    path = "/loans/search/by-borrower"
+    assert await search(path, borrower_name=test_loan_data["BorrowerName"], borrower_state="SC", borrower_city="sumter") == [loan_number]
+    assert await search(path, borrower_name=test_loan_data["BorrowerName"], borrower_state="CA") == []
+
+# Test the typeahead suggests the borrower once its index is built, whatever the casing of the prefix
+@pytest.mark.asyncio
+async def test_suggest_borrower_names(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    await refresh_borrower_names()
+    borrower_name = test_loan_data["BorrowerName"]
+    response: Response = await async_client.get("/loans/suggest", params={"q": borrower_name[:4].lower()})
+    assert response.status_code == 200
+    assert response.json() == [{"borrower_name": borrower_name, "loan_count": 1}]
+
+    response = await async_client.get("/loans/suggest", params={"q": "zzzz no such borrower"})
+    assert response.json() == []
+
+# Test the batch loan number lookup returns the loans found and the misses, and caps the batch size
+@pytest.mark.asyncio
+async def test_search_by_loan_numbers(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    loan_number = test_loan_data["LoanNumber"]
+    response: Response = await async_client.post("/loans/search/by-loan-numbers", json={
+        "loan_numbers": ["1111111111", loan_number, "1111111111", "not-a-loan"],
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert [loan["LoanNumber"] for loan in data["loans"]] == [loan_number]
+    assert data["loans"][0] == (await async_client.get("/loans/search/by-loan-number", params={"loan_number": loan_number})).json()
+    assert data["missing"] == ["1111111111", "not-a-loan"]
+
+    response = await async_client.post("/loans/search/by-loan-numbers", params={"fields": "LoanNumber,BorrowerState"}, json={
+        "loan_numbers": [loan_number],
+    })
+    assert response.json() == {"loans": [{"LoanNumber": loan_number, "BorrowerState": test_loan_data["BorrowerState"]}], "missing": []}
+
+    response = await async_client.post("/loans/search/by-loan-numbers", json={"loan_numbers": [str(i) for i in range(MAX_LOAN_NUMBER_BATCH + 1)]})
+    assert response.status_code == 422
+    response = await async_client.post("/loans/search/by-loan-numbers", json={"loan_numbers": []})
+    assert response.status_code == 422
+
+# Test that a fields projection returns only the requested keys, with the same values as the full response
+@pytest.mark.asyncio
+async def test_fields_projection(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    full = (await async_client.get("/loans")).json()[0]
+    response: Response = await async_client.get("/loans", params={"fields": "BorrowerName, borrower_city,DateApproved"})
+    assert response.status_code == 200
+    assert response.json() == [{key: full[key] for key in ("BorrowerName", "BorrowerCity", "DateApproved")}]
+
+    response = await async_client.get("/loans/search/by-loan-number", params={
+        "loan_number": test_loan_data["LoanNumber"], "fields": "LoanNumber,InitialApprovalAmount",
+    })
+    assert response.json() == {"LoanNumber": test_loan_data["LoanNumber"], "InitialApprovalAmount": test_loan_data["InitialApprovalAmount"]}
+
+    response = await async_client.get("/loans/search/by-date-range", params={
+        "start_date": "2020-05-01", "end_date": "2020-05-01", "limit": 1, "fields": "BorrowerState",
+    })
+    assert response.json() == [{"BorrowerState": test_loan_data["BorrowerState"]}]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = await async_client.get("/loans", params={"fields": "LoanNumber,NotAField"})
+    assert response.status_code == 400
+
+    # the normalized name is only stored for the search index
+    response = await async_client.get("/loans", params={"fields": "LoanNumber,borrower_name_normalized"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown field: borrower_name_normalized"
+
+# Test that the export endpoint streams the filtered loans as NDJSON and CSV
+@pytest.mark.asyncio
+async def test_export_loans(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    response: Response = await async_client.get("/loans/export", params={"state": "sc", "start_date": "2020-05-01"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert len(lines) == 1
+    loan = PPPLoanDataSchema.model_validate_json(lines[0])
+    assert loan.loan_number == test_loan_data["LoanNumber"]
+    assert loan.borrower_name == test_loan_data["BorrowerName"]
+
+    response = await async_client.get("/loans/export", params={"format": "csv", "borrower_name": "sumter coatings"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 1
+    assert rows[0]["loan_number"] == test_loan_data["LoanNumber"]
+    assert rows[0]["borrower_state"] == test_loan_data["BorrowerState"]
+
+    response = await async_client.get("/loans/export", params={"format": "csv", "state": "CA"})
+    assert response.text.splitlines()[0].startswith("loan_number,date_approved")
+    assert len(response.text.splitlines()) == 1
+
+# Test that top borrowers are cached per dataset generation and recomputed once it is bumped
+@pytest.mark.asyncio
+async def test_top_borrowers_cache(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    async with engine.begin() as conn:
+        await conn.execute(text("UPDATE ppp_loan_data_airflow SET forgiveness_amount = 100"))
+    dataset_generation.current = 1
+    try:
+        response: Response = await async_client.get("/loans/top-borrowers")
+        assert [loan["ForgivenessAmount"] for loan in response.json()] == [100]
+
+        # a change the generation doesn't know about is not visible
+        async with engine.begin() as conn:
+            await conn.execute(text("UPDATE ppp_loan_data_airflow SET forgiveness_amount = 200"))
+        response = await async_client.get("/loans/top-borrowers")
+        assert [loan["ForgivenessAmount"] for loan in response.json()] == [100]
+
+        dataset_generation.current = 2
+        response = await async_client.get("/loans/top-borrowers")
+        assert [loan["ForgivenessAmount"] for loan in response.json()] == [200]
+    finally:
+        dataset_generation.current = None
+        response_cache.clear()
+
+# Test data responses carry an ETag per generation, encoding and query, and a matching If-None-Match gets an empty 304
+@pytest.mark.asyncio
+async def test_etag_and_compression(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    dataset_generation.current = 1
+    try:
+        response: Response = await async_client.get("/loans", headers={"Accept-Encoding": "br"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "br"
+        assert response.headers["cache-control"] == "no-cache"
+        etag = response.headers["etag"]
+        assert etag.startswith('"1-') and etag.endswith('-br"')
+        assert response.json()[0]["LoanNumber"] == test_loan_data["LoanNumber"]
+
+        response = await async_client.get("/loans", headers={"Accept-Encoding": "br", "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+        # another query, identity encoding and a new generation each make it a different representation
+        response = await async_client.get("/loans?limit=5", headers={"Accept-Encoding": "br", "If-None-Match": etag})
+        assert response.status_code == 200
+        response = await async_client.get("/loans", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert response.headers["etag"] == etag.removesuffix('-br"') + '"'
+        dataset_generation.current = 2
+        response = await async_client.get("/loans", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["etag"].startswith('"2-')
+
+        # small responses aren't compressed, and no ETag is given while the generation is unknown
+        response = await async_client.get("/loans?fields=LoanNumber", headers={"Accept-Encoding": "br"})
+        assert "content-encoding" not in response.headers
+        assert "Accept-Encoding" in response.headers["vary"]
+        dataset_generation.current = None
+        assert "etag" not in (await async_client.get("/loans")).headers
+    finally:
+        dataset_generation.current = None
+        response_cache.clear()
+
+# Test the analytics endpoints against freshly built rollup tables
+@pytest.mark.asyncio
+async def test_analytics_rollups(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan):
+    assert CreateTempTables().create_rollup_tables()
+
+    response: Response = await async_client.get("/analytics/by-state", params={"state": "sc"})
+    assert response.status_code == 200
+    assert response.json() == [{
+        "group_key": test_loan_data["BorrowerState"],
+        "loan_count": 1,
+        "approval_count": 1,
+        "total_approval_amount": test_loan_data["CurrentApprovalAmount"],
+        "avg_approval_amount": test_loan_data["CurrentApprovalAmount"],
+        "total_forgiveness_amount": None,
+        "total_jobs_reported": None,
+    }]
+
+    # groups with a missing key are reported as "Unknown"
+    for path, params in [
+        ("/analytics/by-lender", {"role": "originating"}),
+        ("/analytics/by-naics", {"level": "sector"}),
+        ("/analytics/by-business-type", {}),
+    ]:
+        response = await async_client.get(path, params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert [row["group_key"] for row in data] == ["Unknown"]
+        assert data[0]["loan_count"] == 1
+
+    response = await async_client.get("/analytics/by-state", params={"state": "CA"})
+    assert response.json() == []
+
+    # a loan without an approval amount doesn't bring the sector average down
+    async with async_session() as session:
+        session.add(PPPLoanData(loan_number="9547507799", date_approved=datetime(2020, 5, 1).date(), borrower_name="NO AMOUNT LLC"))
+        await session.commit()
+    assert CreateTempTables().create_rollup_tables()
+    response = await async_client.get("/analytics/by-naics", params={"level": "sector"})
+    sector = response.json()[0]
+    assert (sector["loan_count"], sector["approval_count"]) == (2, 1)
+    assert sector["avg_approval_amount"] == test_loan_data["CurrentApprovalAmount"]
+
+# Test that the chatbot answers from the generated SQL, that other requests are served while it waits on OpenAI,
+# and that a repeated question is answered from the caches
+@pytest.mark.asyncio
+async def test_ask_question(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan, monkeypatch):
+    release = asyncio.Event()
+    prompts: List[str] = []
+
+    async def openai(request: httpx.Request) -> httpx.Response:
+        # stands in for the OpenAI API: the first call asks for SQL, the second for the answer
+        prompts.append(json.loads(request.content)["messages"][1]["content"])
+        await release.wait()
+        if len(prompts) == 1:
+            content = "```sql\nSELECT borrower_name, loan_number FROM ppp_loan_data_airflow WHERE borrower_name_normalized LIKE '%sumter%'\n```"
+        else:
+            content = "Sumter Coatings got one loan."
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(server, "openai_client", httpx.AsyncClient(transport=httpx.MockTransport(openai)))
+    monkeypatch.setattr(server, "chat_sql_cache", PersistentCache(None, "chat_sql", maxsize=10, ttl=60))
+    monkeypatch.setattr(server, "chat_answer_cache", PersistentCache(None, "chat_answers", maxsize=10, ttl=60))
+    monkeypatch.setattr(dataset_generation, "current", 1)
+    question = asyncio.create_task(async_client.post("/ask-question", json={"question": "Which lender served Sumter Coatings?"}))
+    while not prompts:
+        await asyncio.sleep(0.01)
+    # the question is waiting on OpenAI, the event loop is not
+    response: Response = await asyncio.wait_for(async_client.get("/health"), timeout=5)
+    assert response.status_code == 200
+    release.set()
+
+    response = await question
+    assert response.status_code == 200
+    data = response.json()
+    assert data["postgres_sql_query"].startswith("SELECT borrower_name, loan_number")
+    assert data["result"] == [[test_loan_data["BorrowerName"], test_loan_data["LoanNumber"]]]
+    assert data["truncated"] is False and data["row_count"] == 1
+    assert data["response"] == "Sumter Coatings got one loan."
+    assert test_loan_data["LoanNumber"] in prompts[1]
+    assert "Total Rows: 1" in prompts[1]
+
+    # the same question asked differently needs neither OpenAI nor the database
+    response = await async_client.post("/ask-question", json={"question": "  which lender served sumter coatings"})
+    assert response.status_code == 200
+    assert {key: value for key, value in response.json().items() if key != "question"} == {key: value for key, value in data.items() if key != "question"}
+    assert len(prompts) == 2
+    # after a reload the cached SQL runs again and only the summary is generated
+    monkeypatch.setattr(dataset_generation, "current", 2)
+    response = await async_client.post("/ask-question", json={"question": "Which lender served Sumter Coatings?"})
+    assert response.json()["result"] == data["result"]
+    assert len(prompts) == 3
+    metrics = (await async_client.get("/metrics")).text
+    assert 'ppp_api_chat_cache_lookups_total{cache="sql",outcome="hit"}' in metrics
+
+# Test that the streaming chatbot sends the SQL, the rows, the summary as it is generated and the whole summary
+@pytest.mark.asyncio
+async def test_ask_question_stream(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan, monkeypatch):
+    def openai(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        if not body.get("stream"):
+            content = "SELECT borrower_name, loan_number FROM ppp_loan_data_airflow WHERE borrower_name_normalized LIKE '%sumter%'"
+            return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+        # the completion API streams the summary as server-sent events
+        pieces = ["\n", "Sumter Coatings", " got one loan."]
+        events = "".join(f"data: {json.dumps({'choices': [{'delta': {'content': piece}}]})}\n\n" for piece in pieces)
+        return httpx.Response(200, content=events + "data: [DONE]\n\n", headers={"Content-Type": "text/event-stream"})
+
+    def read_events(response: Response) -> List[tuple]:
+        return [
+            (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("\n")[1].removeprefix("data: ")))
+            for block in response.text.strip().split("\n\n")
+        ]
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(server, "openai_client", httpx.AsyncClient(transport=httpx.MockTransport(openai)))
+    monkeypatch.setattr(server, "chat_sql_cache", PersistentCache(None, "chat_sql", maxsize=10, ttl=60))
+    monkeypatch.setattr(server, "chat_answer_cache", PersistentCache(None, "chat_answers", maxsize=10, ttl=60))
+    monkeypatch.setattr(dataset_generation, "current", 1)
+    response: Response = await async_client.post("/ask-question/stream", json={"question": "Which lender served Sumter Coatings?"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = read_events(response)
+    assert [event for event, _ in events] == ["sql", "rows", "token", "token", "response"]
+    assert events[0][1]["postgres_sql_query"].startswith("SELECT borrower_name, loan_number")
+    assert events[1][1] == {"result": [[test_loan_data["BorrowerName"], test_loan_data["LoanNumber"]]], "truncated": False, "row_count": 1}
+    assert [data for event, data in events if event == "token"] == ["Sumter Coatings", " got one loan."]
+    assert events[-1][1] == {"response": "Sumter Coatings got one loan."}
+
+    # the streamed answer was cached, the JSON endpoint and the stream both answer from it
+    response = await async_client.post("/ask-question", json={"question": "Which lender served Sumter Coatings?"})
+    assert response.json()["response"] == "Sumter Coatings got one loan."
+    response = await async_client.post("/ask-question/stream", json={"question": "which lender served sumter coatings"})
+    assert [event for event, _ in read_events(response)] == ["sql", "rows", "response"]
+
+    # a failing stage ends the stream with an error event
+    monkeypatch.setattr(server, "CHAT_MAX_COST", 0)
+    response = await async_client.post("/ask-question/stream", json={"question": "top 5 borrowers"})
+    assert [event for event, _ in read_events(response)] == ["sql", "error"]
+    assert read_events(response)[-1][1]["status_code"] == 422
+
+# Test that a common question is answered by its SQL template, without OpenAI
+@pytest.mark.asyncio
+async def test_ask_question_intent(async_client: AsyncClient, test_loan_data: dict[str, Any], insert_test_loan, monkeypatch):
+    def openai(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("a matched intent must not call OpenAI")
+
+    monkeypatch.setattr(server, "openai_client", httpx.AsyncClient(transport=httpx.MockTransport(openai)))
+    monkeypatch.setattr(server, "chat_answer_cache", PersistentCache(None, "chat_answers", maxsize=10, ttl=60))
+    response: Response = await async_client.post("/ask-question", json={"question": "Which loans did Sumter Coatings get?"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["intent"] == "company_loans"
+    assert "$1" in data["postgres_sql_query"]
+    assert [row[1] for row in data["result"]] == [test_loan_data["LoanNumber"]]
+    assert data["response"].startswith('1 loan matched "sumter coatings"')
+    metrics = (await async_client.get("/metrics")).text
+    assert 'ppp_api_chat_intents_total{intent="company_loans"}' in metrics
+
+# Test that the chatbot's SQL runs read only with a statement timeout, and that big results are cut off and counted
+@pytest.mark.asyncio
+async def test_chat_query_limits(monkeypatch):
+    monkeypatch.setattr(server, "CHAT_MAX_ROWS", 2)
+    assert await server.query_chat_database("SELECT generate_series(1, 5);") == ([(1,), (2,)], True, 5)
+    assert await server.query_chat_database("SELECT 1") == ([(1,)], False, 1)
+    assert await server.query_chat_database("SELECT current_setting('default_transaction_read_only')") == ([("on",)], False, 1)
+    assert await server.query_chat_database("SELECT current_setting('statement_timeout')") == ([("10s",)], False, 1)
+    with pytest.raises(Exception, match="read-only transaction"):
+        await server.query_chat_database("DELETE FROM ppp_loan_data_airflow")
+
+    # a count that would take too long is skipped, the rows are still returned
+    monkeypatch.setattr(server, "CHAT_COUNT_TIMEOUT", 0.05)
+    rows, truncated, row_count = await server.query_chat_database("SELECT i, pg_sleep(0.02) FROM generate_series(1, 10) AS i")
+    assert [row[0] for row in rows] == [1, 2]
+    assert truncated is True and row_count is None
+
+# Test that the chatbot's queries are EXPLAINed first: big results run under a LIMIT, expensive plans don't run
+@pytest.mark.asyncio
+async def test_chat_query_cost_guard(async_client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(server, "CHAT_MAX_ROWS", 2)
+    monkeypatch.setattr(server, "CHAT_MAX_COST", 1000)
+    # estimated at 100000 rows, under the LIMIT it only costs the 3 it reads
+    assert await server.query_chat_database("SELECT i FROM generate_series(1, 100000) AS i") == ([(1,), (2,)], True, 100000)
+    # a cross join costs too much with or without a LIMIT
+    with pytest.raises(server.HTTPException) as error:
+        await server.query_chat_database("SELECT count(*) FROM generate_series(1, 100000) AS a, generate_series(1, 100000) AS b")
+    assert error.value.status_code == 422
+    metrics = (await async_client.get("/metrics")).text
+    assert 'ppp_api_chat_query_plans_total{plan="limited"}' in metrics
+    assert 'ppp_api_chat_query_plans_total{plan="rejected"}' in metrics
+
 ###########################
 #  API HELPER FUNCTIONS   #
 ###########################
@@ -142,6 +725,7 @@ async def insert_test_loan(test_loan_data: dict[str, Any]):
             loan_number=test_loan_data["LoanNumber"],
             date_approved=date_approved,
             borrower_name=test_loan_data["BorrowerName"],
+            borrower_name_normalized=normalize(test_loan_data["BorrowerName"]),
             sba_office_code=test_loan_data["SBAOfficeCode"],
             processing_method=test_loan_data["ProcessingMethod"],
             borrower_address=test_loan_data["BorrowerAddress"],
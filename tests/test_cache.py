@@ -0,0 +1,115 @@
+"""
+This test will test the response cache in cache.py without needing a database.
+    - Test that entries expire after the TTL and the least recently used entry is evicted past maxsize.
+    - Test that cache keys carry the dataset generation and are None while it is unknown.
+    - Test that changed() wakes up once a new generation is known.
+    - Test that the SQLite backed cache keeps its entries across instances, expires them and stays bounded.
+"""
+import asyncio
+
+from cache import MISSING, DatasetGeneration, PersistentCache, TTLCache
+
+class FakeTimer:
+    """A clock the test advances by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTTLCache:
+    """Test the TTL + LRU response cache."""
+
+    def test_ttl_expiry(self):
+        """Test that an entry is served until its TTL runs out, and that None is a cacheable value."""
+        timer = FakeTimer()
+        cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+        cache.set("loan", None)
+        assert cache.get("loan") is None
+        assert cache.get("other") is MISSING
+
+        timer.now = 59
+        assert cache.get("loan") is None
+        timer.now = 60
+        assert cache.get("loan") is MISSING
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted once the cache is full."""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # "b" is now the least recently used
+        cache.set("c", 3)
+        assert cache.get("b") is MISSING
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_generation_keys(self):
+        """Test that keys change with the generation and the cache is bypassed while it is unknown."""
+        generation = DatasetGeneration("postgresql://localhost/postgres")
+        assert generation.key("top-borrowers") is None
+
+        generation._on_notify(None, 0, "ppp_dataset_generation", "7")
+        assert generation.key("by-loan-number", "9547507704") == (7, "by-loan-number", "9547507704")
+        generation._on_notify(None, 0, "ppp_dataset_generation", "8")
+        assert generation.key("top-borrowers") == (8, "top-borrowers")
+
+    def test_generation_changed(self):
+        """Test that changed() waits for a generation other than the one it was given."""
+        async def wait_for_bump():
+            generation = DatasetGeneration("postgresql://localhost/postgres")
+            generation._on_notify(None, 0, "ppp_dataset_generation", "7")
+            assert await generation.changed(None) == 7
+
+            waiter = asyncio.create_task(generation.changed(7))
+            await asyncio.sleep(0)
+            generation._on_notify(None, 0, "ppp_dataset_generation", "7")
+            await asyncio.sleep(0)
+            assert not waiter.done()
+            generation._on_notify(None, 0, "ppp_dataset_generation", "8")
+            assert await waiter == 8
+
+        asyncio.run(wait_for_bump())
+
+class TestPersistentCache:
+    """Test the TTL + LRU cache backed by a SQLite table."""
+
+    def test_survives_restart(self, tmp_path):
+        """Test that a new cache on the same file serves the entries, with JSON values and tuple keys."""
+        path = str(tmp_path / "chat.sqlite")
+        cache = PersistentCache(path, "chat_answers", maxsize=10, ttl=60)
+        cache.set((3, "chat-answer", "SELECT 1"), {"result": [[1, "1.50"]], "response": "One."})
+        cache.close()
+
+        cache = PersistentCache(path, "chat_answers", maxsize=10, ttl=60)
+        assert len(cache.memory) == 0
+        assert cache.get((3, "chat-answer", "SELECT 1")) == {"result": [[1, "1.50"]], "response": "One."}
+        assert len(cache.memory) == 1
+        assert cache.get((4, "chat-answer", "SELECT 1")) is MISSING
+        # tables are independent
+        assert PersistentCache(path, "chat_sql", maxsize=10, ttl=60).get((3, "chat-answer", "SELECT 1")) is MISSING
+
+    def test_expiry_and_bound(self, tmp_path):
+        """Test that entries expire on disk too, and that the table keeps the maxsize entries that expire last."""
+        timer = FakeTimer()
+        path = str(tmp_path / "chat.sqlite")
+        cache = PersistentCache(path, "chat_sql", maxsize=2, ttl=60, timer=timer)
+        for i, question in enumerate(["a", "b", "c"]):
+            timer.now = i
+            cache.set(question, f"SELECT {i}")
+
+        restarted = PersistentCache(path, "chat_sql", maxsize=2, ttl=60, timer=timer)
+        assert restarted.get("a") is MISSING
+        assert restarted.get("b") == "SELECT 1"
+        timer.now = 61
+        assert restarted.get("b") is MISSING
+        assert restarted.get("c") == "SELECT 2"
+
+    def test_without_path(self):
+        """Test that without a file it is an in-memory cache."""
+        cache = PersistentCache(None, "chat_sql", maxsize=10, ttl=60)
+        cache.set("a", "SELECT 1")
+        assert cache.get("a") == "SELECT 1"
+        assert cache.get("b") is MISSING
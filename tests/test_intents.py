@@ -0,0 +1,71 @@
+"""
+This test will test the chatbot's intent matcher in machine_learning_application/intents.py without needing a database.
+    - Test that the common questions are matched to their templates, with the parameters taken from the question.
+    - Test that other questions are left to the LLM.
+    - Test that the templates summarize their rows.
+"""
+import datetime
+
+from machine_learning_application.intents import match_intent
+
+class TestMatchIntent:
+    """Test the rules mapping questions to vetted SQL templates."""
+
+    def test_common_questions(self):
+        """Test that each intent is matched however the question is phrased."""
+        cases = {
+            "Show me the top 5 states by total forgiveness": ("state_totals", (5,)),
+            "jobs reported per state": ("state_totals", (100,)),
+            "How many loans were approved in Texas?": ("state_total", ("TX",)),
+            "total forgiveness in CA": ("state_total", ("CA",)),
+            "top 10 borrowers": ("top_borrowers", (10,)),
+            "Who are the biggest borrowers?": ("top_borrowers", (10,)),
+            "What are the 20 largest loans": ("top_borrowers", (20,)),
+            "Which loans did Sumter Coatings get?": ("company_loans", ("%sumter coatings%", 100)),
+            "loans for Acme, Inc.": ("company_loans", ("%acme inc%", 100)),
+            "What is the average loan in Austin, Texas?": ("city_average", ("TX", "AUSTIN")),
+            "average loan amount in miami fl": ("city_average", ("FL", "MIAMI")),
+            "average loan in springfield": ("city_average", ("SPRINGFIELD",)),
+        }
+        for question, (intent, args) in cases.items():
+            match = match_intent(question)
+            assert match is not None, question
+            assert (match.intent, match.args) == (intent, args), question
+
+        assert "total_forgiveness_amount" in match_intent("top 5 states by total forgiveness").sql
+        assert "loan_count" in match_intent("number of loans by state").sql
+
+    def test_other_questions(self):
+        """Test that questions without a template, or without a usable parameter, go to the LLM."""
+        for question in [
+            "Who is the business with the longest who had their loan status approval take the longest time?",
+            "top borrowers by approval amount",
+            "loans for a",
+            "total forgiveness in atlantis",
+            "average loan in austin, atlantis",
+        ]:
+            assert match_intent(question) is None, question
+
+    def test_summaries(self):
+        """Test that the answers are formatted from the rows."""
+        match = match_intent("which loans did acme get")
+        rows = [("ACME INC", "123", datetime.datetime(2020, 5, 1), 2500.0, None, 2, 3500.0), ("ACME LLC", "456", datetime.datetime(2020, 6, 1), 1000.0, 1000.0, 2, 3500.0)]
+        assert match.summarize(rows, 2) == (
+            '2 loans matched "acme", $3,500.00 approved in total. '
+            "The largest went to ACME INC (loan 123, approved 2020-05-01, $2,500.00)."
+        )
+        # more matches than the LIMIT returned
+        assert match.summarize(rows[:1], 1).endswith("The 1 largest are listed.")
+        assert match.summarize([], 0) == 'No loans were found for borrowers matching "acme".'
+
+        match = match_intent("top 2 borrowers")
+        assert "ORDER BY current_approval_amount DESC NULLS LAST" in match.sql
+        assert match.summarize([("ACME INC", "Austin", "TX", 2500.0)], 1) == "The 1 largest loans by approved amount went to: ACME INC in Austin, TX ($2,500.00)."
+        match = match_intent("top 2 borrowers by forgiveness")
+        assert "ORDER BY forgiveness_amount DESC" in match.sql
+        assert match.summarize([("ACME INC", "Austin", "TX", 2000.0)], 1) == "The 1 largest loans by forgiveness amount went to: ACME INC in Austin, TX ($2,000.00)."
+
+        match = match_intent("top 2 states by number of loans")
+        assert match.summarize([("CA", 1000), ("TX", 900)], 2) == "States by loans: CA: 1,000 loans; TX: 900 loans."
+        assert match_intent("how many loans in texas").summarize([(900, 900)], 1) == "TX had 900 loans."
+        assert match_intent("average loan in miami fl").summarize([(0, None)], 1) == "No loans were found in Miami, FL."
@@ -4,11 +4,15 @@ For the PPPLoanDataSchema:
     - Test that the model is created correctly and all computed fields are working as expected.
     - Test the model against a sample record from the database.
     - Test that the model will drop any rows that are missing the required fields: loan_number, date_approved, borrower_name.
+    - Test that the model encodes to the compact storage schema.
+    - Test that the fast JSON encoding of database rows matches the model's serialization.
     - Test the ProcessPPPLoanDataDoFn function in the run.py file.
 For the QuestionRequest and QuestionResponse models:
     - Test that the models are created correctly and all fields are working as expected.
     - Test that the models will drop any rows that are missing the required fields: question.
 """
+import types
+import orjson
 import pytest
 import datetime
 import apache_beam as beam
@@ -17,6 +21,7 @@ from typing import Any
 from apache_beam.testing.test_pipeline import TestPipeline as PPPLoanDataTestPipeline
 from models import PPPLoanDataSchema, QuestionRequest, QuestionResponse
 from run import ProcessPPPLoanDataDoFn
+from encoding import dumps_loans
 from pydantic import ValidationError
 
 class TestPPPLoanDataSchema:
@@ -95,10 +100,26 @@ class TestPPPLoanDataSchema:
             "BorrowerName": "SUMTER COATINGS, INC.",
         }
 
+        # TestCase4 [Non-numeric Loan Number] (@field_validator error)
+        test_case_4: dict[str, Any] = {
+            "LoanNumber": "9547-507704",
+            "DateApproved": "05/01/2020",
+            "BorrowerName": "SUMTER COATINGS, INC.",
+        }
+
+        # TestCase5 [Leading Zeros] (@field_validator error, the compact schema would store it as 12345)
+        test_case_5: dict[str, Any] = {
+            "LoanNumber": "0012345",
+            "DateApproved": "05/01/2020",
+            "BorrowerName": "SUMTER COATINGS, INC.",
+        }
+
         test_cases: list[dict[str, Any]] = [
             test_case_1,
             test_case_2,
             test_case_3,
+            test_case_4,
+            test_case_5,
         ]
 
         for test_case in test_cases:
@@ -173,6 +194,54 @@ class TestPPPLoanDataSchema:
         assert record.originating_lender_full_address == "Synovus Bank, COLUMBUS, GA"
         assert record.shard_id == abs(hash(self.SAMPLE_RECORD["LoanNumber"]))
     
+    def test_to_compact(self):
+        """Test that the loan encodes to the compact storage schema and its lender/category dimensions."""
+        record: PPPLoanDataSchema = PPPLoanDataSchema(**self.SAMPLE_RECORD)
+
+        lenders = record.lenders()
+        assert [lender.location_id for lender in lenders] == [19248, 19248]
+        assert lenders[0].address == "1148 Broadway"
+        assert lenders[0].completeness() > lenders[1].completeness()
+
+        category_values = dict(record.category_values())
+        assert category_values["race"] == "Unanswered"
+        assert "franchise_name" not in category_values
+
+        codes = {value: code for code, value in enumerate(record.category_values(), start=1)}
+        compact = record.to_compact(codes)
+        assert compact.loan_number == 9547507704
+        # read back from the BIGINT it is the loan number that was loaded
+        assert str(compact.loan_number) == record.loan_number
+        assert compact.date_approved == datetime.date(2020, 5, 1)
+        assert compact.term == 24
+        assert compact.servicing_lender_location_id == 19248
+        assert compact.rural_urban_indicator == "U"
+        assert compact.race_code == codes[("race", "Unanswered")]
+        assert compact.shard_id == record.shard_id
+
+    def test_borrower_name_normalized_not_serialized(self):
+        """Test that the normalized name is written to the loan table but left out of responses and exports."""
+        record: PPPLoanDataSchema = PPPLoanDataSchema(**self.SAMPLE_RECORD)
+        assert record.borrower_name_normalized == "sumter coatings inc"
+        assert "borrower_name_normalized" not in record.model_dump()
+        assert "BorrowerNameNormalized" not in record.model_dump(by_alias=True)
+        assert record.extract_element_values(["loan_number", "borrower_name_normalized"]) == ["9547507704", "sumter coatings inc"]
+
+    def test_dumps_loans(self):
+        """Test that encoding a database row gives exactly what FastAPI would return for the validated model."""
+        record: PPPLoanDataSchema = PPPLoanDataSchema(**self.SAMPLE_RECORD)
+        # a row as the database returns it, dates are plain dates
+        row = types.SimpleNamespace(**{
+            name: value.date() if isinstance(value, datetime.datetime) else value
+            for name, value in record.model_dump().items()
+        })
+
+        expected = record.model_dump(mode="json", by_alias=True)
+        encoded = orjson.loads(dumps_loans([row]))
+        assert encoded == [expected]
+        assert list(encoded[0]) == list(expected)
+        assert encoded[0]["DateApproved"] == "2020-05-01T00:00:00"
+
     def test_process_ppploan_data_do_fn(self):
         """Test the process_ppploan_data_do_fn function."""
         record: PPPLoanDataSchema = PPPLoanDataSchema(**self.SAMPLE_RECORD)
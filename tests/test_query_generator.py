@@ -0,0 +1,35 @@
+"""
+This test will test the prompt building in machine_learning_application/query_generator.py without needing OpenAI.
+    - Test that the schema sent with a question only has the columns it is about, and the key columns.
+    - Test that a question matching no column gets the whole schema.
+"""
+from machine_learning_application.query_generator import KEY_COLUMNS, SCHEMA, prune_schema, query_messages, relevant_columns
+
+class TestSchemaPruning:
+    """Test the question-aware column selection for generate_query's prompt."""
+
+    def test_relevant_columns(self):
+        """Test that columns are selected by name, synonym, plural and state name, with their companions."""
+        assert relevant_columns("Which banks serviced the most loans?") == [*KEY_COLUMNS, "servicing_lender_name", "originating_lender"]
+        columns = relevant_columns("How many jobs were reported in Texas?")
+        assert {"jobs_reported", "borrower_state", "borrower_city"} <= set(columns)
+        assert "forgiveness_amount" not in columns
+        assert "naics_code" in relevant_columns("Which industries got the most?")
+        # in table order
+        assert relevant_columns("forgiveness by state") == [
+            "loan_number", "borrower_name", "borrower_name_normalized", "borrower_city", "borrower_state",
+            "current_approval_amount", "servicing_lender_state", "project_state", "originating_lender_state",
+            "forgiveness_amount", "forgiveness_date",
+        ]
+
+    def test_prune_schema(self):
+        """Test that the pruned schema keeps the SCHEMA lines of the selected columns and nothing else."""
+        schema = prune_schema("how many veterans got loans")
+        assert "Table: ppp_loan_data_airflow" in schema
+        assert "veteran TEXT, the veteran status of the borrower" in schema
+        assert "borrower_name_normalized TEXT" in schema
+        assert "payroll_proceed" not in schema
+        assert schema in query_messages("how many veterans got loans")[1]["content"]
+
+        assert relevant_columns("What are the loans for Delta Leasing?") is None
+        assert prune_schema("What are the loans for Delta Leasing?") == SCHEMA
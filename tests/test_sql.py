@@ -0,0 +1,183 @@
+"""
+This test will test the DDL helpers in sql.py without needing a database.
+    - Test that rows are routed to the correct leaf partition for each partition strategy.
+    - Test that the generated DDL declares the partitions and bounds we expect.
+    - Test that the compact storage schema declares its table, dimensions and view.
+    - Test that date_approved is indexed with the requested index method.
+    - Test that the chatbot role can only read the loan table and the rollups.
+"""
+import datetime
+import pytest
+
+from sql import (
+    CreateTempTables,
+    DEFAULT_PARTITION,
+    partition_suffix,
+    partition_table_name,
+)
+
+class TestPartitioning:
+    """Test the partitioning helpers for ppp_loan_data_airflow."""
+
+    def test_partition_suffix_by_date_approved(self):
+        """Test that approval dates map to their monthly partition, out of range dates go to the default partition."""
+        assert partition_suffix("date_approved", datetime.datetime(2020, 5, 1)) == "p2020_05"
+        assert partition_suffix("date_approved", datetime.date(2021, 5, 31)) == "p2021_05"
+        assert partition_suffix("date_approved", datetime.date(2021, 6, 1)) == DEFAULT_PARTITION
+        assert partition_suffix("date_approved", datetime.date(2019, 12, 31)) == DEFAULT_PARTITION
+
+    def test_partition_suffix_by_project_state(self):
+        """Test that project states map to their list partition, unknown or missing states go to the default partition."""
+        assert partition_suffix("project_state", "SC") == "sc"
+        assert partition_suffix("project_state", " ca ") == "ca"
+        assert partition_suffix("project_state", "XX") == DEFAULT_PARTITION
+        assert partition_suffix("project_state", None) == DEFAULT_PARTITION
+        assert partition_suffix("none", "SC") is None
+
+    def test_partition_table_name(self):
+        """Test that a partition suffix resolves to its leaf table name."""
+        assert partition_table_name("ppp_loan_data_airflow", "p2020_05") == "ppp_loan_data_airflow_p2020_05"
+        assert partition_table_name("ppp_loan_data_airflow", None) == "ppp_loan_data_airflow"
+
+    def test_partitioned_ddl(self):
+        """Test that the DDL declares the parent as partitioned and creates every leaf."""
+        sql = CreateTempTables(partition_by="date_approved")._get_sql_template()
+        assert "PARTITION BY RANGE (date_approved)" in sql
+        assert "PRIMARY KEY (id, date_approved)" in sql
+        assert "ppp_loan_data_airflow_p2020_04 PARTITION OF ppp_loan_data_airflow FOR VALUES FROM ('2020-04-01') TO ('2020-05-01')" in sql
+        assert "ppp_loan_data_airflow_p2021_05 PARTITION OF ppp_loan_data_airflow FOR VALUES FROM ('2021-05-01') TO ('2021-06-01')" in sql
+        assert "ppp_loan_data_airflow_default PARTITION OF ppp_loan_data_airflow DEFAULT" in sql
+
+        sql = CreateTempTables(partition_by="project_state")._get_sql_template()
+        assert "PARTITION BY LIST (project_state)" in sql
+        assert "ppp_loan_data_airflow_sc PARTITION OF ppp_loan_data_airflow FOR VALUES IN ('SC')" in sql
+        # no primary key, a unique index per leaf instead
+        assert "PRIMARY KEY (id" not in sql
+        assert "CREATE UNIQUE INDEX IF NOT EXISTS ppp_loan_data_airflow_sc_id_key ON ppp_loan_data_airflow_sc (id);" in sql
+        assert "CREATE UNIQUE INDEX IF NOT EXISTS ppp_loan_data_airflow_default_id_key ON ppp_loan_data_airflow_default (id);" in sql
+
+        sql = CreateTempTables(partition_by="none")._get_sql_template()
+        assert "PARTITION" not in sql
+
+    def test_unknown_partition_strategy(self):
+        """Test that an unknown partition strategy is rejected."""
+        with pytest.raises(ValueError):
+            CreateTempTables(partition_by="borrower_zip")
+
+    def test_loan_shard_key_routes_to_partition(self):
+        """Test that the COPY sink keys loans by (partition, shard) only when the table is partitioned."""
+        from models import PPPLoanDataSchema
+        from utils import WritePPPLoanDataToPostgresAndCSV, construct_template_options
+
+        loan = PPPLoanDataSchema(LoanNumber="9547507704", DateApproved="05/01/2020", BorrowerName="SUMTER COATINGS, INC.", ProjectState="SC")
+        TemplateOptions = construct_template_options()
+
+        options = TemplateOptions(flags=["--num_shards", "4", "--ppp_partition_by", "date_approved"])
+        key, element = WritePPPLoanDataToPostgresAndCSV(options)._loan_shard_key(loan)
+        assert key == ("p2020_05", loan.shard_id % 4)
+        assert element is loan
+
+        options = TemplateOptions(flags=["--num_shards", "4", "--ppp_partition_by", "project_state"])
+        key, _ = WritePPPLoanDataToPostgresAndCSV(options)._loan_shard_key(loan)
+        assert key == ("sc", loan.shard_id % 4)
+
+        options = TemplateOptions(flags=["--num_shards", "4", "--ppp_partition_by", "none"])
+        key, _ = WritePPPLoanDataToPostgresAndCSV(options)._loan_shard_key(loan)
+        assert key == loan.shard_id % 4
+
+class TestStorageSchema:
+    """Test the compact storage schema DDL."""
+
+    def test_compact_ddl(self):
+        """Test that the compact schema creates the narrow table, its dimensions and the decoding view."""
+        sql = CreateTempTables(storage_schema="compact")._get_sql_template()
+        assert "CREATE TABLE IF NOT EXISTS ppp_loan_data_compact" in sql
+        assert "PRIMARY KEY (loan_number)" in sql
+        assert "CREATE TABLE IF NOT EXISTS ppp_lender" in sql
+        assert "CREATE TABLE IF NOT EXISTS ppp_category" in sql
+        assert "CREATE VIEW ppp_loan_data_airflow AS" in sql
+
+        sql = CreateTempTables(storage_schema="compact", partition_by="date_approved")._get_sql_template()
+        assert "PRIMARY KEY (loan_number, date_approved)" in sql
+        assert "ppp_loan_data_compact_p2020_04 PARTITION OF ppp_loan_data_compact" in sql
+
+    def test_compact_load_table(self):
+        """Test that compact loads COPY into the compact table unless --ppp_loan_table names another table."""
+        import apache_beam as beam
+        from apache_beam.pipeline import PipelineVisitor
+        from utils import CopyToPostgresFn, WritePPPLoanDataToPostgresAndCSV, construct_template_options
+
+        TemplateOptions = construct_template_options()
+
+        def loan_copy_table(loan_table: str) -> str:
+            options = TemplateOptions(flags=[
+                "--ppp_storage_schema", "compact",
+                "--ppp_loan_table", loan_table,
+                "--ppp_loan_error_table", "ppp_loan_data_error",
+                "--ppp_loan_data_csv", "/tmp/ppp_loans.csv",
+                "--ppp_loan_error_csv", "/tmp/ppp_errors.csv",
+            ])
+            pipeline = beam.Pipeline(options=options)
+            _ = {
+                "loans": pipeline | "Loans" >> beam.Create([]),
+                "errors": pipeline | "Errors" >> beam.Create([]),
+            } | WritePPPLoanDataToPostgresAndCSV(options)
+
+            tables = {}
+            class CopyTables(PipelineVisitor):
+                def visit_transform(self, node):
+                    if isinstance(getattr(node.transform, "fn", None), CopyToPostgresFn):
+                        tables[node.full_label.rsplit("/", 1)[-1]] = node.transform.fn.table_name.get()
+            pipeline.visit(CopyTables())
+            return tables["Write PPP Loans to Postgres"]
+
+        # ppp_loan_data_airflow is the view over the compact table
+        assert loan_copy_table("ppp_loan_data_airflow") == "ppp_loan_data_compact"
+        assert loan_copy_table("ppp_loan_data_compact_p2020_05_staging") == "ppp_loan_data_compact_p2020_05_staging"
+
+    def test_unknown_storage_schema(self):
+        """Test that an unknown storage schema is rejected."""
+        with pytest.raises(ValueError):
+            CreateTempTables(storage_schema="columnar")
+
+class TestPhysicalLayout:
+    """Test the date index method option."""
+
+    def test_date_index_method(self):
+        """Test that date_approved is indexed with the requested access method."""
+        sql = CreateTempTables(date_index="brin")._get_sql_template()
+        assert "idx_date_approved ON ppp_loan_data_airflow USING brin (date_approved)" in sql
+
+        sql = CreateTempTables(date_index="btree")._get_sql_template()
+        assert "idx_date_approved ON" not in sql
+        assert "idx_date_approved_loan_number ON ppp_loan_data_airflow (date_approved, loan_number)" in sql
+
+        with pytest.raises(ValueError):
+            CreateTempTables(date_index="hash")
+
+    def test_search_indexes(self):
+        """Test that every search filter gets a composite index ending in the keyset order, on the physical table."""
+        sql = CreateTempTables(storage_schema="wide")._get_sql_template()
+        assert "ON ppp_loan_data_airflow (borrower_state, upper(borrower_city), date_approved, loan_number)" in sql
+        assert "ON ppp_loan_data_airflow (left(borrower_zip, 5), date_approved, loan_number)" in sql
+        assert "ON ppp_loan_data_airflow (servicing_lender_name, date_approved, loan_number)" in sql
+
+        sql = CreateTempTables(storage_schema="compact")._get_sql_template()
+        assert "ON ppp_loan_data_compact (borrower_state, date_approved, loan_number)" in sql
+        assert "ON ppp_loan_data_compact (servicing_lender_location_id, date_approved, loan_number)" in sql
+        assert "idx_lender_name ON ppp_lender (name)" in sql
+
+class TestChatRole:
+    """Test the chatbot's read-only role."""
+
+    def test_chat_role_sql(self):
+        """Test that the role can only read the loan table and the rollups, in read only sessions with a statement timeout."""
+        sql = CreateTempTables()._get_chat_role_sql("ppp_chat", "it's", 2.5)
+        assert "CREATE ROLE ppp_chat;" in sql
+        assert "NOSUPERUSER NOCREATEDB NOCREATEROLE NOINHERIT PASSWORD 'it''s'" in sql
+        assert "ALTER ROLE ppp_chat SET default_transaction_read_only = on;" in sql
+        assert "ALTER ROLE ppp_chat SET statement_timeout = '2500ms';" in sql
+        assert "GRANT SELECT ON ppp_loan_data_airflow, ppp_rollup_state, ppp_rollup_servicing_lender," in sql
+
+        with pytest.raises(ValueError):
+            CreateTempTables()._get_chat_role_sql("ppp_chat; DROP TABLE x", "", 10)
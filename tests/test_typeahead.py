@@ -0,0 +1,41 @@
+"""
+This test will test the borrower name typeahead index in typeahead.py without needing a database.
+    - Test that completions start with the (normalized) prefix and come most loans first, ties in name order.
+    - Test that the ranking matches a brute force one over prefixes spanning many index blocks.
+"""
+import random
+
+from typeahead import BorrowerNameIndex
+
+class TestBorrowerNameIndex:
+    """Test the in-memory prefix index behind /loans/suggest."""
+
+    def test_complete(self):
+        """Test that completions match the normalized prefix and are ranked by loan count."""
+        index = BorrowerNameIndex([
+            ("acme corp", "ACME CORP", 3),
+            ("acme tools llc", "Acme Tools, LLC", 7),
+            ("acme", "ACME", 3),
+            ("apex dental", "APEX DENTAL", 10),
+        ])
+        assert len(index) == 4
+        assert index.complete("Acme", 10) == [("Acme Tools, LLC", 7), ("ACME", 3), ("ACME CORP", 3)]
+        assert index.complete("ACME-T", 10) == [("Acme Tools, LLC", 7)]
+        assert index.complete("acme ", 10) == [("Acme Tools, LLC", 7), ("ACME CORP", 3)]
+        assert index.complete("a", 2) == [("APEX DENTAL", 10), ("Acme Tools, LLC", 7)]
+        assert index.complete("b", 10) == []
+        assert index.complete("  ", 10) == []
+
+    def test_ranking_matches_brute_force(self):
+        """Test the block and sparse table lookups against sorting every matching name."""
+        rng = random.Random(7)
+        counts = {}
+        for _ in range(20000):
+            name = " ".join("".join(rng.choice("abc ") for _ in range(rng.randint(1, 8))).split())
+            if name:
+                counts[name] = rng.randint(1, 20)
+        index = BorrowerNameIndex((name, name, count) for name, count in counts.items())
+
+        for prefix in ["a", "b c", "ab", "cab"] + [rng.choice(list(counts))[:3] for _ in range(50)]:
+            expected = sorted((-count, name) for name, count in counts.items() if name.startswith(prefix))[:15]
+            assert index.complete(prefix, 15) == [(name, -count) for count, name in expected]
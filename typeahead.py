@@ -0,0 +1,107 @@
+from array import array
+from bisect import bisect_left
+from heapq import heappop, heappush
+from typing import Iterable, List, Tuple
+
+from utils import normalize
+
+# sorts after every character a borrower name can contain, key + PREFIX_END is past every key starting with key
+PREFIX_END = "\U0010ffff"
+
+class BorrowerNameIndex:
+    """Immutable prefix index of normalized borrower names, ranked by how many loans each name has.
+
+    Names are kept sorted in a flat list (bisect finds the range of names starting with a prefix) and their loan
+    counts in a parallel array. The names are cut in blocks of BLOCK_SIZE, every name knows the best name from
+    its block's start up to it and from it to its block's end, and a sparse table holds the best name of every
+    power of two run of blocks. The best name of a range spanning blocks is then the best of four lookups, however
+    many names the prefix matches, only a range within one block is scanned.
+    """
+
+    BLOCK_SIZE = 64
+
+    def __init__(self, entries: Iterable[Tuple[str, str, int]]) -> None:
+        """
+        Args:
+            entries (Iterable[Tuple[str, str, int]]): (normalized name, display name, loan count) per distinct
+                normalized name. Already sorted input (ORDER BY ... COLLATE "C") is indexed in linear time.
+        """
+        entries = sorted(entries)
+        self.keys: List[str] = [key for key, _, _ in entries]
+        self.labels: List[str] = [label for _, label, _ in entries]
+        self.counts = array("I", (count for _, _, count in entries))
+        del entries
+
+        # best name from the block's start up to each name, and from each name to the block's end
+        size = len(self.keys)
+        self._best_before = array("I", range(size))
+        self._best_after = array("I", range(size))
+        for start in range(0, size, self.BLOCK_SIZE):
+            end = min(start + self.BLOCK_SIZE, size)
+            for i in range(start + 1, end):
+                self._best_before[i] = self._better(self._best_before[i - 1], i)
+            for i in range(end - 2, start - 1, -1):
+                self._best_after[i] = self._better(i, self._best_after[i + 1])
+
+        # level j of the table holds the best name of the 2**j blocks from block i
+        self._table: List[array] = [array("I", self._best_after[::self.BLOCK_SIZE])]
+        width = 1
+        while 2 * width <= len(self._table[0]):
+            previous = self._table[-1]
+            self._table.append(array("I", (
+                self._better(previous[i], previous[i + width]) for i in range(len(previous) - width)
+            )))
+            width *= 2
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _better(self, a: int, b: int) -> int:
+        # the higher count wins, ties go to the name that sorts first
+        return b if self.counts[b] > self.counts[a] else a
+
+    def _best(self, lo: int, hi: int) -> int:
+        """Index of the name with the most loans in keys[lo:hi]."""
+        first_block, last_block = lo // self.BLOCK_SIZE, (hi - 1) // self.BLOCK_SIZE
+        if first_block == last_block:
+            counts = self.counts[lo:hi]
+            return lo + counts.index(max(counts))
+        best = self._best_after[lo]
+        if last_block - first_block > 1:
+            # the whole blocks in between, covered by two overlapping power of two runs
+            first_block, last_block = first_block + 1, last_block - 1
+            level = (last_block - first_block + 1).bit_length() - 1
+            table = self._table[level]
+            best = self._better(best, table[first_block])
+            best = self._better(best, table[last_block - (1 << level) + 1])
+        # combined left to right, so ties go to the first name
+        return self._better(best, self._best_before[hi - 1])
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """Returns up to limit (display name, loan count) of the names starting with prefix, most loans first.
+
+        The prefix is normalized like the stored names, so casing and punctuation don't matter. A trailing space
+        is kept, "acme " only completes to names with a word after "acme".
+        """
+        key = normalize(prefix)
+        if not key or limit <= 0:
+            return []
+        if prefix[-1].isspace():
+            key += " "
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + PREFIX_END, lo)
+        if lo == hi:
+            return []
+
+        # best first expansion: taking the best of a range splits it into the two ranges around it
+        completions = []
+        best = self._best(lo, hi)
+        heap = [(-self.counts[best], best, lo, hi)]
+        while heap and len(completions) < limit:
+            _, best, lo, hi = heappop(heap)
+            completions.append((self.labels[best], self.counts[best]))
+            for sub_lo, sub_hi in ((lo, best), (best + 1, hi)):
+                if sub_lo < sub_hi:
+                    sub_best = self._best(sub_lo, sub_hi)
+                    heappush(heap, (-self.counts[sub_best], sub_best, sub_lo, sub_hi))
+        return completions
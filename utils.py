@@ -10,11 +10,13 @@ import traceback
 
 import datetime as dt
 from enum import Enum
+from operator import attrgetter
 from dataclasses import dataclass
 from typing import (
     Any,
     ClassVar,
     Dict,
+    Iterable,
     List,
     Optional,
     Set,
@@ -26,7 +28,7 @@ from typing import (
 
 import apache_beam as beam
 from apache_beam.metrics import Metrics
-from apache_beam.options.value_provider import ValueProvider
+from apache_beam.options.value_provider import NestedValueProvider, StaticValueProvider, ValueProvider
 from apache_beam.options.pipeline_options import (
     PipelineOptions,
     SetupOptions,
@@ -40,6 +42,17 @@ from pydantic import (
 )
 from typing_extensions import Self
 
+from sql import (
+    CATEGORY_TABLE,
+    COMPACT_LOAN_TABLE,
+    LENDER_TABLE,
+    LOAN_TABLE,
+    LOAD_SORT_KEYS,
+    STORAGE_SCHEMAS,
+    partition_suffix,
+    partition_table_name,
+)
+
 # type checking for circular imports
 if TYPE_CHECKING:
     from models import PPPLoanDataSchema
@@ -104,7 +117,8 @@ class SerializableBaseModel(BaseModel):
         row_values = []
 
         for col in columns:
-            raw_val = element.get(col, "")
+            # columns that aren't dumped (properties the table stores, like borrower_name_normalized) are read off the model
+            raw_val = element[col] if col in element else getattr(self, col, "")
             if col == "element" and isinstance(raw_val, dict):
                 # Convert dictionary to a JSON string and escape it
                 import json
@@ -362,6 +376,7 @@ class WritePPPLoanDataToPostgresAndCSV(beam.PTransform):
             "loan_number",
             "date_approved",
             "borrower_name",
+            "borrower_name_normalized",
             "sba_office_code",
             "processing_method",
             "borrower_address",
@@ -422,23 +437,31 @@ class WritePPPLoanDataToPostgresAndCSV(beam.PTransform):
             "shard_id",
         ]
 
-        loan_header = ",".join(loan_columns)
+        # the CSV holds the validated fields, borrower_name_normalized is only stored for the search index
+        loan_header = ",".join(column for column in loan_columns if column != "borrower_name_normalized")
         error_header = ",".join(error_columns)
 
         # --- Main Data ---
+        loans_to_write = pcoll["loans"]
+        loan_table = self.pipeline_options.ppp_loan_table
+        if self.pipeline_options.ppp_storage_schema == "compact":
+            from models import PPPLoanCompactSchema
+
+            loans_to_write = self._encode_compact(pcoll["loans"])
+            loan_table = NestedValueProvider(self.pipeline_options.ppp_loan_table, compact_loan_table)
+            loan_columns = list(PPPLoanCompactSchema.model_fields)
+
         written_to_postgres = (
-            pcoll["loans"]
-            | "Shard PPP Loans"
-            >> beam.Map(
-                lambda x: (x.shard_id % self.pipeline_options.num_shards.get(), x)
-            )
+            loans_to_write
+            | "Shard PPP Loans" >> beam.Map(self._loan_shard_key)
             | "GroupByShard PPP Loans" >> beam.GroupByKey()
             | "Write PPP Loans to Postgres"
             >> beam.ParDo(
                 CopyToPostgresFn(
                     pipeline_options=self.pipeline_options,
-                    table_name=self.pipeline_options.ppp_loan_table,
+                    table_name=loan_table,
                     columns=loan_columns,
+                    sort_key=self.pipeline_options.ppp_load_sort_key,
                 )
             )
         )
@@ -485,6 +508,76 @@ class WritePPPLoanDataToPostgresAndCSV(beam.PTransform):
 
         return None
 
+    def _encode_compact(self, loans):
+        """Encodes loans for the compact storage schema and writes its lender and category dimensions.
+
+        Category codes are assigned from the sorted distinct values of each categorical column and
+        handed to the encoder as a side input; lenders are deduplicated by location id, keeping the
+        most complete record.
+
+        Returns:
+            PCollection[PPPLoanCompactSchema]: The encoded loans.
+        """
+        category_codes = (
+            loans
+            | "Extract Categories" >> beam.FlatMap(lambda loan: loan.category_values())
+            | "Distinct Categories" >> beam.Distinct()
+            | "Group Categories" >> beam.GroupByKey()
+            | "Assign Category Codes" >> beam.FlatMap(assign_category_codes)
+        )
+        _ = (
+            category_codes
+            | "Key Category Codes" >> beam.Map(lambda code: (0, code))
+            | "Group Category Codes" >> beam.GroupByKey()
+            | "Write Category Codes to Postgres"
+            >> beam.ParDo(
+                CopyToPostgresFn(
+                    pipeline_options=self.pipeline_options,
+                    table_name=StaticValueProvider(str, CATEGORY_TABLE),
+                    columns=["category", "code", "label"],
+                )
+            )
+        )
+
+        _ = (
+            loans
+            | "Extract Lenders" >> beam.FlatMap(lambda loan: [(lender.location_id, lender) for lender in loan.lenders()])
+            | "Deduplicate Lenders" >> beam.CombinePerKey(merge_lenders)
+            | "Shard Lenders"
+            >> beam.Map(
+                lambda x: (x[0] % self.pipeline_options.num_shards.get(), x[1])
+            )
+            | "GroupByShard Lenders" >> beam.GroupByKey()
+            | "Write Lenders to Postgres"
+            >> beam.ParDo(
+                CopyToPostgresFn(
+                    pipeline_options=self.pipeline_options,
+                    table_name=StaticValueProvider(str, LENDER_TABLE),
+                    columns=["location_id", "name", "address", "city", "state", "zip"],
+                )
+            )
+        )
+
+        return loans | "Encode Compact PPP Loans" >> beam.Map(
+            lambda loan, codes: loan.to_compact(codes),
+            beam.pvalue.AsDict(
+                category_codes
+                | "Key Category Codes By Value" >> beam.Map(lambda code: ((code.category, code.label), code.code))
+            ),
+        )
+
+    def _loan_shard_key(self, loan: "PPPLoanDataSchema") -> Tuple[Any, "PPPLoanDataSchema"]:
+        """Keys a loan by shard, prefixed with its leaf partition when the table is partitioned.
+
+        Grouping by (partition, shard) lets each COPY target a single leaf partition directly
+        instead of paying for per-row tuple routing through the parent table.
+        """
+        shard = loan.shard_id % self.pipeline_options.num_shards.get()
+        partition_by = self.pipeline_options.ppp_partition_by.get()
+        if partition_by == "none":
+            return shard, loan
+        return (partition_suffix(partition_by, getattr(loan, partition_by)), shard), loan
+
 class ReadAndMapToPydanticSingle(beam.PTransform):
     def __init__(
         self,
@@ -539,14 +632,21 @@ class CopyToPostgresFn(beam.DoFn):
         pipeline_options (PipelineOptions): Pipeline configuration.
         table_name (str): Target table name.
         columns (List[str]): Column names for the table.
+        sort_key (Optional[ValueProvider]): Attribute each shard is sorted by before COPY so the
+            rows land in the heap in that order, or "none" to keep the shuffle order.
     """
 
     def __init__(
-        self, pipeline_options: PipelineOptions, table_name: Any, columns: List[str]
+        self,
+        pipeline_options: PipelineOptions,
+        table_name: Any,
+        columns: List[str],
+        sort_key: Optional[Any] = None,
     ) -> None:
         self.pipeline_options = pipeline_options
         self.table_name = table_name
         self.columns = columns
+        self.sort_key = sort_key
 
     def setup(self) -> None:
         """Initializes database connection."""
@@ -559,6 +659,9 @@ class CopyToPostgresFn(beam.DoFn):
         self.postgres_num_retries = self.pipeline_options.postgres_num_retries.get()
         self.resolved_table_name = self.table_name.get()
         self.num_shards = self.pipeline_options.num_shards.get()
+        self.resolved_sort_key = self.sort_key.get() if self.sort_key else "none"
+        if self.resolved_sort_key not in LOAD_SORT_KEYS:
+            raise ValueError(f"Unknown load sort key: {self.resolved_sort_key}. Expected one of {LOAD_SORT_KEYS}")
         self._connect()
 
     def _connect(self) -> None:
@@ -581,12 +684,18 @@ class CopyToPostgresFn(beam.DoFn):
         """Writes a batch of elements to PostgreSQL.
 
         Args:
-            element (Tuple[str, List]): Shard ID and list of elements.
+            element (Tuple[Union[int, Tuple[str, int]], List]): Shard ID, or (partition suffix, shard ID)
+                for partitioned tables, and list of elements.
 
         Yields:
             int: Number of rows written or 0 if empty.
         """
-        _, elements = element
+        shard_key, elements = element
+        table_name = self.resolved_table_name
+        if isinstance(shard_key, tuple):
+            table_name = partition_table_name(self.resolved_table_name, shard_key[0])
+        if self.resolved_sort_key != "none":
+            elements = sorted(elements, key=attrgetter(self.resolved_sort_key))
         temp_file_path = f"/tmp/{uuid.uuid4()}.csv"
         rows_written = 0
 
@@ -597,7 +706,7 @@ class CopyToPostgresFn(beam.DoFn):
                 )
                 for element in elements:
                     logging.info(
-                        f"Writing element to {self.resolved_table_name}: {element}"
+                        f"Writing element to {table_name}: {element}"
                     )
                     row_values = element.extract_element_values(self.columns)
                     writer.writerow(row_values)
@@ -612,7 +721,7 @@ class CopyToPostgresFn(beam.DoFn):
                 try:
                     with open(temp_file_path, "r") as temp_file:
                         copy_sql = f"""
-                        COPY {self.resolved_table_name} ({', '.join(self.columns)})
+                        COPY {table_name} ({', '.join(self.columns)})
                         FROM STDIN WITH (FORMAT CSV, DELIMITER ',', QUOTE '"')
                         """
                         self.cursor.copy_expert(copy_sql, temp_file)
@@ -624,7 +733,7 @@ class CopyToPostgresFn(beam.DoFn):
                     attempts += 1
                     if attempts > self.postgres_num_retries:
                         raise RuntimeError(
-                            f"Failed to COPY {rows_written} records into {self.resolved_table_name} "
+                            f"Failed to COPY {rows_written} records into {table_name} "
                             f"after {attempts} attempts: {insert_error}"
                         )
                     time.sleep(self.postgres_retry_delay)
@@ -640,6 +749,41 @@ class CopyToPostgresFn(beam.DoFn):
 ################################################################################
 #                                   HELPERS                                    #
 ################################################################################
+def compact_loan_table(table: Optional[str]) -> str:
+    """Returns the table a compact load COPYs its loans into.
+
+    --ppp_loan_table usually names ppp_loan_data_airflow, which is a view over the compact table in compact mode,
+    so only another table (e.g. a partition staging table) replaces COMPACT_LOAN_TABLE.
+
+    Args:
+        table (Optional[str]): The --ppp_loan_table value.
+
+    Returns:
+        str: The table to COPY into.
+    """
+    if not table or table == LOAN_TABLE:
+        return COMPACT_LOAN_TABLE
+    return table
+
+def assign_category_codes(element: Tuple[str, Iterable[str]]):
+    """Assigns SMALLINT codes (1..n, in sorted label order) to the distinct values of a categorical column.
+
+    Args:
+        element (Tuple[str, Iterable[str]]): Column name and its distinct values.
+
+    Yields:
+        CategoryCodeSchema: One ppp_category row per value.
+    """
+    from models import CategoryCodeSchema  # imported only once code runs
+
+    category, labels = element
+    for code, label in enumerate(sorted(labels), start=1):
+        yield CategoryCodeSchema(category=category, code=code, label=label)
+
+def merge_lenders(lenders):
+    """Combines the records seen for one lender location id into its most complete record."""
+    return max(lenders, key=lambda lender: lender.completeness())
+
 def configure_baselayer_pipeline_options(opts: PipelineOptions) -> None:
     """Mutates `opts` in-place with our standard Dataflow settings."""
     setup_options = opts.view_as(SetupOptions)
@@ -824,6 +968,41 @@ def construct_template_options(additional_args: Optional[List[TemplateOption]] =
                 type=int,
                 help="Number of shards for parallel COPY to Postgres",
             )
+            parser.add_value_provider_argument(
+                "--ppp_partition_by",
+                type=str,
+                default=os.getenv("PPP_PARTITION_BY", "none"),
+                help="Partition strategy for the PPP loan table: none, date_approved (monthly range) or project_state (list)",
+            )
+
+            # Physical layout
+            parser.add_value_provider_argument(
+                "--ppp_load_sort_key",
+                type=str,
+                default=os.getenv("PPP_LOAD_SORT_KEY", "none"),
+                help="Sort each COPY shard by none, date_approved or loan_number so rows are clustered on disk",
+            )
+            parser.add_value_provider_argument(
+                "--ppp_date_index",
+                type=str,
+                default=os.getenv("PPP_DATE_INDEX", "btree"),
+                help="Index method for date_approved: btree or brin (pair brin with --ppp_load_sort_key date_approved)",
+            )
+
+            # Storage layout (shapes the pipeline graph, so it is a plain argument rather than a value provider)
+            parser.add_argument(
+                "--ppp_storage_schema",
+                choices=STORAGE_SCHEMAS,
+                default=os.getenv("PPP_STORAGE_SCHEMA", "wide"),
+                help="wide (one column per CSV column) or compact (narrow types, coded categoricals and a lender dimension)",
+            )
+            # Read-only snapshot for serving without Postgres (written by the launcher after the load)
+            parser.add_argument(
+                "--ppp_snapshot_path",
+                type=str,
+                default=os.getenv("PPP_SNAPSHOT_PATH"),
+                help="Directory to write an Arrow snapshot of the loaded loans to (see snapshot.py), none by default",
+            )
 
     return TemplateOptions
 